@@ -0,0 +1,365 @@
+"""
+Контроль допуска запросов и сброс нагрузки.
+
+Без ограничений перегруженный сервер принимает все запросы в очередь пула потоков, там они ждут
+соединение из исчерпанного пула базы, пока у клиентов не истечёт дедлайн, - и задержка растёт у всех.
+Здесь запрос отклоняется сразу с RESOURCE_EXHAUSTED, пока он ещё ничего не стоит:
+    - maximum_concurrent_rpcs самого gRPC сервера - жёсткий потолок одновременных вызовов;
+    - ограничение одновременных вызовов отдельных методов (ADMISSION_METHOD_LIMITS);
+    - адаптивный порог: по среднему ожиданию соединения из пула, числу ждущих соединение,
+      глубине очереди пула потоков и времени ожидания в ней считается загрузка (1 - порог).
+      Первыми отклоняются массовые операции, затем запись, чтения - только при полной загрузке.
+
+Отклонённый ответ несёт grpc-retry-pushback-ms, клиент с retryPolicy повторяет не раньше этого срока.
+В режиме thread отказ отправляется потоком пула, но базу он не трогает, поэтому очередь быстро рассасывается.
+
+Настройки:
+    GRPC_MAX_CONCURRENT_RPCS  - maximum_concurrent_rpcs сервера, 0 - без ограничения (0)
+    ADMISSION_ENABLED         - адаптивный сброс нагрузки и лимиты методов (1)
+    ADMISSION_METHOD_LIMITS   - лимиты методов: "BulkImport=1,StreamAllTemplates=4" (BulkImport=1)
+    ADMISSION_POOL_WAIT_MS    - среднее ожидание соединения из пула при полной загрузке (100)
+    ADMISSION_POOL_WAITERS    - ждущих соединение из пула при полной загрузке (DB_POOL_SIZE)
+    ADMISSION_QUEUE_DEPTH     - запросов в очереди пула потоков при полной загрузке (GRPC_MAX_WORKERS * 2)
+    ADMISSION_QUEUE_WAIT_MS   - среднее ожидание в очереди пула потоков при полной загрузке (200)
+    ADMISSION_RETRY_AFTER_MS  - через сколько клиенту повторять отклонённый запрос (100)
+"""
+from concurrent import futures
+import threading
+import logging
+import time
+import os
+
+import grpc
+
+import db
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+
+def _parse_limits(value):
+    limits = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        method, _, limit = item.partition("=")
+        limits[method.strip()] = int(limit)
+    return limits
+
+
+max_concurrent_rpcs = int(os.getenv('GRPC_MAX_CONCURRENT_RPCS') or 0) or None
+admission_enabled = (os.getenv('ADMISSION_ENABLED') or '1') not in ('0', 'false', 'no')
+method_limits = _parse_limits(os.getenv('ADMISSION_METHOD_LIMITS') or 'BulkImport=1')
+pool_wait_limit = float(os.getenv('ADMISSION_POOL_WAIT_MS') or 100) / 1000
+pool_waiters_limit = int(os.getenv('ADMISSION_POOL_WAITERS') or max(1, db.pool_size))
+queue_depth_limit = int(os.getenv('ADMISSION_QUEUE_DEPTH') or db.grpc_max_workers * 2)
+queue_wait_limit = float(os.getenv('ADMISSION_QUEUE_WAIT_MS') or 200) / 1000
+retry_after_ms = int(os.getenv('ADMISSION_RETRY_AFTER_MS') or 100)
+
+# классы методов: при какой загрузке их запросы начинают отклоняться
+READ_METHODS = {"GetFeaturesByTemplateId", "GetAllTemplates", "GetAllTemplatesIfModified", "GetTemplatesPage",
+                "SearchTemplates", "SearchFeatures", "FindTemplates", "BatchGetFeaturesByTemplateIds",
+                "GetTemplatesByIds"}
+BULK_METHODS = {"BulkImport", "StreamAllTemplates", "DeleteTemplates", "DeleteFeatures"}
+# Watch ограничен своим числом подписок и базу почти не нагружает
+EXEMPT_METHODS = {"Watch"}
+SHED_LEVELS = {"bulk": 0.5, "write": 0.8, "read": 1.0}
+
+# средние ожидания считаются по окнам такой длины, в секундах
+WINDOW = 0.5
+
+
+
+def MethodClass(method):
+    if method in READ_METHODS:
+        return "read"
+    if method in BULK_METHODS:
+        return "bulk"
+    return "write"
+
+
+
+class AdmissionExecutor(futures.ThreadPoolExecutor):
+    """
+    Пул потоков gRPC сервера, который считает очередь: сколько запросов ждут свободный поток и сколько ждали
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.queued = 0
+        self.started = 0
+        self.wait_seconds_total = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        queued_at = time.perf_counter()
+
+        def run():
+            wait = time.perf_counter() - queued_at
+            with self._stats_lock:
+                self.queued -= 1
+                self.started += 1
+                self.wait_seconds_total += wait
+            return fn(*args, **kwargs)
+
+        with self._stats_lock:
+            self.queued += 1
+        try:
+            return super().submit(run)
+        except Exception:
+            with self._stats_lock:
+                self.queued -= 1
+            raise
+
+
+
+class _WindowAverage:
+    """
+    Среднее за прошлое окно по накопительным счётчикам (сумма, количество)
+    """
+    def __init__(self):
+        self.start = time.monotonic()
+        self.total = 0.0
+        self.count = 0
+        self.value = 0.0
+
+    def Update(self, now, total, count):
+        if now - self.start < WINDOW:
+            return self.value
+        done = count - self.count
+        self.value = (total - self.total) / done if done > 0 else 0.0
+        self.start, self.total, self.count = now, total, count
+        return self.value
+
+
+
+class AdmissionController:
+    """
+    Решает, принимать ли вызов метода. pool_stats - db.PoolStats пула, которым пользуется сервер,
+    executor - AdmissionExecutor сервера в режиме thread
+    """
+    def __init__(self, pool_stats, executor=None, limits=method_limits):
+        self.pool_stats = pool_stats
+        self.executor = executor
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._running = {}
+        self._pool_wait = _WindowAverage()
+        self._queue_wait = _WindowAverage()
+        self.pressure = 0.0
+        self.reason = None
+        self.shed = {}
+        self.admitted = {}
+        self._logged_at = 0.0
+        self._unlogged = 0
+
+    def Pressure(self):
+        """
+        Загрузка сервера (1 - порог, при котором отклоняются даже чтения) и сигнал, который её определил
+        """
+        now = time.monotonic()
+        stats = self.pool_stats
+        with self._lock:
+            pool_wait = self._pool_wait.Update(now, stats.wait_seconds_total, stats.checkouts + stats.timeouts)
+            signals = [
+                (pool_wait / pool_wait_limit, "pool_wait"),
+                (stats.waiting / pool_waiters_limit, "pool_waiters"),
+            ]
+            if self.executor is not None:
+                queue_wait = self._queue_wait.Update(now, self.executor.wait_seconds_total, self.executor.started)
+                signals.append((self.executor.queued / queue_depth_limit, "queue_depth"))
+                signals.append((queue_wait / queue_wait_limit, "queue_wait"))
+            self.pressure, self.reason = max(signals)
+        return self.pressure, self.reason
+
+    def Admit(self, method):
+        """
+        Решение при получении вызова: None - принять, иначе причина отказа
+        """
+        pressure, reason = self.Pressure()
+        if pressure >= SHED_LEVELS[MethodClass(method)]:
+            return reason
+        return None
+
+    def Enter(self, method):
+        """
+        Начало выполнения вызова. False - у метода уже выполняется предельное число вызовов
+        """
+        limit = self.limits.get(method)
+        with self._lock:
+            running = self._running.get(method, 0)
+            if limit is not None and running >= limit:
+                return False
+            self._running[method] = running + 1
+            self.admitted[method] = self.admitted.get(method, 0) + 1
+        return True
+
+    def Leave(self, method):
+        with self._lock:
+            self._running[method] -= 1
+
+    def Shed(self, method, reason):
+        now = time.monotonic()
+        with self._lock:
+            key = (method, reason)
+            self.shed[key] = self.shed.get(key, 0) + 1
+            self._unlogged += 1
+            # под перегрузкой отказов тысячи, в лог - не чаще раза в секунду
+            if now - self._logged_at < 1:
+                return
+            count, self._unlogged, self._logged_at = self._unlogged, 0, now
+        logger.warning(f"Отклонено запросов: {count}, последний {method} ({reason}), загрузка {self.pressure:.2f}")
+
+    def Stats(self):
+        self.Pressure()
+        with self._lock:
+            stats = {
+                "pressure": self.pressure,
+                "shed": dict(self.shed),
+                "admitted": dict(self.admitted),
+                "running": dict(self._running),
+            }
+        if self.executor is not None:
+            stats.update({
+                "queued": self.executor.queued,
+                "queue_started": self.executor.started,
+                "queue_wait_seconds_total": self.executor.wait_seconds_total,
+            })
+        return stats
+
+
+
+# контроллер запущенного в процессе сервера, его читают метрики
+controller = None
+
+
+
+def _reject_details(method, reason):
+    return f"Сервер перегружен ({reason}), повторите {method} позже"
+
+
+
+def _pushback():
+    return (("grpc-retry-pushback-ms", str(retry_after_ms)),)
+
+
+
+class AdmissionInterceptor(grpc.ServerInterceptor):
+    """
+    Интерсептор для grpc.server. Решение по загрузке принимается при получении вызова,
+    лимит метода проверяется, когда вызов получил поток
+    """
+    def __init__(self, controller, service):
+        self.controller = controller
+        self.prefix = f"/{service}/"
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or not handler_call_details.method.startswith(self.prefix):
+            return handler
+        method = handler_call_details.method[len(self.prefix):]
+        if method in EXEMPT_METHODS:
+            return handler
+        controller = self.controller
+        reason = controller.Admit(method)
+
+        def admit(context):
+            rejected = reason
+            if rejected is None and not controller.Enter(method):
+                rejected = "method_limit"
+            if rejected is not None:
+                controller.Shed(method, rejected)
+                context.set_trailing_metadata(_pushback())
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _reject_details(method, rejected))
+
+        def wrap_unary(behavior):
+            def wrapper(request, context):
+                admit(context)
+                try:
+                    return behavior(request, context)
+                finally:
+                    controller.Leave(method)
+            return wrapper
+
+        def wrap_stream(behavior):
+            def wrapper(request, context):
+                admit(context)
+                try:
+                    yield from behavior(request, context)
+                finally:
+                    controller.Leave(method)
+            return wrapper
+
+        return metrics.ReplaceBehavior(handler, wrap_unary, wrap_stream)
+
+
+
+class AsyncAdmissionInterceptor(grpc.aio.ServerInterceptor):
+    """
+    Интерсептор для grpc.aio.server
+    """
+    def __init__(self, controller, service):
+        self.controller = controller
+        self.prefix = f"/{service}/"
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or not handler_call_details.method.startswith(self.prefix):
+            return handler
+        method = handler_call_details.method[len(self.prefix):]
+        if method in EXEMPT_METHODS:
+            return handler
+        controller = self.controller
+        reason = controller.Admit(method)
+
+        async def admit(context):
+            rejected = reason
+            if rejected is None and not controller.Enter(method):
+                rejected = "method_limit"
+            if rejected is not None:
+                controller.Shed(method, rejected)
+                context.set_trailing_metadata(_pushback())
+                await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _reject_details(method, rejected))
+
+        def wrap_unary(behavior):
+            async def wrapper(request, context):
+                await admit(context)
+                try:
+                    return await behavior(request, context)
+                finally:
+                    controller.Leave(method)
+            return wrapper
+
+        def wrap_stream(behavior):
+            async def wrapper(request, context):
+                await admit(context)
+                try:
+                    async for response in behavior(request, context):
+                        yield response
+                finally:
+                    controller.Leave(method)
+            return wrapper
+
+        return metrics.ReplaceBehavior(handler, wrap_unary, wrap_stream)
+
+
+
+def ServerInterceptors(service, executor):
+    """
+    Интерсепторы для grpc.server с пулом потоков executor (AdmissionExecutor)
+    """
+    global controller
+    if not admission_enabled:
+        return []
+    controller = AdmissionController(db.InstrumentedQueuePool.stats, executor)
+    return [AdmissionInterceptor(controller, service)]
+
+
+
+def AsyncServerInterceptors(service):
+    global controller
+    if not admission_enabled:
+        return []
+    controller = AdmissionController(db.InstrumentedAsyncQueuePool.stats)
+    return [AsyncAdmissionInterceptor(controller, service)]
@@ -0,0 +1,290 @@
+"""
+Бенчмарки горячих путей чтения.
+
+Запуск против базы из PSQL_URL (данные создаются с уникальным префиксом и удаляются после замера):
+
+    python bench.py features --sizes 1 10 100 300 1000 --repeat 50
+    python bench.py mapping --rows 10000 50000 --repeat 10
+"""
+import argparse
+import logging
+import statistics
+import time
+import uuid
+
+from sqlalchemy import event, insert
+
+import templates_pb2
+import mapping
+import model
+
+
+# model при импорте включает DEBUG для всего процесса (basicConfig здесь уже ничего не меняет), отладочный вывод пула мешает замерам
+logging.getLogger().setLevel(logging.WARNING)
+
+
+
+class QueryCounter:
+    """
+    Считает количество SQL запросов, отправленных через engine.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+
+#========================================================================================================================
+#                       GetFeaturesByTemplateId
+#========================================================================================================================
+
+
+
+def LegacyGetFeaturesByTemplateId(template_id):
+    """
+    Старая реализация (N+1 запрос) - только для сравнения.
+    """
+    features_dicts = []
+    with model.GetSession() as session:
+        links = session.query(model.FeaturesTemplates).filter(model.FeaturesTemplates.template_id == template_id).all()
+        for link in links:
+            feature = session.query(model.Feature).filter(model.Feature.id == link.feature_id).first()
+            if feature:
+                features_dicts.append({
+                    "id": feature.id,
+                    "name": feature.name,
+                    "feature_type": feature.feature_type,
+                    "link": {
+                        "id": link.id,
+                        "feature_id": link.feature_id,
+                        "template_id": link.template_id,
+                        "value": link.value
+                    }
+                })
+    return features_dicts
+
+
+
+def SeedTemplate(size, prefix):
+    """
+    Создаёт шаблон с size фичами и возвращает его id.
+    """
+    with model.GetSession() as session:
+        template = model.Template(name=f"{prefix}-template-{size}", description="bench")
+        features = [model.Feature(name=f"{prefix}-{size}-{i}", feature_type=i % 2) for i in range(size)]
+        session.add(template)
+        session.add_all(features)
+        session.flush()
+        session.add_all([
+            model.FeaturesTemplates(feature_id=feature.id, template_id=template.id, value=str(i))
+            for i, feature in enumerate(features)
+        ])
+        session.commit()
+        return template.id
+
+
+
+def Cleanup(prefix):
+    with model.GetSession() as session:
+        template_ids = [t.id for t in session.query(model.Template.id).filter(model.Template.name.like(f"{prefix}-%"))]
+        session.query(model.FeaturesTemplates).filter(
+            model.FeaturesTemplates.template_id.in_(template_ids)).delete(synchronize_session=False)
+        session.query(model.Template).filter(model.Template.id.in_(template_ids)).delete(synchronize_session=False)
+        session.query(model.Feature).filter(model.Feature.name.like(f"{prefix}-%")).delete(synchronize_session=False)
+        session.commit()
+
+
+
+def Measure(func, template_id, repeat):
+    timings = []
+    with QueryCounter(model.GetEngine()) as counter:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(template_id)
+            timings.append((time.perf_counter() - start) * 1000)
+    return counter.count // repeat, timings
+
+
+
+def BenchFeatures(sizes, repeat):
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    implementations = [
+        ("legacy", LegacyGetFeaturesByTemplateId),
+        ("join", model.GetFeaturesByTemplateId),
+    ]
+    print(f"{'size':>6} {'impl':>8} {'queries':>8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    try:
+        for size in sizes:
+            template_id = SeedTemplate(size, prefix)
+            for name, func in implementations:
+                func(template_id)  # прогрев
+                queries, timings = Measure(func, template_id, repeat)
+                print(f"{size:>6} {name:>8} {queries:>8} {statistics.median(timings):>9.3f} "
+                      f"{percentile(timings, 95):>9.3f} {max(timings):>9.3f}")
+    finally:
+        Cleanup(prefix)
+
+
+
+#========================================================================================================================
+#                       Строки -> protobuf
+#========================================================================================================================
+
+
+
+def LegacyTemplatesPayload():
+    """
+    Старый GetAllTemplates: ORM объекты, из них словари, из словарей сообщения - только для сравнения.
+    """
+    with model.GetSession() as session:
+        templates = [
+            {"id": template.id, "name": template.name, "description": template.description}
+            for template in session.query(model.Template).all()
+        ]
+    ret_templates = templates_pb2.TemplatesList()
+    for template in templates:
+        ret_templates.items.add(id=template["id"], name=template["name"], description=template["description"])
+    return ret_templates.SerializeToString()
+
+
+
+def LegacyFeaturesPayload(template_id):
+    """
+    Старый GetFeaturesByTemplateId: строки join в словари, из словарей сообщения - только для сравнения.
+    """
+    with model.GetSession() as session:
+        rows = session.query(
+                model.FeaturesTemplates.id,
+                model.FeaturesTemplates.feature_id,
+                model.FeaturesTemplates.template_id,
+                model.FeaturesTemplates.value,
+                model.Feature.id,
+                model.Feature.name,
+                model.Feature.feature_type,
+            ).join(model.Feature, model.Feature.id == model.FeaturesTemplates.feature_id
+            ).filter(model.FeaturesTemplates.template_id == template_id
+            ).order_by(model.FeaturesTemplates.id).all()
+        features = [
+            {
+                "id": feature_id,
+                "name": name,
+                "feature_type": feature_type,
+                "link": {"id": link_id, "feature_id": link_feature_id, "template_id": link_template_id, "value": value},
+            }
+            for link_id, link_feature_id, link_template_id, value, feature_id, name, feature_type in rows
+        ]
+    final_array = templates_pb2.HibridFeatureLinkTemplateList()
+    for feature in features:
+        final_array.items.add(
+            link=feature["link"],
+            feature={"id": feature["id"], "name": feature["name"], "feature_type": feature["feature_type"]},
+        )
+    return final_array.SerializeToString()
+
+
+
+def TemplatesPayload():
+    return mapping.TemplatesPayload(model.GetAllTemplates())
+
+
+
+def FeaturesPayload(template_id):
+    return mapping.FeaturesPayload(model.GetFeaturesByTemplateId(template_id))
+
+
+
+def SeedTemplates(count, prefix):
+    with model.GetSession() as session:
+        session.execute(insert(model.Template), [
+            {"name": f"{prefix}-catalog-{i}", "description": "bench" if i % 2 else None} for i in range(count)
+        ])
+        session.commit()
+
+
+
+def MeasureCpu(func, repeat):
+    """
+    Медианы (процессорное время, полное время) вызова в секундах: процессорное - только этого процесса,
+    без ожидания базы, то есть стоимость сборки строк и ответа
+    """
+    cpu, wall = [], []
+    for _ in range(repeat):
+        start_cpu, start = time.process_time(), time.perf_counter()
+        func()
+        cpu.append(time.process_time() - start_cpu)
+        wall.append(time.perf_counter() - start)
+    return statistics.median(cpu), statistics.median(wall)
+
+
+
+def BenchMapping(sizes, repeat):
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    print(f"{'method':>24} {'rows':>7} {'impl':>7} {'cpu us/row':>11} {'wall us/row':>12} {'bytes':>10}")
+    try:
+        seeded = 0
+        for size in sizes:
+            SeedTemplates(size - seeded, prefix)
+            seeded = size
+            template_id = SeedTemplate(size, prefix)
+            cases = [
+                ("GetAllTemplates", [("legacy", LegacyTemplatesPayload), ("tuples", TemplatesPayload)]),
+                ("GetFeaturesByTemplateId", [
+                    ("legacy", lambda: LegacyFeaturesPayload(template_id)),
+                    ("tuples", lambda: FeaturesPayload(template_id)),
+                ]),
+            ]
+            for method, implementations in cases:
+                payloads = {name: func() for name, func in implementations}  # прогрев
+                if len(set(payloads.values())) != 1:
+                    print(f"{method}: ответы реализаций различаются")
+                rows = len(templates_pb2.TemplatesList.FromString(payloads["tuples"]).items) \
+                    if method == "GetAllTemplates" else size
+                for name, func in implementations:
+                    cpu, wall = MeasureCpu(func, repeat)
+                    print(f"{method:>24} {rows:>7} {name:>7} {cpu / rows * 1e6:>11.2f} "
+                          f"{wall / rows * 1e6:>12.2f} {len(payloads[name]):>10}")
+    finally:
+        Cleanup(prefix)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    features = sub.add_parser("features", help="GetFeaturesByTemplateId: количество запросов и задержка от размера шаблона")
+    features.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 300, 1000])
+    features.add_argument("--repeat", type=int, default=50)
+
+    rows = sub.add_parser("mapping", help="GetAllTemplates и GetFeaturesByTemplateId: стоимость строки от базы до байт ответа")
+    rows.add_argument("--rows", type=int, nargs="+", default=[10000, 50000])
+    rows.add_argument("--repeat", type=int, default=10)
+
+    args = parser.parse_args()
+    model.InitSchema()
+    if args.command == "features":
+        BenchFeatures(args.sizes, args.repeat)
+    elif args.command == "mapping":
+        BenchMapping(args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
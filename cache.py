@@ -0,0 +1,257 @@
+"""
+Кэш готовых (сериализованных) ответов GetFeaturesByTemplateId по id шаблона.
+
+LRU с TTL и ограничением по памяти. Инвалидация точечная: по id шаблона
+(изменения связей, удаление шаблона) и по id фичи (изменение/удаление фичи сбрасывает
+все закэшированные шаблоны, в которых она есть).
+
+Чтение, начатое до сброса, отсекает поколение (BeginLoad). При чтении с реплик (replicas) этого мало:
+начатое после сброса чтение может попасть на реплику, ещё не проигравшую изменение. Поэтому сброс
+помечает шаблон и фичи LSN процесса (fence_clock), а Put отвергает ответ с реплики, не проигравшей метку.
+Меток хранится не больше FENCE_LIMIT, вытесненные поднимают общий нижний порог.
+
+Настройки:
+    FEATURES_CACHE_ENABLED      - 0 выключает кэш (1)
+    FEATURES_CACHE_MAX_ENTRIES  - максимум шаблонов в кэше (10000)
+    FEATURES_CACHE_MAX_BYTES    - максимум памяти под ответы (64 MB)
+    FEATURES_CACHE_TTL          - время жизни записи в секундах (60)
+
+Там же кэш сериализованного GetAllTemplates для текущей версии каталога (см. model.CatalogVersion):
+    CATALOG_CACHE_ENABLED       - 0 выключает кэш (1)
+"""
+from collections import OrderedDict
+import threading
+import time
+import os
+
+
+# примерные накладные расходы на одну запись (ключ, кортеж, узел OrderedDict)
+ENTRY_OVERHEAD = 200
+# меток LSN сброса на шаблоны и на фичи
+FENCE_LIMIT = 10000
+
+
+
+class TemplateFeaturesCache:
+
+    def __init__(self, max_entries, max_bytes, ttl, enabled=True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # template_id -> (payload, feature_ids, expires_at)
+        self._entries = OrderedDict()
+        # feature_id -> {template_id}
+        self._by_feature = {}
+        self._bytes = 0
+        # растёт при каждой инвалидации, см. BeginLoad
+        self._generation = 0
+        # () -> LSN, которым помечаются сбросы; None - чтения только с основной базы, метки не нужны
+        self.fence_clock = None
+        # template_id / feature_id -> LSN последнего сброса, старые вытесняются в _fence_floor
+        self._template_fences = OrderedDict()
+        self._feature_fences = OrderedDict()
+        self._fence_floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.rejected = 0
+
+
+    def Get(self, template_id):
+        """
+        Готовый ответ или None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(template_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] < time.monotonic():
+                self._remove(template_id)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(template_id)
+            self.hits += 1
+            return entry[0]
+
+
+    def BeginLoad(self):
+        """
+        Вызывается до чтения из базы. Если пока читали, что-то инвалидировали,
+        Put с этим токеном ничего не запишет - иначе в кэш мог бы попасть уже устаревший ответ
+        """
+        return self._generation
+
+
+    def Put(self, template_id, payload, feature_ids, token, source_lsn=None):
+        """
+        source_lsn - проигранный LSN реплики, с которой читали (replicas.TrackReads), None - основная база
+        """
+        if not self.enabled:
+            return
+        size = len(payload) + ENTRY_OVERHEAD
+        feature_ids = frozenset(feature_ids)
+        with self._lock:
+            if (token != self._generation or size > self.max_bytes
+                    or (source_lsn is not None and source_lsn < self._fence(template_id, feature_ids))):
+                self.rejected += 1
+                return
+            if template_id in self._entries:
+                self._remove(template_id)
+            self._entries[template_id] = (payload, feature_ids, time.monotonic() + self.ttl)
+            self._bytes += size
+            for feature_id in feature_ids:
+                self._by_feature.setdefault(feature_id, set()).add(template_id)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+
+    def InvalidateTemplate(self, *template_ids):
+        lsn = self._clock()
+        with self._lock:
+            self._generation += 1
+            for template_id in template_ids:
+                self._mark(self._template_fences, template_id, lsn)
+                if template_id in self._entries:
+                    self._remove(template_id)
+                    self.invalidations += 1
+
+
+    def InvalidateFeature(self, feature_id):
+        lsn = self._clock()
+        with self._lock:
+            self._generation += 1
+            self._mark(self._feature_fences, feature_id, lsn)
+            for template_id in self._by_feature.pop(feature_id, ()):
+                if template_id in self._entries:
+                    self._remove(template_id)
+                    self.invalidations += 1
+
+
+    def Clear(self):
+        lsn = self._clock()
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_feature.clear()
+            self._bytes = 0
+            self._template_fences.clear()
+            self._feature_fences.clear()
+            self._fence_floor = max(self._fence_floor, lsn)
+
+
+    def Stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "rejected": self.rejected,
+            }
+
+
+    def _clock(self):
+        return self.fence_clock() if self.fence_clock is not None else 0
+
+
+    def _mark(self, fences, key, lsn):
+        if not lsn:
+            return
+        fences[key] = max(lsn, fences.pop(key, 0))
+        while len(fences) > FENCE_LIMIT:
+            _, evicted = fences.popitem(last=False)
+            self._fence_floor = max(self._fence_floor, evicted)
+
+
+    def _fence(self, template_id, feature_ids):
+        """
+        LSN, который должен проиграть источник ответа шаблона с фичами feature_ids
+        """
+        fence = max(self._fence_floor, self._template_fences.get(template_id, 0))
+        for feature_id in feature_ids:
+            fence = max(fence, self._feature_fences.get(feature_id, 0))
+        return fence
+
+
+    def _remove(self, template_id):
+        payload, feature_ids, _ = self._entries.pop(template_id)
+        self._bytes -= len(payload) + ENTRY_OVERHEAD
+        for feature_id in feature_ids:
+            templates = self._by_feature.get(feature_id)
+            if templates is not None:
+                templates.discard(template_id)
+                if not templates:
+                    del self._by_feature[feature_id]
+
+
+
+class VersionedResponseCache:
+    """
+    Готовый ответ для одной версии данных (например, GetAllTemplates для версии каталога).
+    Хранится только самая новая версия, более старую положить нельзя
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._version = None
+        self._payload = None
+        self.hits = 0
+        self.misses = 0
+
+    def Get(self, version):
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._version != version:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._payload
+
+    def Put(self, version, payload):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._version is None or version >= self._version:
+                self._version = version
+                self._payload = payload
+
+    def Clear(self):
+        with self._lock:
+            self._version = None
+            self._payload = None
+
+    def Stats(self):
+        with self._lock:
+            return {
+                "version": self._version or 0,
+                "bytes": len(self._payload) if self._payload is not None else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+
+features_cache = TemplateFeaturesCache(
+    max_entries=int(os.getenv('FEATURES_CACHE_MAX_ENTRIES') or 10000),
+    max_bytes=int(os.getenv('FEATURES_CACHE_MAX_BYTES') or 64 * 1024 * 1024),
+    ttl=float(os.getenv('FEATURES_CACHE_TTL') or 60),
+    enabled=(os.getenv('FEATURES_CACHE_ENABLED') or '1') not in ('0', 'false', 'no'),
+)
+
+catalog_cache = VersionedResponseCache(
+    enabled=(os.getenv('CATALOG_CACHE_ENABLED') or '1') not in ('0', 'false', 'no'),
+)
@@ -1,16 +1,44 @@
+"""
+Клиент для проверки и нагрузочного тестирования сервиса шаблонов.
+
+    python client.py smoke                                   # один вызов каждого метода
+    python client.py seed --templates 1000 --features 300 --links-per-template 30 --manifest seed.json
+    python client.py load --manifest seed.json --concurrency 32 --duration 30 --json run.json
+    python client.py load --mode async --qps 2000 --mix GetFeaturesByTemplateId=90,CreateLink=10
+
+С --start-server сервер (main.py) запускается локально на --target с базой из --db-url,
+например sqlite:////tmp/load.db, и останавливается после прогона.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
 import grpc
 import templates_pb2
 import templates_pb2_grpc
-import logging
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-grpc_port = '127.0.0.1:50051'
+grpc_port = os.environ.get('GRPC_TARGET') or '127.0.0.1:50051'
 
-def run():
+DEFAULT_MIX = "GetFeaturesByTemplateId=80,GetTemplatesPage=8,GetAllTemplates=2,CreateLink=5,UpdateTemplate=5"
+
+SERVICE = templates_pb2.DESCRIPTOR.services_by_name['Templates']
+
+
+
+def run(target=grpc_port):
     # Создаем канал для связи с сервером
-    with grpc.insecure_channel(grpc_port) as channel:
+    with grpc.insecure_channel(target) as channel:
         # Создаем клиента (stub)
         stub = templates_pb2_grpc.TemplatesStub(channel)
 
@@ -84,6 +112,389 @@ def run():
         except grpc.RpcError as e:
             logger.error(f"GetFeaturesByTemplateId error: {e.details()}")
 
+
+
+#========================================================================================================================
+#                       Синтетические данные
+#========================================================================================================================
+
+
+
+def seed(target, templates, features, links_per_template, manifest=None, random_seed=0):
+    """
+    Загружает синтетический набор данных через BulkImport и возвращает {"template_ids", "feature_ids"}
+    """
+    rng = random.Random(random_seed)
+    tag = uuid.uuid4().hex[:8]
+    links_per_template = min(links_per_template, features)
+
+    def records():
+        for i in range(features):
+            yield templates_pb2.BulkImportRecord(
+                ref=f"f{i}", feature=templates_pb2.FeatureStruct(name=f"load-{tag}-feature-{i}", feature_type=i % 2))
+        for i in range(templates):
+            yield templates_pb2.BulkImportRecord(
+                ref=f"t{i}", template=templates_pb2.TemplateStruct(name=f"load-{tag}-template-{i}", description="load test"))
+            for j in rng.sample(range(features), links_per_template):
+                yield templates_pb2.BulkImportRecord(
+                    link=templates_pb2.BulkLink(template_ref=f"t{i}", feature_ref=f"f{j}", value=str(rng.randint(0, 1000))))
+
+    start = time.perf_counter()
+    with grpc.insecure_channel(target) as channel:
+        summary = templates_pb2_grpc.TemplatesStub(channel).BulkImport(records())
+    elapsed = time.perf_counter() - start
+
+    feature_ids = list(summary.ids[:features])
+    template_ids = []
+    index = features
+    for _ in range(templates):
+        template_ids.append(summary.ids[index])
+        index += 1 + links_per_template
+    logger.info(f"seed: {summary.templates} шаблонов, {summary.features} фич, {summary.links} связей, "
+                f"{len(summary.errors)} ошибок за {elapsed:.2f} s")
+
+    dataset = {"template_ids": [id for id in template_ids if id], "feature_ids": [id for id in feature_ids if id]}
+    if manifest:
+        with open(manifest, "w") as f:
+            json.dump(dataset, f)
+    return dataset
+
+
+
+def discover(target, limit=10000):
+    """
+    Набор id для нагрузки по уже существующим данным, если нет манифеста seed
+    """
+    template_ids, feature_ids = [], set()
+    with grpc.insecure_channel(target) as channel:
+        stub = templates_pb2_grpc.TemplatesStub(channel)
+        cursor = ""
+        while len(template_ids) < limit:
+            page = stub.GetTemplatesPage(templates_pb2.TemplatesPageRequest(page_size=1000, cursor=cursor))
+            template_ids.extend(item.id for item in page.items)
+            cursor = page.next_cursor
+            if not cursor:
+                break
+        for template_id in template_ids[:50]:
+            for item in stub.GetFeaturesByTemplateId(templates_pb2.IdStruct(id=template_id)).items:
+                feature_ids.add(item.feature.id)
+    return {"template_ids": template_ids[:limit], "feature_ids": sorted(feature_ids)}
+
+
+
+def catalog_version(target):
+    with grpc.insecure_channel(target) as channel:
+        stub = templates_pb2_grpc.TemplatesStub(channel)
+        return stub.GetAllTemplatesIfModified(templates_pb2.CatalogVersionRequest()).version
+
+
+
+#========================================================================================================================
+#                       Нагрузка
+#========================================================================================================================
+
+
+
+def make_request(method, dataset, rng):
+    """
+    Запрос для метода method на случайных данных из dataset
+    """
+    template_id = rng.choice(dataset["template_ids"])
+    feature_id = rng.choice(dataset["feature_ids"]) if dataset["feature_ids"] else 0
+    if method == "GetFeaturesByTemplateId":
+        return templates_pb2.IdStruct(id=template_id)
+    if method == "GetAllTemplates":
+        return templates_pb2.Empty()
+    if method == "GetAllTemplatesIfModified":
+        # опрос клиентом, у которого уже есть список: в основном not_modified
+        return templates_pb2.CatalogVersionRequest(known_version=dataset.get("catalog_version", 0))
+    if method == "GetTemplatesPage":
+        return templates_pb2.TemplatesPageRequest(page_size=100)
+    if method == "StreamAllTemplates":
+        return templates_pb2.StreamTemplatesRequest()
+    if method == "CreateLink":
+        return templates_pb2.FeatureLinkTemplateStruct(template_id=template_id, feature_id=feature_id, value=str(rng.random()))
+    if method == "UpdateLink":
+        return templates_pb2.FeatureLinkTemplateStruct(template_id=template_id, feature_id=feature_id, value=str(rng.random()))
+    if method == "UpdateTemplate":
+        return templates_pb2.TemplateStruct(id=template_id, name=f"load-template-{template_id}", description=str(rng.random()))
+    if method == "CreateTemplate":
+        return templates_pb2.TemplateStruct(name=f"load-new-{uuid.uuid4().hex[:8]}", description="load test")
+    raise ValueError(f"Метод {method} не поддерживается в нагрузке")
+
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        method, _, weight = item.partition("=")
+        if method not in SERVICE.methods_by_name:
+            raise ValueError(f"Неизвестный метод: {method}")
+        weights[method] = float(weight or 1)
+    return weights
+
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+
+class Recorder:
+    """
+    Задержки и ошибки по методам
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, method, latency, code=None):
+        with self._lock:
+            self.latencies.setdefault(method, []).append(latency)
+            if code is not None:
+                errors = self.errors.setdefault(method, {})
+                errors[code] = errors.get(code, 0) + 1
+
+    def report(self, duration):
+        rpcs = {}
+        for method in sorted(self.latencies):
+            values = sorted(self.latencies[method])
+            errors = self.errors.get(method, {})
+            rpcs[method] = {
+                "count": len(values),
+                "errors": sum(errors.values()),
+                "error_codes": errors,
+                "throughput": len(values) / duration,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        total = sum(rpc["count"] for rpc in rpcs.values())
+        return {
+            "duration": duration,
+            "total": total,
+            "errors": sum(rpc["errors"] for rpc in rpcs.values()),
+            "throughput": total / duration,
+            "rpcs": rpcs,
+        }
+
+
+
+class Schedule:
+    """
+    Общее расписание отправки для всех воркеров. При заданном qps запросы идут с фиксированным шагом,
+    а задержка считается от запланированного времени отправки, чтобы очередь на клиенте не пряталась
+    """
+    def __init__(self, qps, duration):
+        self.qps = qps
+        self.start = time.perf_counter()
+        self.deadline = self.start + duration
+        self._lock = threading.Lock()
+        self._sent = 0
+
+    def next(self):
+        """
+        Время отправки следующего запроса или None, если прогон закончен
+        """
+        with self._lock:
+            index = self._sent
+            self._sent += 1
+        if not self.qps:
+            now = time.perf_counter()
+            return now if now < self.deadline else None
+        planned = self.start + index / self.qps
+        return planned if planned < self.deadline else None
+
+
+
+def load_sync(target, dataset, mix, concurrency, qps, duration, deadline, recorder):
+    methods, weights = list(mix), list(mix.values())
+    schedule = Schedule(qps, duration)
+
+    def worker(worker_id):
+        rng = random.Random(worker_id)
+        with grpc.insecure_channel(target) as channel:
+            stub = templates_pb2_grpc.TemplatesStub(channel)
+            while True:
+                planned = schedule.next()
+                if planned is None:
+                    return
+                delay = planned - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                method = rng.choices(methods, weights)[0]
+                request = make_request(method, dataset, rng)
+                try:
+                    response = getattr(stub, method)(request, timeout=deadline)
+                    if SERVICE.methods_by_name[method].server_streaming:
+                        for _ in response:
+                            pass
+                    recorder.add(method, time.perf_counter() - planned)
+                except grpc.RpcError as e:
+                    recorder.add(method, time.perf_counter() - planned, e.code().name)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - schedule.start
+
+
+
+async def load_async(target, dataset, mix, concurrency, qps, duration, deadline, recorder):
+    methods, weights = list(mix), list(mix.values())
+    schedule = Schedule(qps, duration)
+
+    async with grpc.aio.insecure_channel(target) as channel:
+        stub = templates_pb2_grpc.TemplatesStub(channel)
+
+        async def worker(worker_id):
+            rng = random.Random(worker_id)
+            while True:
+                planned = schedule.next()
+                if planned is None:
+                    return
+                delay = planned - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                method = rng.choices(methods, weights)[0]
+                request = make_request(method, dataset, rng)
+                try:
+                    call = getattr(stub, method)(request, timeout=deadline)
+                    if SERVICE.methods_by_name[method].server_streaming:
+                        async for _ in call:
+                            pass
+                    else:
+                        await call
+                    recorder.add(method, time.perf_counter() - planned)
+                except grpc.RpcError as e:
+                    recorder.add(method, time.perf_counter() - planned, e.code().name)
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return time.perf_counter() - schedule.start
+
+
+
+def print_report(report):
+    print(f"{'rpc':<26} {'count':>8} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for method, rpc in report["rpcs"].items():
+        print(f"{method:<26} {rpc['count']:>8} {rpc['errors']:>7} {rpc['throughput']:>9.1f} {rpc['p50_ms']:>9.2f} "
+              f"{rpc['p95_ms']:>9.2f} {rpc['p99_ms']:>9.2f} {rpc['max_ms']:>9.2f}")
+    print(f"{'total':<26} {report['total']:>8} {report['errors']:>7} {report['throughput']:>9.1f}")
+
+
+
+#========================================================================================================================
+#                       Локальный сервер
+#========================================================================================================================
+
+
+
+class LocalServer:
+    """
+    main.py в отдельном процессе на время прогона
+    """
+    def __init__(self, target, db_url, extra_env=None):
+        self.target = target
+        self.env = dict(os.environ, GRPC_IPPORT=target, **(extra_env or {}))
+        if db_url:
+            self.env["PSQL_URL"] = db_url
+        self.process = None
+
+    def __enter__(self):
+        main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        self.process = subprocess.Popen([sys.executable, main_py], env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with grpc.insecure_channel(self.target) as channel:
+            grpc.channel_ready_future(channel).result(timeout=30)
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default=grpc_port)
+    parser.add_argument("--start-server", action="store_true", help="запустить main.py локально на --target")
+    parser.add_argument("--db-url", help="PSQL_URL для локального сервера, например sqlite:////tmp/load.db")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="дополнительные переменные окружения локального сервера")
+    sub = parser.add_subparsers(dest="command")
+
+    sub.add_parser("smoke", help="по одному вызову каждого метода")
+
+    seed_parser = sub.add_parser("seed", help="загрузить синтетические данные")
+    load_parser = sub.add_parser("load", help="нагрузка заданной смесью методов")
+    for p in (seed_parser, load_parser):
+        p.add_argument("--templates", type=int, default=1000)
+        p.add_argument("--features", type=int, default=300)
+        p.add_argument("--links-per-template", type=int, default=30)
+        p.add_argument("--manifest", help="json с id загруженных данных")
+    load_parser.add_argument("--seed", action="store_true", help="перед нагрузкой загрузить данные")
+    load_parser.add_argument("--mix", default=DEFAULT_MIX, help="метод=вес через запятую")
+    load_parser.add_argument("--mode", choices=("sync", "async"), default="sync")
+    load_parser.add_argument("--concurrency", type=int, default=16)
+    load_parser.add_argument("--qps", type=float, default=0, help="целевой qps, 0 - без ограничения")
+    load_parser.add_argument("--duration", type=float, default=30)
+    load_parser.add_argument("--deadline", type=float, default=10, help="дедлайн одного запроса, секунды")
+    load_parser.add_argument("--json", help="куда записать результат в json")
+
+    args = parser.parse_args()
+    server_env = dict(item.split("=", 1) for item in args.server_env)
+    server = LocalServer(args.target, args.db_url, server_env) if args.start_server else None
+    if server:
+        server.__enter__()
+    try:
+        if args.command in (None, "smoke"):
+            run(args.target)
+        elif args.command == "seed":
+            seed(args.target, args.templates, args.features, args.links_per_template, args.manifest)
+        elif args.command == "load":
+            logging.getLogger().setLevel(logging.WARNING)
+            if args.seed:
+                dataset = seed(args.target, args.templates, args.features, args.links_per_template, args.manifest)
+            elif args.manifest:
+                with open(args.manifest) as f:
+                    dataset = json.load(f)
+            else:
+                dataset = discover(args.target)
+            if not dataset["template_ids"]:
+                parser.error("нет шаблонов для нагрузки: запустите seed или load --seed")
+
+            mix = parse_mix(args.mix)
+            if "GetAllTemplatesIfModified" in mix:
+                dataset["catalog_version"] = catalog_version(args.target)
+            recorder = Recorder()
+            if args.mode == "async":
+                duration = asyncio.run(load_async(args.target, dataset, mix, args.concurrency, args.qps,
+                                                  args.duration, args.deadline, recorder))
+            else:
+                duration = load_sync(args.target, dataset, mix, args.concurrency, args.qps,
+                                     args.duration, args.deadline, recorder)
+            report = recorder.report(duration)
+            report["config"] = {
+                "target": args.target, "mode": args.mode, "mix": mix, "concurrency": args.concurrency,
+                "qps": args.qps, "duration": args.duration, "templates": len(dataset["template_ids"]),
+                "features": len(dataset["feature_ids"]),
+            }
+            print_report(report)
+            if args.json:
+                with open(args.json, "w") as f:
+                    json.dump(report, f, indent=2)
+    finally:
+        if server:
+            server.__exit__(None, None, None)
+
+
 if __name__ == "__main__":
     logger.info("Running gRPC client")
-    run()
+    main()
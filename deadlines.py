@@ -0,0 +1,126 @@
+"""
+Дедлайны gRPC для запросов к базе.
+
+Интерсептор создаёт db.RequestScope на каждый вызов: оставшееся время (context.time_remaining())
+становится SET LOCAL statement_timeout каждой транзакции RPC, поэтому запрос клиента, который уже
+не ждёт ответа, не держит соединение пула дольше дедлайна. Потолок для всех запросов -
+DB_STATEMENT_TIMEOUT_MS (см. db).
+
+Отмена RPC (клиент отключился, истёк дедлайн):
+    thread - колбэк RPC вызывает cancel() у соединения, на котором идёт запрос;
+    aio    - gRPC отменяет задачу обработчика, asyncpg при этом сам отправляет отмену запроса в базу.
+"""
+import logging
+import time
+
+import grpc
+
+import db
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# time_remaining() без дедлайна возвращает огромное число, всё, что дальше суток, считаем отсутствием дедлайна
+NO_DEADLINE = 24 * 3600
+
+query_cancels = metrics.Counter(
+    "db_query_cancels_total", "Запросы к базе, отменённые вместе с RPC", ("method",))
+
+
+
+def _deadline(context):
+    remaining = context.time_remaining()
+    if remaining is None or remaining > NO_DEADLINE:
+        return None
+    return time.monotonic() + remaining
+
+
+
+class DeadlineInterceptor(grpc.ServerInterceptor):
+    """
+    Интерсептор для grpc.server
+    """
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method.rsplit("/", 1)[-1]
+
+        def begin(context):
+            scope = db.RequestScope(_deadline(context))
+
+            def on_done():
+                # колбэк вызывается и при обычном завершении, тогда обработчик уже вышел
+                if not scope.finished and scope.Cancel():
+                    query_cancels.inc(method)
+                    logger.warning(f"{method}: RPC отменён, запрос к базе прерван")
+            context.add_callback(on_done)
+            return scope, db.current_request.set(scope)
+
+        def end(scope, token):
+            scope.finished = True
+            db.current_request.reset(token)
+
+        def wrap_unary(behavior):
+            def wrapper(request, context):
+                scope, token = begin(context)
+                try:
+                    return behavior(request, context)
+                finally:
+                    end(scope, token)
+            return wrapper
+
+        def wrap_stream(behavior):
+            def wrapper(request, context):
+                scope, token = begin(context)
+                try:
+                    yield from behavior(request, context)
+                finally:
+                    end(scope, token)
+            return wrapper
+
+        return metrics.ReplaceBehavior(handler, wrap_unary, wrap_stream)
+
+
+
+class AsyncDeadlineInterceptor(grpc.aio.ServerInterceptor):
+    """
+    Интерсептор для grpc.aio.server: только statement_timeout, отмену делает сам asyncpg
+    """
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+
+        def wrap_unary(behavior):
+            async def wrapper(request, context):
+                token = db.current_request.set(db.RequestScope(_deadline(context), cancellable=False))
+                try:
+                    return await behavior(request, context)
+                finally:
+                    db.current_request.reset(token)
+            return wrapper
+
+        def wrap_stream(behavior):
+            async def wrapper(request, context):
+                token = db.current_request.set(db.RequestScope(_deadline(context), cancellable=False))
+                try:
+                    async for response in behavior(request, context):
+                        yield response
+                finally:
+                    db.current_request.reset(token)
+            return wrapper
+
+        return metrics.ReplaceBehavior(handler, wrap_unary, wrap_stream)
+
+
+
+def ServerInterceptors():
+    return [DeadlineInterceptor()]
+
+
+
+def AsyncServerInterceptors():
+    return [AsyncDeadlineInterceptor()]
@@ -0,0 +1,325 @@
+"""
+Раздача событий журнала change_events подписчикам Watch внутри процесса.
+
+Один поток на процесс (ChangeListener) слушает LISTEN change_events (с psycopg2) или
+опрашивает таблицу раз в CHANGE_EVENTS_POLL_INTERVAL секунд и складывает новые события в EventBus.
+Подписчики читают из кольцевого буфера шины и ждут новых событий на ней же - база не нагружается
+числом подписчиков. Если подписчик отстал дальше буфера, он дочитывает журнал из базы сам.
+Через шину же сбрасывается кэш GetFeaturesByTemplateId при изменениях из других процессов.
+
+Транзакции пишут журнал без общей блокировки, поэтому событие с меньшим seq может закоммититься позже
+большего. Слушатель публикует события только до первого пропуска в seq: пропуск либо заполнит
+ещё идущая транзакция, либо его оставила откатившаяся. Какой случай, решает не время, а сама база:
+при обнаружении пропуска слушатель берёт новый xid (model.GapHorizon), и когда все транзакции
+с меньшими xid завершились, а пропуск после перечитывания остался, он окончателен - seq пишутся в лог
+и события за ним публикуются. В буфере шины поэтому пропусков нет, а всё, что слушатель прошёл, в базе
+уже не изменится - из базы отставшие подписчики дочитывают только это.
+
+Настройки:
+    CHANGE_EVENTS_BUFFER         - событий в буфере шины (10000)
+    CHANGE_EVENTS_POLL_INTERVAL  - период опроса без LISTEN, в секундах (1)
+    CHANGE_EVENTS_RETENTION      - сколько секунд хранить события в базе, 0 - всегда (7 суток)
+"""
+import threading
+import asyncio
+import logging
+import bisect
+import select
+import time
+import os
+
+import db
+import model
+import replicas
+from cache import features_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+buffer_size = int(os.getenv('CHANGE_EVENTS_BUFFER') or 10000)
+poll_interval = float(os.getenv('CHANGE_EVENTS_POLL_INTERVAL') or 1)
+retention = int(os.getenv('CHANGE_EVENTS_RETENTION') or 7 * 24 * 3600)
+
+# с LISTEN журнал всё равно перечитывается раз в LISTEN_TIMEOUT секунд - на случай потерянного уведомления
+LISTEN_TIMEOUT = 10
+PRUNE_INTERVAL = 600
+FETCH_LIMIT = 1000
+RECONNECT_DELAY = 5
+# как часто проверять, завершились ли транзакции, которые могли взять seq пропуска
+GAP_RECHECK_INTERVAL = 0.05
+
+
+
+class EventBus:
+
+    def __init__(self, size):
+        self.size = size
+        self._cond = threading.Condition()
+        self._events = []
+        self._seqs = []
+        # события с seq <= start_seq в буфере не хранятся
+        self.start_seq = 0
+        self.last_seq = 0
+        self._async_waiters = set()
+        self._subscribers = []
+        self.published = 0
+
+    def Reset(self, last_seq):
+        with self._cond:
+            self._events = []
+            self._seqs = []
+            self.start_seq = self.last_seq = last_seq
+
+    def Subscribe(self, callback):
+        """
+        callback(events) вызывается в потоке слушателя на каждую новую пачку событий
+        """
+        self._subscribers.append(callback)
+
+    def Publish(self, events):
+        with self._cond:
+            self._events.extend(events)
+            self._seqs.extend(event["seq"] for event in events)
+            self.last_seq = self._seqs[-1]
+            self.published += len(events)
+            if len(self._events) > 2 * self.size:
+                drop = len(self._events) - self.size
+                self.start_seq = self._seqs[drop - 1]
+                del self._events[:drop], self._seqs[:drop]
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # event loop подписчика уже закрыт
+                pass
+        for callback in self._subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                logger.exception(e)
+
+    def Since(self, seq, limit=FETCH_LIMIT):
+        """
+        События с seq больше заданного из буфера. None - буфер их уже не хранит, читать из базы
+        """
+        with self._cond:
+            if seq < self.start_seq:
+                return None
+            index = bisect.bisect_right(self._seqs, seq)
+            return self._events[index:index + limit]
+
+    def Wait(self, seq, timeout):
+        """
+        Ждёт событие с seq больше заданного, не дольше timeout секунд
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.last_seq > seq, timeout)
+
+    async def WaitAsync(self, seq, timeout):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            if self.last_seq > seq:
+                return True
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+
+
+bus = EventBus(buffer_size)
+
+
+
+def _invalidate_caches(events):
+    for event in events:
+        if event["entity"] == "feature":
+            features_cache.InvalidateFeature(event["entity_id"])
+        elif event["template_id"]:
+            features_cache.InvalidateTemplate(event["template_id"])
+
+
+bus.Subscribe(_invalidate_caches)
+
+
+
+class ChangeListener(threading.Thread):
+
+    def __init__(self):
+        super().__init__(name="change-events", daemon=True)
+        self._stop_event = threading.Event()
+        self._next_prune = 0
+        # [первый seq пропуска, xid из model.GapHorizon, транзакции до него завершились]
+        self._gap = None
+
+    def Stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                logger.error(f"Слушатель change_events: {e}, переподключение через {RECONNECT_DELAY} с")
+                self._stop_event.wait(RECONNECT_DELAY)
+
+    def _listen(self):
+        connection = None
+        engine = db.GetEngine()
+        if engine.dialect.driver == "psycopg2":
+            # отдельное соединение вне пула: оно занято LISTEN всё время работы процесса
+            connection = engine.raw_connection()
+            listener = connection.driver_connection
+            connection.detach()
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {model.CHANGE_EVENTS_CHANNEL}")
+        try:
+            # всё, что пришло пока слушатель не был подключён
+            retry_in = self._fetch()
+            while not self._stop_event.is_set():
+                if connection is not None:
+                    timeout = LISTEN_TIMEOUT if retry_in is None else min(LISTEN_TIMEOUT, retry_in)
+                    readable, _, _ = select.select([listener], [], [], timeout)
+                    if readable:
+                        listener.poll()
+                        listener.notifies.clear()
+                else:
+                    self._stop_event.wait(poll_interval if retry_in is None else min(poll_interval, retry_in))
+                retry_in = self._fetch()
+                self._prune()
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _fetch(self):
+        """
+        Публикует новые события, возвращает через сколько секунд перечитать задержанные пропуском или None
+        """
+        while True:
+            after_seq = bus.last_seq
+            fetched = model.GetChangeEvents(after_seq, FETCH_LIMIT)
+            events, gap = self._settled(fetched, after_seq)
+            if events:
+                if replicas.Enabled():
+                    # LSN после чтения журнала покрывает фиксации прочитанных событий; до сброса кэшей,
+                    # чтобы метки сброса (cache.fence_clock) были не меньше
+                    replicas.Advance(replicas.PrimaryLsn())
+                bus.Publish(events)
+            if gap:
+                if not self._gap[2]:
+                    return GAP_RECHECK_INTERVAL
+                # транзакции пропуска завершились после чтения: перечитать, зафиксированные уже видны
+            elif len(fetched) < FETCH_LIMIT:
+                return None
+
+    def _settled(self, fetched, after_seq):
+        """
+        (события до первого пропуска в seq, который ещё может заполниться; есть ли такой пропуск)
+        """
+        expected = after_seq + 1
+        for index, event in enumerate(fetched):
+            if event["seq"] != expected and not self._gap_closed(expected, event["seq"]):
+                return fetched[:index], True
+            expected = event["seq"] + 1
+        return fetched, False
+
+    def _gap_closed(self, start, end):
+        """
+        Пропуск seq start..end-1 окончателен: его не заполнили транзакции, завершившиеся
+        ещё до чтения, в котором он снова найден
+        """
+        if self._gap is None or self._gap[0] != start:
+            horizon = model.GapHorizon()
+            self._gap = [start, horizon, horizon is None]
+        elif self._gap[2]:
+            self._gap = None
+            for seq in range(start, end):
+                logger.warning(f"Пропуск в журнале change_events: seq {seq} взяла откатившаяся транзакция")
+            return True
+        if not self._gap[2]:
+            self._gap[2] = model.XactsEndedBefore(self._gap[1])
+        return False
+
+    def _prune(self):
+        if not retention or time.monotonic() < self._next_prune:
+            return
+        self._next_prune = time.monotonic() + PRUNE_INTERVAL
+        removed = model.PruneChangeEvents(retention)
+        if removed:
+            logger.info(f"Удалено старых событий change_events: {removed}")
+
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+
+def Start():
+    """
+    Запускает слушателя журнала в текущем процессе (в многопроцессном режиме - в каждом воркере).
+    Подписчики получают события, появившиеся после запуска, более ранние читаются из базы
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        _, last_seq = model.GetChangeEventsBounds()
+        bus.Reset(last_seq)
+        _listener = ChangeListener()
+        _listener.start()
+        logger.info(f"Слушатель change_events запущен с seq {last_seq}")
+
+
+
+def _passed(events, start_seq):
+    """
+    (события из базы, которые слушатель уже прошёл, позиция подписчика после них). Дальше start_seq
+    подписчик читает буфер шины; если прочитать из базы нечего, он сразу переходит к start_seq
+    """
+    events = [event for event in events if event["seq"] <= start_seq]
+    return events, events[-1]["seq"] if events else start_seq
+
+
+
+def ReadSince(seq, limit=FETCH_LIMIT):
+    """
+    (события после seq, позиция подписчика после них): из буфера шины, а если подписчик отстал дальше
+    буфера - из базы. Пустой список - новых событий нет, ждать их bus.Wait с возвращённой позиции.
+    LookupError - события после seq уже удалены из журнала, подписчику нужно перечитать данные целиком
+    """
+    events = bus.Since(seq, limit)
+    if events is not None:
+        return events, events[-1]["seq"] if events else seq
+    start_seq = bus.start_seq
+    first, _ = model.GetChangeEventsBounds()
+    if first and seq < first - 1:
+        # seq могли пропустить откатившиеся транзакции, поэтому точно проверить нельзя -
+        # считаем журнал неполным, только если самое старое событие новее seq + 1
+        raise LookupError(f"События после seq {seq} уже удалены из журнала, самое старое - {first}")
+    return _passed(model.GetChangeEvents(seq, limit), start_seq)
+
+
+
+async def ReadSinceAsync(seq, limit=FETCH_LIMIT):
+    """
+    ReadSince для grpc.aio: отставший подписчик дочитывает журнал через асинхронный движок
+    """
+    events = bus.Since(seq, limit)
+    if events is not None:
+        return events, events[-1]["seq"] if events else seq
+    import model_async
+    start_seq = bus.start_seq
+    first, _ = await model_async.GetChangeEventsBounds()
+    if first and seq < first - 1:
+        raise LookupError(f"События после seq {seq} уже удалены из журнала, самое старое - {first}")
+    return _passed(await model_async.GetChangeEvents(seq, limit), start_seq)
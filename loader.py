@@ -0,0 +1,212 @@
+"""
+Объединение одиночных запросов по ключу в пачки (как DataLoader).
+
+Вызовы Load(key), пришедшие одновременно из разных RPC, уходят в базу одним запросом load_many(keys) ->
+{key: значение}. Пока других загрузок нет, пачка уходит сразу, без ожидания: одиночный вызов не платит
+за окно. Если загрузка уже идёт, новая пачка собирается в течение DATALOADER_WINDOW_MS (или до
+DATALOADER_MAX_BATCH ключей). Первый вызов пачки выполняет запрос, остальные ждут его результат.
+Ошибка запроса достаётся всем вызовам пачки.
+
+Запрос пачки выполняется в контексте db.BatchContext её вызовов: с самым ранним из их дедлайнов,
+отменяется, только когда отменены все, x-min-lsn - наибольший из вызовов (replicas).
+
+Настройки:
+    DATALOADER_WINDOW_MS  - окно сбора пачки при параллельных загрузках, 0 - не объединять (2)
+    DATALOADER_MAX_BATCH  - ключей в пачке не больше (500)
+"""
+from concurrent import futures
+import contextvars
+import threading
+import asyncio
+import logging
+import os
+
+import db
+
+
+logger = logging.getLogger(__name__)
+
+
+window = float(os.getenv('DATALOADER_WINDOW_MS') or 2) / 1000
+max_batch = int(os.getenv('DATALOADER_MAX_BATCH') or 500)
+
+
+
+class _Batch:
+
+    def __init__(self):
+        self.keys = {}
+        # contextvars.copy_context() вызовов, см. db.BatchContext
+        self.contexts = []
+        self.full = threading.Event()
+
+
+
+class BatchLoader:
+    """
+    Для пула потоков (grpc.server): Load блокирует поток вызова до результата
+    """
+    def __init__(self, name, load_many, window=window, max_batch=max_batch):
+        self.name = name
+        self.load_many = load_many
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._batch = None
+        self._inflight = 0
+        self.batches = 0
+        self.keys = 0
+
+    def Load(self, key):
+        if self.window <= 0:
+            with self._lock:
+                self.batches += 1
+                self.keys += 1
+            return self.load_many([key])[key]
+        leader = False
+        with self._lock:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _Batch()
+                leader = True
+                # без параллельных загрузок ждать в окне некого
+                wait = self.window if self._inflight else 0
+            batch.contexts.append(contextvars.copy_context())
+            future = batch.keys.get(key)
+            if future is None:
+                future = batch.keys[key] = futures.Future()
+                if len(batch.keys) >= self.max_batch:
+                    self._batch = None
+                    batch.full.set()
+        if leader:
+            if wait:
+                batch.full.wait(wait)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+                self._inflight += 1
+            try:
+                context, scope = db.BatchContext(batch.contexts)
+                try:
+                    context.run(self._dispatch, batch.keys)
+                finally:
+                    scope.Close()
+            finally:
+                with self._lock:
+                    self._inflight -= 1
+        return future.result()
+
+    def _dispatch(self, keys):
+        with self._lock:
+            self.batches += 1
+            self.keys += len(keys)
+        try:
+            values = self.load_many(list(keys))
+            for key, future in keys.items():
+                future.set_result(values[key])
+        except Exception as e:
+            # ждущие пачку не должны зависнуть, даже если load_many вернул не все ключи
+            for future in keys.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def Stats(self):
+        return {"batches": self.batches, "keys": self.keys}
+
+
+
+class _AsyncBatch:
+
+    def __init__(self):
+        self.keys = {}
+        self.contexts = []
+        # вызовов, ещё ждущих результат: когда отменены все, задача пачки отменяется
+        self.waiters = 0
+        self.task = None
+
+
+
+class AsyncBatchLoader:
+    """
+    Для grpc.aio: load_many - корутина, пачка выполняется отдельной задачей event loop
+    """
+    def __init__(self, name, load_many, window=window, max_batch=max_batch):
+        self.name = name
+        self.load_many = load_many
+        self.window = window
+        self.max_batch = max_batch
+        self._batch = None
+        self._timer = None
+        self._inflight = 0
+        self.batches = 0
+        self.keys = 0
+
+    async def Load(self, key):
+        if self.window <= 0:
+            self.batches += 1
+            self.keys += 1
+            return (await self.load_many([key]))[key]
+        loop = asyncio.get_running_loop()
+        batch = self._batch
+        if batch is None:
+            batch = self._batch = _AsyncBatch()
+            # без параллельных загрузок - на следующей итерации цикла: к пачке успеют только вызовы этой итерации
+            self._timer = (loop.call_later(self.window, self._flush, batch) if self._inflight
+                           else loop.call_soon(self._flush, batch))
+        batch.contexts.append(contextvars.copy_context())
+        batch.waiters += 1
+        future = batch.keys.get(key)
+        if future is None:
+            future = batch.keys[key] = loop.create_future()
+            if len(batch.keys) >= self.max_batch:
+                self._timer.cancel()
+                self._flush(batch)
+        try:
+            # shield: отмена одного вызова не отменяет общий результат для остальных
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            batch.waiters -= 1
+            if not batch.waiters and batch.task is not None:
+                batch.task.cancel()
+            raise
+
+    def _flush(self, batch):
+        if self._batch is batch:
+            self._batch = self._timer = None
+        if not batch.waiters:
+            return
+        context, scope = db.BatchContext(batch.contexts)
+        self._inflight += 1
+        batch.task = context.run(asyncio.ensure_future, self._dispatch(batch.keys))
+        batch.task.add_done_callback(lambda _: self._finished(scope))
+
+    def _finished(self, scope):
+        self._inflight -= 1
+        scope.Close()
+
+    async def _dispatch(self, keys):
+        self.batches += 1
+        self.keys += len(keys)
+        try:
+            values = await self.load_many(list(keys))
+            for key, future in keys.items():
+                if not future.done():
+                    future.set_result(values[key])
+        except Exception as e:
+            for future in keys.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def Stats(self):
+        return {"batches": self.batches, "keys": self.keys}
+
+
+
+# загрузчики процесса по имени, их читают метрики
+loaders = {}
+
+
+
+def Register(loader):
+    loaders[loader.name] = loader
+    return loader
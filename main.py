@@ -2,9 +2,30 @@ import grpc
 import templates_pb2
 import templates_pb2_grpc
 from grpc_reflection.v1alpha import reflection
-from concurrent import futures
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+from sqlalchemy import exc
+from google.protobuf import message_factory
+import asyncio
+import binascii
+import base64
 import logging
+import signal
+import threading
+import time
+import db
 import model
+import model_async
+import metrics
+import events
+import supervisor
+import admission
+import deadlines
+import search
+import loader
+import writer
+import replicas
+import mapping
+from cache import features_cache, catalog_cache
 import os
 
 
@@ -12,10 +33,58 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 grpc_port = os.environ.get('GRPC_IPPORT') or '0.0.0.0:50051'
+# thread - grpc.server на пуле потоков, aio - grpc.aio с асинхронным движком
+grpc_server_mode = os.environ.get('GRPC_SERVER_MODE') or 'thread'
+
+STREAM_CHUNK_SIZE = 500
+STREAM_MAX_CHUNK_SIZE = 5000
+PAGE_SIZE = 100
+PAGE_MAX_SIZE = 1000
+# id в одном пакетном запросе (Batch*, GetTemplatesByIds, DeleteTemplates, DeleteFeatures) не больше
+batch_max_ids = int(os.environ.get('BATCH_MAX_IDS') or 10000)
+# сколько ждать базу при старте (создание схемы, прогрев пула)
+db_startup_timeout = float(os.environ.get('DB_STARTUP_TIMEOUT') or 60)
+STARTUP_RETRY_DELAY = 0.5
+STARTUP_RETRY_MAX_DELAY = 5.0
+
+# как часто поток Watch без событий проверяет, не отключился ли клиент
+WATCH_POLL_TIMEOUT = 1.0
+
+# в режиме thread каждый Watch занимает поток пула до отключения клиента,
+# поэтому подписок не больше половины потоков, чтобы остальным запросам хватало
+watch_max_streams = int(os.environ.get('WATCH_MAX_STREAMS') or max(1, db.grpc_max_workers // 2))
+watch_slots = threading.BoundedSemaphore(watch_max_streams)
+
+EVENT_ENTITIES = {
+    "template": templates_pb2.ChangeEvent.TEMPLATE,
+    "feature": templates_pb2.ChangeEvent.FEATURE,
+    "link": templates_pb2.ChangeEvent.LINK,
+}
+EVENT_OPS = {
+    "create": templates_pb2.ChangeEvent.CREATE,
+    "update": templates_pb2.ChangeEvent.UPDATE,
+    "delete": templates_pb2.ChangeEvent.DELETE,
+}
 
 
 
 def print_exception_details(e, context):
+    if db.IsQueryCanceled(e):
+        # дедлайн клиента истёк или RPC отменён - это не ошибка сервиса
+        logger.warning(f"Запрос прерван: {e}")
+        context.set_code(grpc.StatusCode.DEADLINE_EXCEEDED)
+        context.set_details(str(e))
+        return
+    if isinstance(e, model.NotFound):
+        logger.warning(f"Не найдено: {e}")
+        context.set_code(grpc.StatusCode.NOT_FOUND)
+        context.set_details(str(e))
+        return
+    if isinstance(e, model.AlreadyExists):
+        logger.warning(f"Уже есть: {e}")
+        context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+        context.set_details(str(e))
+        return
     logger.error(f"Error: {e}")
     logger.exception(e)
     context.set_code(grpc.StatusCode.INTERNAL)
@@ -23,8 +92,424 @@ def print_exception_details(e, context):
 
 
 
-class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
-    
+def encode_cursor(last_id):
+    """
+    Непрозрачный курсор страницы из id последнего отданного шаблона
+    """
+    return base64.urlsafe_b64encode(f"t:{last_id}".encode()).decode()
+
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        prefix, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        if prefix != "t":
+            raise ValueError(cursor)
+        return int(last_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError(f"Некорректный курсор: {cursor}")
+
+
+
+# условий в одном FindTemplates не больше - каждое добавляет подзапрос
+FIND_MAX_PREDICATES = 16
+
+
+
+def feature_predicates(request):
+    """
+    Условия model.FindTemplates из FindTemplatesRequest, ValueError - условий нет или они некорректны
+    """
+    if not request.predicates:
+        raise ValueError("Не заданы условия на фичи")
+    if len(request.predicates) > FIND_MAX_PREDICATES:
+        raise ValueError(f"Условий больше {FIND_MAX_PREDICATES}")
+    predicates = []
+    for item in request.predicates:
+        if not item.feature_id:
+            raise ValueError("Не задан feature_id условия")
+        predicate = {"feature_id": item.feature_id, "range": None}
+        condition = item.WhichOneof("condition")
+        if condition == "range":
+            low = item.range.min if item.range.HasField("min") else None
+            high = item.range.max if item.range.HasField("max") else None
+            if low is not None and high is not None and low > high:
+                raise ValueError(f"Пустой диапазон фичи {item.feature_id}: {low} > {high}")
+            predicate["range"] = (low, high, item.range.overlaps)
+        elif condition == "list":
+            predicate["any_of"] = list(item.list.any_of)
+            predicate["all_of"] = list(item.list.all_of)
+        predicates.append(predicate)
+    return predicates
+
+
+
+def templates_page(templates, last_id):
+    page = templates_pb2.TemplatesPage(
+        next_cursor=encode_cursor(last_id) if last_id is not None else "")
+    mapping.FillTemplates(page.items, templates)
+    return page
+
+
+
+SEARCH_MODES = {
+    templates_pb2.SearchRequest.PREFIX: "prefix",
+    templates_pb2.SearchRequest.SUBSTRING: "substring",
+    templates_pb2.SearchRequest.FUZZY: "fuzzy",
+}
+
+
+
+def search_params(request):
+    """
+    (запрос, режим, лимит) из SearchRequest, ValueError - пустой запрос или неизвестный режим
+    """
+    query = request.query.strip()
+    if not query:
+        raise ValueError("Пустой запрос поиска")
+    if request.mode not in SEARCH_MODES:
+        raise ValueError(f"Неизвестный режим поиска: {request.mode}")
+    return query, SEARCH_MODES[request.mode], min(request.limit or search.DEFAULT_LIMIT, search.max_limit)
+
+
+
+def template_matches(matches):
+    result = templates_pb2.TemplateSearchResult()
+    for match in matches:
+        result.items.add(
+            template={"id": match["id"], "name": match["name"], "description": match["description"]},
+            score=match["score"])
+    return result
+
+
+
+def feature_matches(matches):
+    result = templates_pb2.FeatureSearchResult()
+    for match in matches:
+        result.items.add(
+            feature={"id": match["id"], "name": match["name"], "feature_type": match["feature_type"]},
+            score=match["score"])
+    return result
+
+
+
+def catalog_payload():
+    """
+    (версия каталога, сериализованный TemplatesList). Пока версия не изменилась,
+    список не перечитывается из базы и не сериализуется заново
+    """
+    version = model.GetCatalogVersion()
+    payload = catalog_cache.Get(version)
+    if payload is None:
+        version, templates = model.GetAllTemplatesVersioned()
+        payload = mapping.TemplatesPayload(templates)
+        catalog_cache.Put(version, payload)
+    return version, payload
+
+
+
+async def catalog_payload_async():
+    version = await model_async.GetCatalogVersion()
+    payload = catalog_cache.Get(version)
+    if payload is None:
+        version, templates = await model_async.GetAllTemplatesVersioned()
+        payload = mapping.TemplatesPayload(templates)
+        catalog_cache.Put(version, payload)
+    return version, payload
+
+
+
+def snapshot_response(request, version, payload):
+    """
+    TemplatesSnapshot: not_modified, если у клиента та же версия, иначе готовые байты списка
+    (items - то же поле 1, что и в TemplatesList) плюс версия
+    """
+    if request.known_version == version:
+        return templates_pb2.TemplatesSnapshot(version=version, not_modified=True)
+    return payload + templates_pb2.TemplatesSnapshot(version=version).SerializeToString()
+
+
+
+def batch_ids(request):
+    """
+    id из IdsRequest без повторов в исходном порядке, ValueError - пустой или слишком длинный список
+    """
+    ids = list(dict.fromkeys(request.ids))
+    if not ids:
+        raise ValueError("Не заданы id")
+    if len(ids) > batch_max_ids:
+        raise ValueError(f"Больше {batch_max_ids} id в одном запросе")
+    return ids
+
+
+
+def _varint(value):
+    result = bytearray()
+    while value > 0x7f:
+        result.append(value & 0x7f | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+
+def embedded(field_number, payload):
+    """
+    Поле-сообщение field_number с уже сериализованным payload
+    """
+    return _varint(field_number << 3 | 2) + _varint(len(payload)) + payload
+
+
+
+def cached_features(ids):
+    """
+    ({id: готовый ответ GetFeaturesByTemplateId из кэша}, [id, которых в кэше нет])
+    """
+    if replicas.Behind():
+        return {}, list(ids)
+    payloads = {}
+    misses = []
+    for template_id in ids:
+        payload = features_cache.Get(template_id)
+        if payload is None:
+            misses.append(template_id)
+        else:
+            payloads[template_id] = payload
+    return payloads, misses
+
+
+
+def _built_features(features, found):
+    for template_id, rows in features.items():
+        found[template_id] = (mapping.FeaturesPayload(rows), [row.feature_id for row in rows])
+    return found
+
+
+
+def _sourced(found, sources):
+    return {template_id: (payload, feature_ids, sources.lsn) for template_id, (payload, feature_ids) in found.items()}
+
+
+
+def load_features(ids):
+    """
+    {id шаблона: (готовый ответ GetFeaturesByTemplateId, [id фич], LSN источника)} из базы:
+    при TEMPLATE_SNAPSHOTS - из снимков, шаблоны без снимка - запросом с join.
+    LSN источника - см. replicas.TrackReads
+    """
+    with replicas.TrackReads() as sources:
+        found = model.GetTemplateSnapshots(ids) if model.template_snapshots else {}
+        misses = [template_id for template_id in ids if template_id not in found]
+        if misses:
+            _built_features(model.GetFeaturesByTemplateIds(misses), found)
+    return _sourced(found, sources)
+
+
+
+async def load_features_async(ids):
+    with replicas.TrackReads() as sources:
+        found = await model_async.GetTemplateSnapshots(ids) if model.template_snapshots else {}
+        misses = [template_id for template_id in ids if template_id not in found]
+        if misses:
+            _built_features(await model_async.GetFeaturesByTemplateIds(misses), found)
+    return _sourced(found, sources)
+
+
+
+def put_features(token, found):
+    """
+    Кладёт в кэш ответы из load_features, возвращает {id: ответ}
+    """
+    payloads = {}
+    for template_id, (payload, feature_ids, source_lsn) in found.items():
+        features_cache.Put(template_id, payload, feature_ids, token, source_lsn)
+        payloads[template_id] = payload
+    return payloads
+
+
+
+def batch_features_response(ids, payloads):
+    """
+    BatchFeaturesResult из готовых ответов GetFeaturesByTemplateId: кэшированные байты
+    вкладываются в поле features как есть, без разбора и повторной сериализации
+    """
+    parts = []
+    for template_id in ids:
+        if template_id in payloads:
+            item = templates_pb2.TemplateFeatures(template_id=template_id).SerializeToString()
+            parts.append(embedded(1, item + embedded(2, payloads[template_id])))
+    missing = [template_id for template_id in ids if template_id not in payloads]
+    parts.append(templates_pb2.BatchFeaturesResult(missing_ids=missing).SerializeToString())
+    return b"".join(parts)
+
+
+
+def delete_result(ids, deleted):
+    deleted = set(deleted)
+    return templates_pb2.DeleteResult(
+        deleted_ids=[item for item in ids if item in deleted],
+        missing_ids=[item for item in ids if item not in deleted])
+
+
+
+def templates_by_ids_response(ids, templates):
+    result = templates_pb2.TemplatesByIdsResult(
+        missing_ids=[template_id for template_id in ids if template_id not in templates])
+    mapping.FillTemplates(result.items, [templates[template_id] for template_id in ids if template_id in templates])
+    return result
+
+
+
+# одиночные GetFeaturesByTemplateId без кэша, пришедшие одновременно, читаются из базы одним запросом
+features_loader = loader.Register(loader.BatchLoader("features", load_features))
+features_loader_async = loader.Register(loader.AsyncBatchLoader("features_async", load_features_async))
+
+# CreateLink и UpdateLink, пришедшие одновременно, при WRITE_BATCH_WINDOW_MS > 0 фиксируются одной транзакцией
+create_links_writer = writer.Register(writer.GroupWriter("create_links", model.AddTemplateFeatureLinks))
+update_links_writer = writer.Register(writer.GroupWriter("update_links", model.UpdateTemplateFeaturesLinks))
+create_links_writer_async = writer.Register(
+    writer.AsyncGroupWriter("create_links_async", model_async.AddTemplateFeatureLinks))
+update_links_writer_async = writer.Register(
+    writer.AsyncGroupWriter("update_links_async", model_async.UpdateTemplateFeaturesLinks))
+
+
+
+def events_response(batch):
+    response = templates_pb2.ChangeEventsList(last_seq=batch[-1]["seq"])
+    for event in batch:
+        fields = {
+            "seq": event["seq"],
+            "entity": EVENT_ENTITIES[event["entity"]],
+            "op": EVENT_OPS[event["op"]],
+            "id": event["entity_id"],
+            "template_id": event["template_id"] or 0,
+            "feature_id": event["feature_id"] or 0,
+        }
+        if event["data"]:
+            # поле oneof называется так же, как сущность: template, feature, link
+            data = dict(event["data"], id=event["entity_id"])
+            if event["entity"] == "link":
+                data.update(template_id=fields["template_id"], feature_id=fields["feature_id"])
+            fields[event["entity"]] = data
+        response.items.add(**fields)
+    return response
+
+
+
+def add_bulk_record(index, record, templates, features, links):
+    """
+    Раскладывает запись потока BulkImport по спискам для model.BulkImport
+    """
+    kind = record.WhichOneof("record")
+    if kind == "template":
+        templates.append((index, record.ref, record.template.name, record.template.description))
+    elif kind == "feature":
+        features.append((index, record.ref, record.feature.name, record.feature.feature_type))
+    elif kind == "link":
+        link = record.link
+        links.append((index, link.template_ref, link.feature_ref, link.template_id, link.feature_id, link.value))
+
+
+
+def bulk_summary(count, ids, errors, templates, features, links):
+    summary = templates_pb2.BulkImportSummary(
+        templates=sum(1 for record in templates if record[0] in ids),
+        features=sum(1 for record in features if record[0] in ids),
+        links=sum(1 for record in links if record[0] in ids),
+        ids=[ids.get(index, 0) for index in range(count)],
+    )
+    for index in range(count):
+        if index not in ids:
+            summary.errors.add(index=index, error=errors.get(index, "пустая запись"))
+    return summary
+
+
+
+class ServerIo:
+    """
+    Чем обработчики RPC обращаются к базе и прочему вводу-выводу в своём режиме сервера:
+    синхронные функции для grpc.server или корутины для grpc.aio, с одинаковыми сигнатурами
+    """
+    def __init__(self, model, load_features, features_loader, create_links_writer, update_links_writer,
+                 catalog_payload, search_templates, search_features, collect):
+        self.model = model
+        self.load_features = load_features
+        self.features_loader = features_loader
+        self.create_links_writer = create_links_writer
+        self.update_links_writer = update_links_writer
+        self.catalog_payload = catalog_payload
+        self.search_templates = search_templates
+        self.search_features = search_features
+        # все записи клиентского потока списком
+        self.collect = collect
+
+
+
+async def collect_async(request_iterator):
+    return [record async for record in request_iterator]
+
+
+
+SYNC_IO = ServerIo(model, load_features, features_loader, create_links_writer, update_links_writer,
+                   catalog_payload, search.SearchTemplates, search.SearchFeatures, list)
+ASYNC_IO = ServerIo(model_async, load_features_async, features_loader_async, create_links_writer_async,
+                    update_links_writer_async, catalog_payload_async, search.SearchTemplatesAsync,
+                    search.SearchFeaturesAsync, collect_async)
+
+
+
+def drive(handler):
+    """
+    Выполняет обработчик TemplatesHandlers в потоке: отданное через yield уже вычислено, возвращаем как есть
+    """
+    value = None
+    try:
+        while True:
+            value = handler.send(value)
+    except StopIteration as stop:
+        return stop.value
+
+
+
+async def drive_async(handler):
+    """
+    Выполняет обработчик TemplatesHandlers в event loop: отданное через yield - корутина, её результат
+    или исключение возвращается в обработчик
+    """
+    send, value = handler.send, None
+    while True:
+        try:
+            awaitable = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, send = await awaitable, handler.send
+        except Exception as e:
+            value, send = e, handler.throw
+
+
+
+def acquire_watch_slot(context):
+    """
+    Место для подписки Watch, без места - RESOURCE_EXHAUSTED и False. Предел общий для обоих режимов
+    """
+    if watch_slots.acquire(blocking=False):
+        return True
+    context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+    context.set_details(f"Превышено число подписок Watch: {watch_max_streams}")
+    return False
+
+
+
+class TemplatesHandlers:
+    """
+    Обработчики unary RPC, общие для grpc.server и grpc.aio. Каждый - генератор: обращение к self.io
+    он отдаёт через yield и получает обратно результат. TemplatesServicer выполняет их через drive,
+    AsyncTemplatesServicer - через drive_async. self.io задаёт режим (ServerIo)
+    """
+
 
 
 #========================================================================================================================
@@ -39,7 +524,7 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         """
         logger.info("CreateTemplate request")
         try:
-            id = model.CreateTemplate(request.name, request.description)
+            id = yield self.io.model.CreateTemplate(request.name, request.description)
             return templates_pb2.IdStruct(id=id)
         except Exception as e:
             print_exception_details(e, context)
@@ -53,7 +538,7 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         """
         logger.info("UpdateTemplate request")
         try:
-            model.UpdateTemplate(request.name, request.description, request.id)
+            yield self.io.model.UpdateTemplate(request.name, request.description, request.id)
         except Exception as e:
             print_exception_details(e, context)
         return templates_pb2.Empty()
@@ -66,13 +551,32 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         """
         logger.info("DeleteTemplate request")
         try:
-            model.DeleteTemplate(request.id)
+            yield self.io.model.DeleteTemplate(request.id)
         except Exception as e:
-            print_exception_details(e, context)        
+            print_exception_details(e, context)
         return templates_pb2.Empty()
 
 
 
+    def DeleteTemplates(self, request, context):
+        """
+        Удалить шаблоны вместе со связями
+        """
+        logger.info(f"DeleteTemplates request: {len(request.ids)} ids")
+        try:
+            ids = batch_ids(request)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return templates_pb2.DeleteResult()
+        try:
+            return delete_result(ids, (yield self.io.model.DeleteTemplates(ids)))
+        except Exception as e:
+            print_exception_details(e, context)
+        return templates_pb2.DeleteResult()
+
+
+
 #========================================================================================================================
 #              Links
 #========================================================================================================================
@@ -85,7 +589,11 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         """
         logger.info("CreateLink request")
         try:
-            id = model.AddTemplateFeatureLink(request.feature_id, request.template_id, request.value)
+            link = (request.feature_id, request.template_id, request.value)
+            if self.io.create_links_writer.enabled:
+                id = yield self.io.create_links_writer.Submit(link)
+            else:
+                id = yield self.io.model.AddTemplateFeatureLink(*link)
             return templates_pb2.IdStruct(id=id)
         except Exception as e:
             print_exception_details(e, context)
@@ -99,8 +607,16 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         Редактирование связи
         """
         logger.info("UpdateLink request")
+        if not request.id and not (request.template_id and request.feature_id):
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Связь задаётся id или парой template_id, feature_id")
+            return templates_pb2.Empty()
         try:
-            model.UpdateTemplateFeaturesLink(request.feature_id, request.template_id, request.value)
+            link = (request.id, request.template_id, request.feature_id, request.value)
+            if self.io.update_links_writer.enabled:
+                yield self.io.update_links_writer.Submit(link)
+            else:
+                yield self.io.model.UpdateTemplateFeaturesLink(*link)
         except Exception as e:
             print_exception_details(e, context)
 
@@ -114,8 +630,7 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         """
         logger.info("DeleteLink request")
         try:
-            
-            model.DeleteTemplateFeatureLink(request.feature_id, request.template_id)
+            yield self.io.model.DeleteTemplateFeatureLink(request.feature_id, request.template_id)
         except Exception as e:
             print_exception_details(e, context)
         
@@ -136,7 +651,7 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         logger.info("CreateFeature request")
 
         try:
-            id = model.CreateFeature(request.name, request.feature_type)
+            id = yield self.io.model.CreateFeature(request.name, request.feature_type)
             return templates_pb2.IdStruct(id=id)
         except Exception as e:
             print_exception_details(e, context)
@@ -152,7 +667,7 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         logger.info("UpdateFeature")
 
         try:
-            model.UpdateFeature(request.id, request.name, request.feature_type)
+            yield self.io.model.UpdateFeature(request.id, request.name, request.feature_type)
         except Exception as e:
             print_exception_details(e, context)
 
@@ -166,7 +681,7 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         """
         logger.info("DeleteFeature")
         try:
-            model.DeleteFeature(request.id)
+            yield self.io.model.DeleteFeature(request.id)
         except Exception as e:
             print_exception_details(e, context)
 
@@ -174,6 +689,25 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
 
 
 
+    def DeleteFeatures(self, request, context):
+        """
+        Удаление фич вместе со связями
+        """
+        logger.info(f"DeleteFeatures request: {len(request.ids)} ids")
+        try:
+            ids = batch_ids(request)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return templates_pb2.DeleteResult()
+        try:
+            return delete_result(ids, (yield self.io.model.DeleteFeatures(ids)))
+        except Exception as e:
+            print_exception_details(e, context)
+        return templates_pb2.DeleteResult()
+
+
+
 #========================================================================================================================
 #                       MORE MORE MORE DATA!!!
 #========================================================================================================================
@@ -206,55 +740,63 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         """
         logger.info("GetFeaturesByTemplateId request")
         try:
-            final_array = templates_pb2.HibridFeatureLinkTemplateList()
-            database_result = model.GetFeaturesByTemplateId(request.id)
-
-            for row in database_result:
-                """
-                uint64 id = 1;
-                uint64 feature_id = 2;
-                uint64 template_id = 3;
-                string value = 4;
-
-                {'id': 1, 'name': 'tempor aliquip', 'feature_type': 0, 
-                'link': {'id': 1, 'feature_id': 1, 'template_id': 1, 
-                'value': 'какое то значение в валуе'}}
-
-                
-                "id": feature.id,
-                    "name": feature.name,
-                    "feature_type": feature.feature_type,
-                    "link":{
-                        "id": link.id,
-                        "feature_id": link.feature_id, 
-                        "template_id": link.template_id,
-                        "value": link.value
-                    }
-
-                """
-                temp_link = templates_pb2.FeatureLinkTemplateStruct(
-                        id=row["link"]["id"],
-                        feature_id=row["link"]["feature_id"],
-                        template_id=row["link"]["template_id"],
-                        value=row["link"]["value"]
-                    )
-                """
-                uint64 id = 1;
-                string name = 2;
-                FeatureType feature_type = 3;
-                """
-                temp_feature = templates_pb2.FeatureStruct(
-                        id=row["id"],
-                        feature_type=row["feature_type"],
-                        name=row["name"],
-                    )
-                item = templates_pb2.FeatureLinkTemplate(link=temp_link, feature=temp_feature)
-                final_array.items.append(item)
-
-            return final_array
+            if replicas.Behind():
+                # клиент ждёт изменений, которых кэш и общая пачка загрузчика могут ещё не видеть
+                token = features_cache.BeginLoad()
+                return put_features(token, (yield self.io.load_features([request.id])))[request.id]
+            cached = features_cache.Get(request.id)
+            if cached is not None:
+                return cached
+
+            token = features_cache.BeginLoad()
+            found = yield self.io.features_loader.Load(request.id)
+            return put_features(token, {request.id: found})[request.id]
         except Exception as e:
             print_exception_details(e, context)
         return templates_pb2.HibridFeatureLinkTemplateList()
+
+
+
+    def BatchGetFeaturesByTemplateIds(self, request, context):
+        """
+        Фичи многих шаблонов: кэшированные берутся из кэша, остальные - одним запросом
+        """
+        logger.info(f"BatchGetFeaturesByTemplateIds request: {len(request.ids)} ids")
+        try:
+            ids = batch_ids(request)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return templates_pb2.BatchFeaturesResult()
+        try:
+            existing = yield self.io.model.GetExistingTemplateIds(ids)
+            payloads, misses = cached_features([template_id for template_id in ids if template_id in existing])
+            if misses:
+                token = features_cache.BeginLoad()
+                payloads.update(put_features(token, (yield self.io.load_features(misses))))
+            return batch_features_response(ids, payloads)
+        except Exception as e:
+            print_exception_details(e, context)
+        return templates_pb2.BatchFeaturesResult()
+
+
+
+    def GetTemplatesByIds(self, request, context):
+        """
+        Шаблоны по списку id
+        """
+        logger.info(f"GetTemplatesByIds request: {len(request.ids)} ids")
+        try:
+            ids = batch_ids(request)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return templates_pb2.TemplatesByIdsResult()
+        try:
+            return templates_by_ids_response(ids, (yield self.io.model.GetTemplatesByIds(ids)))
+        except Exception as e:
+            print_exception_details(e, context)
+        return templates_pb2.TemplatesByIdsResult()
     
 
 
@@ -265,16 +807,8 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         """
         logger.info("GetAllTemplates request")
         try:
-            ret_templates = templates_pb2.TemplatesList()
-            templates_result = model.GetAllTemplates()
-
-            for template in templates_result:
-                temp_struct = templates_pb2.TemplateStruct(
-                    id=template["id"],
-                    name = template["name"], 
-                    description = template["description"])
-                ret_templates.items.append(temp_struct)
-            return ret_templates
+            _, payload = yield self.io.catalog_payload()
+            return payload
         
         except Exception as e:
             print_exception_details(e, context)
@@ -282,33 +816,500 @@ class TemplatesServicer(templates_pb2_grpc.TemplatesServicer):
         return templates_pb2.TemplatesList()    
 
 
-    
 
+    def GetAllTemplatesIfModified(self, request, context):
+        """
+        Получение всех шаблонов, только если список изменился после known_version
+        """
+        logger.info(f"GetAllTemplatesIfModified request: known_version={request.known_version}")
+        try:
+            version, payload = yield self.io.catalog_payload()
+            return snapshot_response(request, version, payload)
+        except Exception as e:
+            print_exception_details(e, context)
+
+        return templates_pb2.TemplatesSnapshot()
+
+
+
+    def GetTemplatesPage(self, request, context):
+        """
+        Постраничное получение шаблонов по курсору
+        """
+        logger.info("GetTemplatesPage request")
+        try:
+            after_id = decode_cursor(request.cursor)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return templates_pb2.TemplatesPage()
+
+        page_size = min(request.page_size or PAGE_SIZE, PAGE_MAX_SIZE)
+        try:
+            templates, last_id = yield self.io.model.GetTemplatesPage(after_id, page_size)
+            return templates_page(templates, last_id)
+        except Exception as e:
+            print_exception_details(e, context)
 
+        return templates_pb2.TemplatesPage()
 
 
 
+    def FindTemplates(self, request, context):
+        """
+        Постраничное получение шаблонов, у которых значения фич удовлетворяют условиям
+        """
+        try:
+            predicates = feature_predicates(request)
+            after_id = decode_cursor(request.cursor)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return templates_pb2.TemplatesPage()
+
+        page_size = min(request.page_size or PAGE_SIZE, PAGE_MAX_SIZE)
+        try:
+            return templates_page(*(yield self.io.model.FindTemplates(predicates, after_id, page_size)))
+        except Exception as e:
+            print_exception_details(e, context)
 
+        return templates_pb2.TemplatesPage()
 
 
 
-def serve():
-    try:
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-        templates_pb2_grpc.add_TemplatesServicer_to_server(TemplatesServicer(), server)
-        SERVICE_NAMES = (
-            templates_pb2.DESCRIPTOR.services_by_name['Templates'].full_name,
-            reflection.SERVICE_NAME,
+    def SearchTemplates(self, request, context):
+        """
+        Поиск шаблонов по имени и описанию
+        """
+        try:
+            query, mode, limit = search_params(request)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return templates_pb2.TemplateSearchResult()
+        try:
+            return template_matches((yield self.io.search_templates(query, mode, limit)))
+        except Exception as e:
+            print_exception_details(e, context)
+
+        return templates_pb2.TemplateSearchResult()
+
+
+
+    def SearchFeatures(self, request, context):
+        """
+        Поиск фич по имени
+        """
+        try:
+            query, mode, limit = search_params(request)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return templates_pb2.FeatureSearchResult()
+        try:
+            return feature_matches((yield self.io.search_features(query, mode, limit)))
+        except Exception as e:
+            print_exception_details(e, context)
+
+        return templates_pb2.FeatureSearchResult()
+
+
+
+    def BulkImport(self, request_iterator, context):
+        """
+        Массовая загрузка из клиентского потока записей
+        """
+        logger.info("BulkImport request")
+        templates, features, links = [], [], []
+        count = 0
+        try:
+            for record in (yield self.io.collect(request_iterator)):
+                add_bulk_record(count, record, templates, features, links)
+                count += 1
+            ids, errors = yield self.io.model.BulkImport(templates, features, links)
+            logger.info(f"BulkImport: {count} записей, {len(errors)} ошибок")
+            return bulk_summary(count, ids, errors, templates, features, links)
+        except Exception as e:
+            print_exception_details(e, context)
+
+        return templates_pb2.BulkImportSummary()
+
+
+
+# RPC из TemplatesHandlers; потоковые ответы (StreamAllTemplates, Watch) у каждого режима свои
+HANDLED_RPCS = (
+    "CreateTemplate", "UpdateTemplate", "DeleteTemplate", "DeleteTemplates",
+    "CreateLink", "UpdateLink", "DeleteLink",
+    "CreateFeature", "UpdateFeature", "DeleteFeature", "DeleteFeatures",
+    "GetFeaturesByTemplateId", "BatchGetFeaturesByTemplateIds", "GetTemplatesByIds",
+    "GetAllTemplates", "GetAllTemplatesIfModified", "GetTemplatesPage", "FindTemplates",
+    "SearchTemplates", "SearchFeatures", "BulkImport",
+)
+
+
+
+def _sync_rpc(handler):
+    def rpc(self, request, context):
+        return drive(handler(self, request, context))
+    rpc.__name__ = handler.__name__
+    rpc.__doc__ = handler.__doc__
+    return rpc
+
+
+
+def _async_rpc(handler):
+    async def rpc(self, request, context):
+        return await drive_async(handler(self, request, context))
+    rpc.__name__ = handler.__name__
+    rpc.__doc__ = handler.__doc__
+    return rpc
+
+
+
+class TemplatesServicer(TemplatesHandlers, templates_pb2_grpc.TemplatesServicer):
+    """
+    Для grpc.server на пуле потоков
+    """
+    io = SYNC_IO
+
+
+
+    def StreamAllTemplates(self, request, context):
+        """
+        Потоковое получение всех шаблонов пачками по chunk_size
+        """
+        logger.info("StreamAllTemplates request")
+        chunk_size = min(request.chunk_size or STREAM_CHUNK_SIZE, STREAM_MAX_CHUNK_SIZE)
+        try:
+            for chunk in model.IterTemplates(chunk_size):
+                ret_templates = templates_pb2.TemplatesList()
+                mapping.FillTemplates(ret_templates.items, chunk)
+                yield ret_templates
+        except Exception as e:
+            print_exception_details(e, context)
+
+
+
+    def Watch(self, request, context):
+        """
+        Поток изменений. Первое сообщение - пустая пачка с позицией подписки,
+        дальше пачки событий по мере появления
+        """
+        logger.info(f"Watch request: since_seq={request.since_seq}")
+        if not acquire_watch_slot(context):
+            return
+        try:
+            seq = request.since_seq or events.bus.last_seq
+            yield templates_pb2.ChangeEventsList(last_seq=seq)
+            while context.is_active():
+                batch, seq = events.ReadSince(seq)
+                if batch:
+                    yield events_response(batch)
+                else:
+                    events.bus.Wait(seq, WATCH_POLL_TIMEOUT)
+        except LookupError as e:
+            context.set_code(grpc.StatusCode.OUT_OF_RANGE)
+            context.set_details(str(e))
+        except Exception as e:
+            print_exception_details(e, context)
+        finally:
+            watch_slots.release()
+
+
+
+
+#========================================================================================================================
+#                       asyncio (grpc.aio)
+#========================================================================================================================
+
+
+
+class AsyncTemplatesServicer(TemplatesHandlers, templates_pb2_grpc.TemplatesServicer):
+    """
+    Тот же интерфейс, что и TemplatesServicer, но для grpc.aio и асинхронного движка (model_async)
+    """
+    io = ASYNC_IO
+
+
+
+    async def StreamAllTemplates(self, request, context):
+        logger.info("StreamAllTemplates request")
+        chunk_size = min(request.chunk_size or STREAM_CHUNK_SIZE, STREAM_MAX_CHUNK_SIZE)
+        try:
+            async for chunk in model_async.IterTemplates(chunk_size):
+                ret_templates = templates_pb2.TemplatesList()
+                mapping.FillTemplates(ret_templates.items, chunk)
+                yield ret_templates
+        except Exception as e:
+            print_exception_details(e, context)
+
+
+
+    async def Watch(self, request, context):
+        logger.info(f"Watch request: since_seq={request.since_seq}")
+        if not acquire_watch_slot(context):
+            return
+        try:
+            seq = request.since_seq or events.bus.last_seq
+            yield templates_pb2.ChangeEventsList(last_seq=seq)
+            while True:
+                batch, seq = await events.ReadSinceAsync(seq)
+                if batch:
+                    yield events_response(batch)
+                else:
+                    await events.bus.WaitAsync(seq, WATCH_POLL_TIMEOUT)
+        except LookupError as e:
+            context.set_code(grpc.StatusCode.OUT_OF_RANGE)
+            context.set_details(str(e))
+        except Exception as e:
+            print_exception_details(e, context)
+        finally:
+            watch_slots.release()
+
+
+
+for rpc_name in HANDLED_RPCS:
+    setattr(TemplatesServicer, rpc_name, _sync_rpc(getattr(TemplatesHandlers, rpc_name)))
+    setattr(AsyncTemplatesServicer, rpc_name, _async_rpc(getattr(TemplatesHandlers, rpc_name)))
+
+
+
+
+
+
+
+
+
+TEMPLATES_SERVICE = templates_pb2.DESCRIPTOR.services_by_name['Templates'].full_name
+
+SERVICE_NAMES = (
+    TEMPLATES_SERVICE,
+    health.SERVICE_NAME,
+    reflection.SERVICE_NAME,
+)
+
+
+
+def serialize_response(response):
+    """
+    Ответ может быть уже сериализован (например, взят из кэша) - тогда отдаём байты как есть
+    """
+    if isinstance(response, bytes):
+        return response
+    return response.SerializeToString()
+
+
+
+def add_servicer_to_server(servicer, server):
+    """
+    Аналог templates_pb2_grpc.add_TemplatesServicer_to_server, но с serialize_response,
+    чтобы методы могли возвращать готовые байты
+    """
+    service = templates_pb2.DESCRIPTOR.services_by_name['Templates']
+    handler_factories = {
+        (False, False): grpc.unary_unary_rpc_method_handler,
+        (False, True): grpc.unary_stream_rpc_method_handler,
+        (True, False): grpc.stream_unary_rpc_method_handler,
+        (True, True): grpc.stream_stream_rpc_method_handler,
+    }
+    rpc_method_handlers = {}
+    for method in service.methods:
+        handler_factory = handler_factories[(method.client_streaming, method.server_streaming)]
+        rpc_method_handlers[method.name] = handler_factory(
+            getattr(servicer, method.name),
+            request_deserializer=message_factory.GetMessageClass(method.input_type).FromString,
+            response_serializer=serialize_response,
         )
+    generic_handler = grpc.method_handlers_generic_handler(service.full_name, rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers(service.full_name, rpc_method_handlers)
+
+
+
+def server_options():
+    # несколько процессов-воркеров слушают один порт, соединения между ними распределяет ядро
+    return [("grpc.so_reuseport", 1)] if supervisor.worker_index is not None else []
+
+
+
+def set_health(health_servicer, status):
+    for service in ("", TEMPLATES_SERVICE):
+        health_servicer.set(service, status)
+
+
+
+def wait_for_database(action, description):
+    """
+    Повторяет action, пока база не станет доступна, но не дольше DB_STARTUP_TIMEOUT
+    """
+    deadline = time.monotonic() + db_startup_timeout
+    delay = STARTUP_RETRY_DELAY
+    while True:
+        try:
+            return action()
+        except (exc.OperationalError, OSError) as e:
+            if time.monotonic() + delay > deadline:
+                raise
+            logger.warning(f"{description}: база недоступна ({e}), повтор через {delay:.1f} с")
+            time.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+
+
+
+async def wait_for_database_async(action, description):
+    deadline = time.monotonic() + db_startup_timeout
+    delay = STARTUP_RETRY_DELAY
+    while True:
+        try:
+            return await action()
+        except (exc.OperationalError, OSError) as e:
+            if time.monotonic() + delay > deadline:
+                raise
+            logger.warning(f"{description}: база недоступна ({e}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+
+
+
+def log_dropped_snapshots(removed):
+    if removed:
+        logger.info(f"TEMPLATE_SNAPSHOTS выключены, удалено снимков: {removed}")
+
+
+
+def warmup():
+    """
+    Подготовка процесса к запросам: соединения пула, кэш списка шаблонов, слушатель изменений
+    """
+    start = time.perf_counter()
+    connections = wait_for_database(lambda: db.Prewarm(db.GetEngine()), "Прогрев пула")
+    replicas.Start()
+    if not model.template_snapshots:
+        log_dropped_snapshots(model.DropSnapshots())
+    catalog_payload()
+    events.Start()
+    search.Start()
+    logger.info(f"Прогрев: {connections} соединений, {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+
+async def warmup_async():
+    start = time.perf_counter()
+    connections = await wait_for_database_async(model_async.Prewarm, "Прогрев пула")
+    replicas.Start()
+    if not model.template_snapshots:
+        log_dropped_snapshots(await model_async.DropSnapshots())
+    await catalog_payload_async()
+    events.Start()
+    # индекс поиска в памяти строится через синхронный движок, как и слушатель журнала
+    await asyncio.get_running_loop().run_in_executor(None, search.Start)
+    logger.info(f"Прогрев: {connections} соединений, {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+
+def serve(ready_fd=None):
+    try:
+        executor = admission.AdmissionExecutor(max_workers=db.grpc_max_workers)
+        # метрики снаружи, чтобы отклонённые запросы попали в grpc_server_handled_total
+        server = grpc.server(
+            executor,
+            interceptors=(metrics.ServerInterceptors() + admission.ServerInterceptors(TEMPLATES_SERVICE, executor)
+                          + deadlines.ServerInterceptors() + replicas.ServerInterceptors()),
+            options=server_options(),
+            maximum_concurrent_rpcs=admission.max_concurrent_rpcs)
+        add_servicer_to_server(TemplatesServicer(), server)
+        # пока процесс не прогрет, health отвечает NOT_SERVING и балансировщик не шлёт запросы
+        health_servicer = health.HealthServicer()
+        health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+        set_health(health_servicer, health_pb2.HealthCheckResponse.NOT_SERVING)
 
         reflection.enable_server_reflection(SERVICE_NAMES, server)
         server.add_insecure_port(grpc_port)
         server.start()
+
+        def stop(signum, frame):
+            logger.info(f"Получен {signal.Signals(signum).name}, останавливаем сервер")
+            health_servicer.enter_graceful_shutdown()
+            server.stop(supervisor.shutdown_grace)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        warmup()
+        set_health(health_servicer, health_pb2.HealthCheckResponse.SERVING)
+        supervisor.NotifyReady(ready_fd)
         server.wait_for_termination()
     except Exception as e:
-        logger.error("Error in server:", e)
+        logger.error(f"Error in server: {e}")
+
+
+
+async def serve_aio(ready_fd=None):
+    """
+    Сервер на grpc.aio: все запросы обслуживаются в одном event loop
+    """
+    try:
+        server = grpc.aio.server(
+            interceptors=(metrics.AsyncServerInterceptors() + admission.AsyncServerInterceptors(TEMPLATES_SERVICE)
+                          + deadlines.AsyncServerInterceptors() + replicas.AsyncServerInterceptors()),
+            options=server_options(),
+            maximum_concurrent_rpcs=admission.max_concurrent_rpcs)
+        add_servicer_to_server(AsyncTemplatesServicer(), server)
+        health_servicer = health.aio.HealthServicer()
+        health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+        for service in ("", TEMPLATES_SERVICE):
+            await health_servicer.set(service, health_pb2.HealthCheckResponse.NOT_SERVING)
+
+        reflection.enable_server_reflection(SERVICE_NAMES, server)
+        server.add_insecure_port(grpc_port)
+        await server.start()
+
+        async def stop(signum):
+            logger.info(f"Получен {signal.Signals(signum).name}, останавливаем сервер")
+            await health_servicer.enter_graceful_shutdown()
+            await server.stop(supervisor.shutdown_grace)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, lambda signum=signum: asyncio.ensure_future(stop(signum)))
+
+        await warmup_async()
+        for service in ("", TEMPLATES_SERVICE):
+            await health_servicer.set(service, health_pb2.HealthCheckResponse.SERVING)
+        supervisor.NotifyReady(ready_fd)
+        await server.wait_for_termination()
+    except Exception as e:
+        logger.error(f"Error in server: {e}")
+
+
+
+def run_server(ready_fd=None):
+    if grpc_server_mode == "aio":
+        asyncio.run(serve_aio(ready_fd))
+    else:
+        serve(ready_fd)
+
+
+
+def run_worker(index, ready_fd):
+    """
+    Процесс-воркер многопроцессного режима, запускается сразу после fork
+    """
+    db.AfterFork()
+    logger.info(f"Worker {index} (pid {os.getpid()}): {grpc_server_mode} server on {grpc_port}")
+    if metrics.metrics_enabled:
+        metrics.StartHttpServer(metrics.WorkerAddress(index), reuse_port=True)
+    run_server(ready_fd)
 
 
 if __name__ == "__main__":
-    logger.info(f"Run server on {grpc_port}")
-    serve()
+    if supervisor.supervisor_enabled:
+        logger.info(f"Run {supervisor.processes} x {grpc_server_mode} server on {grpc_port}")
+        # схема готовится один раз до запуска воркеров, её соединения воркерам не достаются
+        wait_for_database(model.InitSchema, "Подготовка схемы")
+        db.Dispose()
+        supervisor.Supervisor(run_worker).Run()
+    else:
+        logger.info(f"Run {grpc_server_mode} server on {grpc_port}")
+        wait_for_database(model.InitSchema, "Подготовка схемы")
+        if metrics.metrics_enabled:
+            metrics.StartHttpServer()
+        run_server()
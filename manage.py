@@ -0,0 +1,37 @@
+"""
+Обслуживание базы без запуска сервера.
+
+    python manage.py rebuild-snapshots [--missing-only]   - пересобрать снимки template_snapshots
+    python manage.py backfill-link-values                 - пересчитать типизированные значения связей
+"""
+import argparse
+import logging
+
+import model
+
+
+# model при импорте включает DEBUG для всего процесса, здесь достаточно хода работы
+logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    snapshots = sub.add_parser("rebuild-snapshots", help="пересобрать снимки шаблонов (починка, включение TEMPLATE_SNAPSHOTS)")
+    snapshots.add_argument("--missing-only", action="store_true", help="только шаблоны без снимка")
+    sub.add_parser("backfill-link-values", help="пересчитать num_min/num_max и link_values всех связей")
+
+    args = parser.parse_args()
+    model.InitSchema()
+    if args.command == "rebuild-snapshots":
+        total = model.RebuildSnapshots(missing_only=args.missing_only)
+        logger.info(f"Снимков пересобрано: {total}")
+    elif args.command == "backfill-link-values":
+        model.BackfillLinkValues()
+
+
+if __name__ == "__main__":
+    main()
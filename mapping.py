@@ -0,0 +1,58 @@
+"""
+Сборка ответов protobuf из строк model.
+
+Отдельно от main, потому что готовые ответы строит и model: снимки template_snapshots
+хранят сериализованный HibridFeatureLinkTemplateList.
+
+Строки - кортежи столбцов model.FEATURE_COLUMNS / model.TEMPLATE_COLUMNS прямо из курсора:
+поля сообщений заполняются из них присваиванием, без ORM объектов, словарей и промежуточных сообщений.
+Замер стоимости на строку: python bench.py mapping
+"""
+import templates_pb2
+
+
+
+def FeaturesResponse(rows):
+    """
+    HibridFeatureLinkTemplateList из строк model.GetFeaturesByTemplateId
+    """
+    final_array = templates_pb2.HibridFeatureLinkTemplateList()
+    add = final_array.items.add
+    for link_id, feature_id, template_id, value, name, feature_type in rows:
+        item = add()
+        link = item.link
+        link.id = link_id
+        link.feature_id = feature_id
+        link.template_id = template_id
+        if value is not None:
+            link.value = value
+        feature = item.feature
+        feature.id = feature_id
+        feature.name = name
+        feature.feature_type = feature_type
+    return final_array
+
+
+
+def FeaturesPayload(rows):
+    return FeaturesResponse(rows).SerializeToString()
+
+
+
+def FillTemplates(items, rows):
+    """
+    Дописывает строки model.TEMPLATE_COLUMNS в repeated TemplateStruct (items ответа)
+    """
+    add = items.add
+    for template_id, name, description in rows:
+        add(id=template_id, name=name, description=description)
+
+
+
+def TemplatesPayload(rows):
+    """
+    Сериализованный TemplatesList из строк model.GetAllTemplates
+    """
+    templates = templates_pb2.TemplatesList()
+    FillTemplates(templates.items, rows)
+    return templates.SerializeToString()
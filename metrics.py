@@ -0,0 +1,549 @@
+"""
+Метрики сервера в формате Prometheus.
+
+По каждому RPC: гистограмма задержки, счётчик статусов, число выполняющихся запросов,
+количество SQL запросов и время внутри базы (остальное время - Python/protobuf).
+Плюс счётчики пула соединений (db.GetPoolStats) и кэша (cache.features_cache).
+
+Отдаются текстом по HTTP на отдельном порту:
+    METRICS_ENABLED  - 0 выключает сбор и HTTP сервер (1)
+    METRICS_IPPORT   - адрес HTTP сервера метрик (127.0.0.1:9095), в многопроцессном режиме порт + номер воркера
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import contextvars
+import threading
+import logging
+import socket
+import bisect
+import time
+import grpc
+import os
+
+
+logger = logging.getLogger(__name__)
+
+metrics_enabled = (os.getenv('METRICS_ENABLED') or '1') not in ('0', 'false', 'no')
+metrics_port = os.getenv('METRICS_IPPORT') or '127.0.0.1:9095'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+
+#========================================================================================================================
+#                       Примитивы
+#========================================================================================================================
+
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+
+class Counter:
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+
+class Gauge(Counter):
+
+    kind = "gauge"
+
+    def dec(self, *labels, value=1):
+        self.inc(*labels, value=-value)
+
+
+
+class Histogram:
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [счётчики по корзинам..., +Inf, сумма]
+        self._values = {}
+        REGISTRY.append(self)
+
+    def observe(self, *labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        for labels, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((self.name + "_bucket", labels + (le,), cumulative))
+            samples.append((self.name + "_count", labels, cumulative))
+            samples.append((self.name + "_sum", labels, counts[-1]))
+        return samples
+
+    def label_names(self, sample_name):
+        return self.labels + ("le",) if sample_name.endswith("_bucket") else self.labels
+
+
+
+REGISTRY = []
+# функции, которые в момент запроса метрик возвращают [(имя, тип, описание, [(метки dict, значение)])]
+COLLECTORS = []
+
+
+
+def RegisterCollector(collector):
+    COLLECTORS.append(collector)
+
+
+
+def Render():
+    """
+    Все метрики в текстовом формате Prometheus
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            names = metric.label_names(name) if isinstance(metric, Histogram) else metric.labels
+            lines.append(f"{name}{_format_labels(names, labels)} {value}")
+    for collector in COLLECTORS:
+        try:
+            families = collector()
+        except Exception as e:
+            logger.error(f"Ошибка сборщика метрик {collector}: {e}")
+            continue
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+
+#========================================================================================================================
+#                       RPC
+#========================================================================================================================
+
+
+
+rpc_latency = Histogram("grpc_server_handling_seconds", "Время обработки RPC", ("method",))
+rpc_handled = Counter("grpc_server_handled_total", "Завершённые RPC по статусам", ("method", "code"))
+rpc_in_flight = Gauge("grpc_server_in_flight", "Выполняющиеся сейчас RPC", ("method",))
+rpc_sql_statements = Counter("grpc_server_sql_statements_total", "SQL запросы, выполненные в RPC", ("method",))
+rpc_db_seconds = Counter("grpc_server_db_seconds_total", "Время внутри базы данных", ("method",))
+rpc_python_seconds = Counter("grpc_server_python_seconds_total", "Время RPC вне базы данных (Python, protobuf)", ("method",))
+
+
+
+class RpcStats:
+    __slots__ = ("statements", "db_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+
+
+
+# статистика текущего RPC; в aio режиме контекст доходит и до greenlet-ов SQLAlchemy
+current_rpc = contextvars.ContextVar("current_rpc", default=None)
+
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_rpc.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+
+if metrics_enabled:
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+
+
+
+def _method_name(handler_call_details):
+    return handler_call_details.method.rsplit("/", 1)[-1]
+
+
+
+def _begin(method):
+    rpc_in_flight.inc(method)
+    stats = RpcStats()
+    return stats, current_rpc.set(stats), time.perf_counter()
+
+
+
+def _end(method, stats, token, start, code):
+    elapsed = time.perf_counter() - start
+    current_rpc.reset(token)
+    rpc_in_flight.dec(method)
+    rpc_latency.observe(method, value=elapsed)
+    rpc_handled.inc(method, code)
+    rpc_sql_statements.inc(method, value=stats.statements)
+    rpc_db_seconds.inc(method, value=stats.db_seconds)
+    rpc_python_seconds.inc(method, value=max(0.0, elapsed - stats.db_seconds))
+
+
+
+def _status(context, error=None):
+    code = context.code()
+    if code is None:
+        code = grpc.StatusCode.UNKNOWN if error is not None else grpc.StatusCode.OK
+    return code.name if isinstance(code, grpc.StatusCode) else str(code)
+
+
+
+HANDLER_FACTORIES = {
+    "unary_unary": grpc.unary_unary_rpc_method_handler,
+    "unary_stream": grpc.unary_stream_rpc_method_handler,
+    "stream_unary": grpc.stream_unary_rpc_method_handler,
+    "stream_stream": grpc.stream_stream_rpc_method_handler,
+}
+
+
+
+def ReplaceBehavior(handler, wrap_unary, wrap_stream):
+    """
+    Копия обработчика с обёрнутым методом сервиса
+    """
+    for kind, factory in HANDLER_FACTORIES.items():
+        behavior = getattr(handler, kind)
+        if behavior is not None:
+            wrapped = wrap_stream(behavior) if handler.response_streaming else wrap_unary(behavior)
+            return factory(wrapped,
+                           request_deserializer=handler.request_deserializer,
+                           response_serializer=handler.response_serializer)
+    return handler
+
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """
+    Интерсептор для grpc.server
+    """
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = _method_name(handler_call_details)
+
+        def wrap_unary(behavior):
+            def wrapper(request, context):
+                stats, token, start = _begin(method)
+                error = None
+                try:
+                    return behavior(request, context)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _end(method, stats, token, start, _status(context, error))
+            return wrapper
+
+        def wrap_stream(behavior):
+            def wrapper(request, context):
+                stats, token, start = _begin(method)
+                error = None
+                try:
+                    yield from behavior(request, context)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _end(method, stats, token, start, _status(context, error))
+            return wrapper
+
+        return ReplaceBehavior(handler, wrap_unary, wrap_stream)
+
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """
+    Интерсептор для grpc.aio.server
+    """
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = _method_name(handler_call_details)
+
+        def wrap_unary(behavior):
+            async def wrapper(request, context):
+                stats, token, start = _begin(method)
+                error = None
+                try:
+                    return await behavior(request, context)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _end(method, stats, token, start, _status(context, error))
+            return wrapper
+
+        def wrap_stream(behavior):
+            async def wrapper(request, context):
+                stats, token, start = _begin(method)
+                error = None
+                try:
+                    async for response in behavior(request, context):
+                        yield response
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _end(method, stats, token, start, _status(context, error))
+            return wrapper
+
+        return ReplaceBehavior(handler, wrap_unary, wrap_stream)
+
+
+
+#========================================================================================================================
+#                       Пул соединений и кэш
+#========================================================================================================================
+
+
+
+def _pool_collector():
+    import db
+    stats = db.GetPoolStats()
+    families = [
+        ("db_pool_checkouts_total", "counter", "Выданные соединения", "checkouts"),
+        ("db_pool_timeouts_total", "counter", "Таймауты ожидания соединения", "timeouts"),
+        ("db_pool_wait_seconds_total", "counter", "Суммарное ожидание соединения", "wait_seconds_total"),
+        ("db_pool_wait_seconds_max", "gauge", "Максимальное ожидание соединения", "wait_seconds_max"),
+        ("db_pool_overflow_checkouts_total", "counter", "Выдачи соединений при переполненном пуле", "overflow_checkouts"),
+        ("db_pool_size", "gauge", "Размер пула", "size"),
+        ("db_pool_checked_out", "gauge", "Занятые соединения", "checked_out"),
+        ("db_pool_overflow", "gauge", "Текущее переполнение пула", "overflow"),
+        ("db_pool_waiting", "gauge", "Ждут соединение из пула", "waiting"),
+    ]
+    for values in stats.values():
+        # QueuePool считает overflow от -pool_size, наружу отдаём только соединения сверх пула
+        values["overflow"] = max(0, values.get("overflow", 0))
+    return [
+        (name, kind, documentation, [({"pool": pool}, values[key]) for pool, values in stats.items() if key in values])
+        for name, kind, documentation, key in families
+    ]
+
+
+
+def _cache_collector():
+    from cache import features_cache, catalog_cache
+    stats = features_cache.Stats()
+    catalog = catalog_cache.Stats()
+    return [
+        ("catalog_cache_version", "gauge", "Версия каталога в кэше GetAllTemplates", [({}, catalog["version"])]),
+        ("catalog_cache_bytes", "gauge", "Размер ответа GetAllTemplates в кэше", [({}, catalog["bytes"])]),
+        ("catalog_cache_hits_total", "counter", "Кэш GetAllTemplates: попадания", [({}, catalog["hits"])]),
+        ("catalog_cache_misses_total", "counter", "Кэш GetAllTemplates: промахи", [({}, catalog["misses"])]),
+    ] + [
+        ("features_cache_entries", "gauge", "Шаблонов в кэше", [({}, stats["entries"])]),
+        ("features_cache_bytes", "gauge", "Память под ответы в кэше", [({}, stats["bytes"])]),
+    ] + [
+        (f"features_cache_{key}_total", "counter", f"Кэш: {key}", [({}, stats[key])])
+        for key in ("hits", "misses", "evictions", "expirations", "invalidations", "rejected")
+    ]
+
+
+
+def _events_collector():
+    import events
+    return [
+        ("change_events_last_seq", "gauge", "Последний seq журнала изменений, полученный процессом", [({}, events.bus.last_seq)]),
+        ("change_events_published_total", "counter", "События, разосланные подписчикам Watch", [({}, events.bus.published)]),
+    ]
+
+
+
+def _admission_collector():
+    import admission
+    if admission.controller is None:
+        return []
+    stats = admission.controller.Stats()
+    families = [
+        ("admission_pressure", "gauge", "Загрузка сервера, 1 - отклоняются и чтения", [({}, stats["pressure"])]),
+        ("grpc_server_shed_total", "counter", "Запросы, отклонённые с RESOURCE_EXHAUSTED",
+         [({"method": method, "reason": reason}, count) for (method, reason), count in stats["shed"].items()]),
+        ("grpc_server_admitted_total", "counter", "Запросы, принятые контролем допуска",
+         [({"method": method}, count) for method, count in stats["admitted"].items()]),
+    ]
+    if "queued" in stats:
+        families += [
+            ("grpc_server_queued", "gauge", "Запросы в очереди пула потоков сервера", [({}, stats["queued"])]),
+            ("grpc_server_queue_wait_seconds_total", "counter", "Суммарное ожидание потока сервера",
+             [({}, stats["queue_wait_seconds_total"])]),
+        ]
+    return families
+
+
+
+def _loader_collector():
+    import loader
+    stats = {name: item.Stats() for name, item in loader.loaders.items()}
+    return [
+        ("dataloader_batches_total", "counter", "Запросы к базе, объединившие одиночные вызовы",
+         [({"loader": name}, values["batches"]) for name, values in stats.items()]),
+        ("dataloader_keys_total", "counter", "Ключи, прочитанные пачками",
+         [({"loader": name}, values["keys"]) for name, values in stats.items()]),
+    ]
+
+
+
+def _writer_collector():
+    import writer
+    stats = {name: item.Stats() for name, item in writer.writers.items()}
+    return [
+        ("write_batches_total", "counter", "Транзакции групповой записи",
+         [({"writer": name}, values["batches"]) for name, values in stats.items()]),
+        ("write_batch_ops_total", "counter", "Записи, зафиксированные пачками",
+         [({"writer": name}, values["ops"]) for name, values in stats.items()]),
+    ]
+
+
+
+def _replica_collector():
+    import replicas
+    if not replicas.Enabled():
+        return []
+    return [
+        ("db_replica_healthy", "gauge", "Реплика в круге чтения",
+         [({"replica": replica.name}, int(replica.healthy)) for replica in replicas.replicas]),
+        ("db_replica_lag_bytes", "gauge", "Отставание реплики от известного процессу LSN основной базы",
+         [({"replica": replica.name}, max(0, replicas.known_lsn - replica.replay_lsn))
+          for replica in replicas.replicas if replica.replay_lsn]),
+        ("db_read_sessions_total", "counter", "Сессии чтения по базам",
+         [({"target": replica.name}, replica.reads) for replica in replicas.replicas]
+         + [({"target": "primary"}, replicas.primary_reads)]),
+        ("db_replica_fallbacks_total", "counter", "Чтения с основной базы из-за отставания реплик",
+         [({}, replicas.fallbacks)]),
+    ]
+
+
+
+RegisterCollector(_pool_collector)
+RegisterCollector(_cache_collector)
+RegisterCollector(_events_collector)
+RegisterCollector(_admission_collector)
+RegisterCollector(_loader_collector)
+RegisterCollector(_writer_collector)
+RegisterCollector(_replica_collector)
+
+
+
+#========================================================================================================================
+#                       HTTP
+#========================================================================================================================
+
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = Render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+class ReusePortHTTPServer(ThreadingHTTPServer):
+    # при перезапуске по SIGHUP новый воркер слушает тот же порт, пока старый ещё дорабатывает
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+
+def WorkerAddress(index, address=metrics_port):
+    """
+    В многопроцессном режиме у каждого воркера свои метрики: порт METRICS_IPPORT + номер воркера
+    """
+    host, _, port = address.rpartition(":")
+    return f"{host}:{int(port) + index}"
+
+
+
+def StartHttpServer(address=metrics_port, reuse_port=False):
+    """
+    HTTP сервер метрик в фоновом потоке
+    """
+    host, _, port = address.rpartition(":")
+    server_class = ReusePortHTTPServer if reuse_port else ThreadingHTTPServer
+    server = server_class((host, int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics on http://{address}/metrics")
+    return server
+
+
+
+def ServerInterceptors():
+    return [MetricsInterceptor()] if metrics_enabled else []
+
+
+
+def AsyncServerInterceptors():
+    return [AsyncMetricsInterceptor()] if metrics_enabled else []
@@ -0,0 +1,175 @@
+"""
+Асинхронные версии функций model поверх create_async_engine.
+
+Функции интерфейса из model выполняются через AsyncSession.run_sync: тот же код запросов,
+но ввод-вывод идёт через асинхронный драйвер (asyncpg) и не блокирует event loop.
+"""
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool
+import contextlib
+import logging
+import os
+
+import db
+import model
+import replicas
+from model import Template, TEMPLATE_COLUMNS
+
+
+logger = logging.getLogger(__name__)
+
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def AsyncConnUrl(url):
+    """
+    URL для асинхронного движка: драйвер меняется на асинхронный, остальное как в PSQL_URL
+    """
+    url = make_url(url)
+    if url.get_dialect().is_async:
+        return url
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+psql_async_conn_url = os.getenv('PSQL_ASYNC_URL') or AsyncConnUrl(db.psql_conn_url)
+
+_async_engine = None
+_async_session_factory = None
+
+
+
+def CreateAsyncEngine(url, poolclass):
+    """
+    Асинхронный движок с настройками пула и подключения из db (основная база и реплики)
+    """
+    engine = create_async_engine(url, connect_args=db.ConnectArgs(url), **db.PoolOptions(url, poolclass))
+    db.EnableForeignKeys(engine.sync_engine)
+    return engine
+
+
+
+def GetAsyncEngine():
+    """
+    Движок создаётся при первом обращении, чтобы импорт модуля не требовал асинхронного драйвера
+    """
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        _async_engine = CreateAsyncEngine(psql_async_conn_url, db.InstrumentedAsyncQueuePool)
+        _async_session_factory = async_sessionmaker(bind=_async_engine, expire_on_commit=False)
+    return _async_engine
+
+
+
+async def Prewarm(count=db.pool_prewarm):
+    """
+    Асинхронный аналог db.Prewarm: заранее открывает соединения пула асинхронного движка
+    """
+    engine = GetAsyncEngine()
+    pool = engine.sync_engine.pool
+    if isinstance(pool, QueuePool):
+        count = min(count, pool.size())
+    async with contextlib.AsyncExitStack() as stack:
+        for _ in range(max(1, count)):
+            await stack.enter_async_context(engine.connect())
+    return max(1, count)
+
+
+
+def GetAsyncSession(**kwargs):
+    """
+    kwargs - параметры AsyncSession поверх фабрики, например bind движка реплики
+    """
+    GetAsyncEngine()
+    return _async_session_factory(**kwargs)
+
+
+
+def AsyncTransactional(func):
+    """
+    Асинхронная версия функции model, обёрнутой в model.Transactional
+    """
+    read_only = getattr(func, "read_only", False)
+
+    async def wrapper(*args, **kwargs):
+        session = await replicas.GetAsyncReadSession() if read_only else GetAsyncSession()
+        async with session:
+            return await session.run_sync(func.in_session, *args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+
+#========================================================================================================================
+#                       Реализация интерфейса
+#========================================================================================================================
+
+
+
+CreateFeature = AsyncTransactional(model.CreateFeature)
+UpdateFeature = AsyncTransactional(model.UpdateFeature)
+DeleteFeature = AsyncTransactional(model.DeleteFeature)
+DeleteFeatures = AsyncTransactional(model.DeleteFeatures)
+
+AddTemplateFeatureLink = AsyncTransactional(model.AddTemplateFeatureLink)
+UpdateTemplateFeaturesLink = AsyncTransactional(model.UpdateTemplateFeaturesLink)
+DeleteTemplateFeatureLink = AsyncTransactional(model.DeleteTemplateFeatureLink)
+AddTemplateFeatureLinks = AsyncTransactional(model.AddTemplateFeatureLinks)
+UpdateTemplateFeaturesLinks = AsyncTransactional(model.UpdateTemplateFeaturesLinks)
+
+GetFeaturesByTemplateId = AsyncTransactional(model.GetFeaturesByTemplateId)
+GetFeaturesByTemplateIds = AsyncTransactional(model.GetFeaturesByTemplateIds)
+GetTemplatesByIds = AsyncTransactional(model.GetTemplatesByIds)
+GetExistingTemplateIds = AsyncTransactional(model.GetExistingTemplateIds)
+GetTemplateSnapshots = AsyncTransactional(model.GetTemplateSnapshots)
+DropSnapshots = AsyncTransactional(model.DropSnapshots)
+
+CreateTemplate = AsyncTransactional(model.CreateTemplate)
+UpdateTemplate = AsyncTransactional(model.UpdateTemplate)
+DeleteTemplate = AsyncTransactional(model.DeleteTemplate)
+DeleteTemplates = AsyncTransactional(model.DeleteTemplates)
+GetAllTemplates = AsyncTransactional(model.GetAllTemplates)
+GetCatalogVersion = AsyncTransactional(model.GetCatalogVersion)
+GetAllTemplatesVersioned = AsyncTransactional(model.GetAllTemplatesVersioned)
+GetTemplatesPage = AsyncTransactional(model.GetTemplatesPage)
+FindTemplates = AsyncTransactional(model.FindTemplates)
+SearchTemplates = AsyncTransactional(model.SearchTemplates)
+SearchFeatures = AsyncTransactional(model.SearchFeatures)
+
+BulkImport = AsyncTransactional(model.BulkImport)
+
+GetChangeEvents = AsyncTransactional(model.GetChangeEvents)
+GetChangeEventsBounds = AsyncTransactional(model.GetChangeEventsBounds)
+
+
+
+async def IterTemplates(chunk_size=500, window_chunks=20):
+    """
+    Асинхронный аналог model.IterTemplates: keyset обход шаблонов с потоковым чтением окна
+    """
+    last_id = 0
+    window = chunk_size * window_chunks
+    while True:
+        fetched = 0
+        async with GetAsyncSession() as session:
+            # как model._rows: соединение сессии, без обработки строк в ORM
+            connection = await session.connection()
+            result = await connection.stream(
+                select(*TEMPLATE_COLUMNS)
+                .where(Template.id > last_id)
+                .order_by(Template.id)
+                .limit(window)
+                .execution_options(yield_per=chunk_size)
+            )
+            async for partition in result.partitions():
+                fetched += len(partition)
+                last_id = partition[-1].id
+                yield partition
+        if fetched < window:
+            return
@@ -0,0 +1,565 @@
+"""
+Чтение с реплик postgresql и read-your-writes по LSN.
+
+При заданном PSQL_REPLICA_URLS функции чтения model (model.ReadTransactional) открывают сессию на одной
+из реплик по кругу, запись всегда идёт в основную базу (PSQL_URL). Поток проверки раз в REPLICA_CHECK_INTERVAL
+секунд читает у каждой реплики проигранный LSN; недоступная реплика выпадает из круга до следующей удачной проверки.
+
+Согласованность держится на LSN основной базы:
+    - после commit пишущей транзакции процесс читает LSN основной базы (pg_current_wal_insert_lsn(), Committed):
+      он не меньше конца записи о фиксации. LSN, прочитанный до commit, не годится - фиксация пишется позже.
+      Поток change_events так же читает LSN после чтения чужих событий;
+    - ответ RPC несёт в метаданных x-lsn: LSN фиксаций самого RPC или, если их не видно (запись пачкой),
+      наибольший известный процессу. Клиент передаёт его обратно в x-min-lsn;
+    - маршрут чтения задаёт только x-min-lsn: без него подходит любая исправная реплика, с ним - проигравшая
+      не меньше него. Отстающие реплики ждём до REPLICA_WAIT_MS, проверяя каждую не чаще раза в POLL_STEP
+      на все ожидающие чтения, дальше читаем с основной базы.
+Кэши от данных старее их сброса защищают поколения и метки: сброс помечает шаблон и фичи LSN процесса,
+а ответ, прочитанный с реплики, не проигравшей метку, в кэш не кладётся (см. TrackReads, cache.Put).
+
+Настройки:
+    PSQL_REPLICA_URLS       - URL реплик через запятую, пусто - всё читается с основной базы ('')
+    REPLICA_CHECK_INTERVAL  - период проверки реплик, в секундах (1)
+    REPLICA_WAIT_MS         - сколько ждать отстающую реплику, прежде чем читать с основной базы (20)
+"""
+from sqlalchemy import create_engine, text
+import contextvars
+import contextlib
+import itertools
+import threading
+import asyncio
+import logging
+import time
+import os
+
+import grpc
+
+import cache
+import db
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+replica_urls = [url.strip() for url in (os.getenv('PSQL_REPLICA_URLS') or '').split(',') if url.strip()]
+check_interval = float(os.getenv('REPLICA_CHECK_INTERVAL') or 1)
+wait = float(os.getenv('REPLICA_WAIT_MS') or 20) / 1000
+
+LSN_HEADER = "x-lsn"
+MIN_LSN_HEADER = "x-min-lsn"
+
+# не чаще одной проверки отстающей реплики за шаг, сколько бы чтений её ни ждало
+POLL_STEP = 0.005
+
+# у реплики - проигранный LSN; если по адресу оказалась основная база - текущий
+REPLAY_LSN_SQL = text("SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_insert_lsn() END")
+PRIMARY_LSN_SQL = text("SELECT pg_current_wal_insert_lsn()")
+
+
+
+def ParseLsn(value):
+    """
+    'X/Y' как в pg_lsn -> число (asyncpg сразу отдаёт число); пусто -> 0. ValueError - не LSN
+    """
+    if not value:
+        return 0
+    if isinstance(value, int):
+        return value
+    high, slash, low = str(value).partition("/")
+    if not slash:
+        raise ValueError(f"Не LSN: {value!r}")
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+
+def FormatLsn(lsn):
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+
+
+
+class Replica:
+
+    def __init__(self, index, url):
+        self.name = f"replica{index}"
+        self.url = url
+        # до первой удачной проверки реплика в круг не входит
+        self.healthy = False
+        self.replay_lsn = 0
+        self.checked_at = 0.0
+        self.reads = 0
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._poll_async_lock = None
+        self._engine = None
+        self._async_engine = None
+
+    def Engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = db.EnableForeignKeys(create_engine(
+                        self.url, connect_args=db.ConnectArgs(self.url),
+                        **db.PoolOptions(self.url, db.PoolClass(self.name))))
+        return self._engine
+
+    def AsyncEngine(self):
+        # только из event loop, блокировка не нужна
+        if self._async_engine is None:
+            import model_async
+            url = model_async.AsyncConnUrl(self.url)
+            self._async_engine = model_async.CreateAsyncEngine(
+                url, db.PoolClass(f"{self.name}_async", db.InstrumentedAsyncQueuePool))
+        return self._async_engine
+
+    def Observe(self, lsn):
+        # гонка между проверками не страшна: LSN реплики только растёт
+        if lsn > self.replay_lsn:
+            self.replay_lsn = lsn
+        return self.replay_lsn
+
+    def Check(self):
+        with self.Engine().connect() as connection:
+            lsn = ParseLsn(connection.scalar(REPLAY_LSN_SQL))
+        self.checked_at = time.monotonic()
+        return self.Observe(lsn)
+
+    async def CheckAsync(self):
+        async with self.AsyncEngine().connect() as connection:
+            lsn = ParseLsn(await connection.scalar(REPLAY_LSN_SQL))
+        self.checked_at = time.monotonic()
+        return self.Observe(lsn)
+
+    def Poll(self):
+        """
+        Проигранный LSN не старее POLL_STEP: ожидающие чтения делят одну проверку
+        """
+        with self._poll_lock:
+            if time.monotonic() - self.checked_at >= POLL_STEP:
+                self.Check()
+        return self.replay_lsn
+
+    async def PollAsync(self):
+        # только из event loop, как и AsyncEngine
+        if self._poll_async_lock is None:
+            self._poll_async_lock = asyncio.Lock()
+        async with self._poll_async_lock:
+            if time.monotonic() - self.checked_at >= POLL_STEP:
+                await self.CheckAsync()
+        return self.replay_lsn
+
+    def SetHealthy(self, healthy, error=None):
+        if healthy and not self.healthy:
+            logger.info(f"Реплика {self.name} в работе, LSN {FormatLsn(self.replay_lsn)}")
+        elif not healthy and self.healthy:
+            logger.warning(f"Реплика {self.name} недоступна: {error}")
+        self.healthy = healthy
+
+
+
+replicas = [Replica(index, url) for index, url in enumerate(replica_urls, 1)]
+
+# наибольший LSN основной базы, известный процессу: фиксации процесса и прочитанные события журнала
+known_lsn = 0
+_lsn_lock = threading.Lock()
+_next = itertools.count()
+primary_reads = 0
+fallbacks = 0
+
+# x-min-lsn текущего RPC
+min_lsn = contextvars.ContextVar("min_lsn", default=0)
+# общая пачка loader читает не старее самого требовательного из её вызовов
+db.MergeInBatch(min_lsn, max)
+# [LSN фиксаций текущего RPC] для x-lsn, ставит перехватчик
+_rpc_commits = contextvars.ContextVar("rpc_commits", default=None)
+# ReadSources активного TrackReads
+_read_sources = contextvars.ContextVar("read_sources", default=None)
+
+
+
+def Enabled():
+    return bool(replicas)
+
+
+
+def Behind():
+    """
+    Клиент RPC ждёт изменений, о которых процесс ещё не знает: кэши процесса для него не годятся
+    """
+    return min_lsn.get() > known_lsn
+
+
+
+def Advance(lsn):
+    global known_lsn
+    with _lsn_lock:
+        if lsn > known_lsn:
+            known_lsn = lsn
+
+
+
+def KnownLsn():
+    return known_lsn
+
+
+
+def CaughtUp(replay_lsn, required):
+    """
+    Реплика с проигранным replay_lsn видит фиксации, после которых прочитан LSN required
+    (0 - токена нет, подходит любая)
+    """
+    return not required or replay_lsn >= required
+
+
+
+class ReadSources:
+    """
+    Откуда читали в блоке TrackReads: lsn - наименьший проигранный LSN реплик на момент выбора,
+    None - всё читалось с основной базы
+    """
+
+    def __init__(self):
+        self.lsn = None
+
+    def Add(self, replica):
+        if self.lsn is None or replica.replay_lsn < self.lsn:
+            self.lsn = replica.replay_lsn
+
+
+
+@contextlib.contextmanager
+def TrackReads():
+    """
+    Собирает источники чтений внутри блока, см. ReadSources. Для cache.Put: ответ с отставшей реплики
+    не должен лечь в кэш поверх более свежего сброса
+    """
+    sources = ReadSources()
+    token = _read_sources.set(sources)
+    try:
+        yield sources
+    finally:
+        _read_sources.reset(token)
+
+
+
+#========================================================================================================================
+#                       Выбор реплики
+#========================================================================================================================
+
+
+
+def _candidates(required):
+    """
+    Исправные реплики по кругу; первая - проигравшая required, если про такую известно (иначе None)
+    """
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        return None, []
+    start = next(_next) % len(healthy)
+    ordered = healthy[start:] + healthy[:start]
+    for replica in ordered:
+        if CaughtUp(replica.replay_lsn, required):
+            return replica, ordered
+    return None, ordered
+
+
+
+def _count(replica):
+    global primary_reads
+    if replica is not None:
+        replica.reads += 1
+        sources = _read_sources.get()
+        if sources is not None:
+            sources.Add(replica)
+    else:
+        primary_reads += 1
+
+
+
+def Pick():
+    """
+    Реплика для чтения или None - читать с основной базы
+    """
+    global fallbacks
+    if not replicas:
+        return None
+    required = min_lsn.get()
+    replica, candidates = _candidates(required)
+    deadline = time.monotonic() + wait
+    while replica is None and candidates:
+        for candidate in candidates:
+            try:
+                if CaughtUp(candidate.Poll(), required):
+                    replica = candidate
+                    break
+            except Exception as e:
+                candidate.SetHealthy(False, e)
+        candidates = [candidate for candidate in candidates if candidate.healthy]
+        if replica is not None or time.monotonic() + POLL_STEP > deadline:
+            break
+        time.sleep(POLL_STEP)
+    if replica is None and candidates:
+        fallbacks += 1
+    _count(replica)
+    return replica
+
+
+
+async def PickAsync():
+    """
+    Pick для grpc.aio: отстающая реплика проверяется и ждётся без блокировки event loop
+    """
+    global fallbacks
+    if not replicas:
+        return None
+    required = min_lsn.get()
+    replica, candidates = _candidates(required)
+    deadline = time.monotonic() + wait
+    while replica is None and candidates:
+        for candidate in candidates:
+            try:
+                if CaughtUp(await candidate.PollAsync(), required):
+                    replica = candidate
+                    break
+            except Exception as e:
+                candidate.SetHealthy(False, e)
+        candidates = [candidate for candidate in candidates if candidate.healthy]
+        if replica is not None or time.monotonic() + POLL_STEP > deadline:
+            break
+        await asyncio.sleep(POLL_STEP)
+    if replica is None and candidates:
+        fallbacks += 1
+    _count(replica)
+    return replica
+
+
+
+def GetReadSession():
+    """
+    Сессия для чтения: на реплике, если есть подходящая, иначе на основной базе
+    """
+    replica = Pick()
+    if replica is None:
+        return db.GetSession()
+    return db.SessionFactory(bind=replica.Engine(), info={"replica": replica.name})
+
+
+
+async def GetAsyncReadSession():
+    import model_async
+    replica = await PickAsync()
+    if replica is None:
+        return model_async.GetAsyncSession()
+    return model_async.GetAsyncSession(bind=replica.AsyncEngine(), info={"replica": replica.name})
+
+
+
+#========================================================================================================================
+#                       LSN фиксаций
+#========================================================================================================================
+
+
+
+def PrimaryLsn():
+    """
+    Текущий LSN основной базы отдельным соединением: при запуске и в потоке change_events
+    """
+    with db.GetEngine().connect() as connection:
+        return ParseLsn(connection.scalar(PRIMARY_LSN_SQL))
+
+
+
+def Committed(session):
+    """
+    Вызывается после commit записи (model._commit): читает LSN в той же сессии, уже вне фиксированной
+    транзакции, и делает его известным процессу и x-lsn RPC до того, как запись сбросит кэши
+    """
+    if not replicas or not session.info.pop("recorded_events", False):
+        return
+    lsn = ParseLsn(session.scalar(PRIMARY_LSN_SQL))
+    Advance(lsn)
+    commits = _rpc_commits.get()
+    if commits is not None and lsn > commits[0]:
+        commits[0] = lsn
+
+
+
+#========================================================================================================================
+#                       Проверка реплик
+#========================================================================================================================
+
+
+
+class HealthChecker(threading.Thread):
+
+    def __init__(self):
+        super().__init__(name="replica-health", daemon=True)
+        self._stop_event = threading.Event()
+
+    def Stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            CheckAll()
+            self._stop_event.wait(check_interval)
+
+
+
+def CheckAll():
+    for replica in replicas:
+        try:
+            replica.Check()
+            replica.SetHealthy(True)
+        except Exception as e:
+            replica.SetHealthy(False, e)
+
+
+
+_checker = None
+_start_lock = threading.Lock()
+
+
+
+def Start():
+    """
+    Проверяет реплики и запускает их периодическую проверку в текущем процессе (в многопроцессном режиме -
+    в каждом воркере). Без PSQL_REPLICA_URLS ничего не делает
+    """
+    global _checker
+    if not replicas:
+        return
+    with _start_lock:
+        if _checker is not None:
+            return
+        if db.GetEngine().dialect.name != "postgresql":
+            logger.error("PSQL_REPLICA_URLS работает только с postgresql, чтение идёт с основной базы")
+            replicas.clear()
+            return
+        Advance(PrimaryLsn())
+        cache.features_cache.fence_clock = KnownLsn
+        CheckAll()
+        _checker = HealthChecker()
+        _checker.start()
+        logger.info(f"Чтение с реплик: {len(replicas)}, в работе {sum(replica.healthy for replica in replicas)}")
+
+
+
+#========================================================================================================================
+#                       Метаданные RPC
+#========================================================================================================================
+
+
+
+def _requested_lsn(context):
+    for key, value in context.invocation_metadata() or ():
+        if key == MIN_LSN_HEADER:
+            return ParseLsn(value)
+    return 0
+
+
+
+def _begin_commits():
+    return _rpc_commits.set([0])
+
+
+
+def _lsn_metadata():
+    # фиксации пачкой (writer) идут в чужом контексте и сюда не попадают - тогда LSN процесса, он не меньше
+    commits = _rpc_commits.get()
+    return ((LSN_HEADER, FormatLsn(commits[0] if commits and commits[0] else known_lsn)),)
+
+
+
+class ReplicaInterceptor(grpc.ServerInterceptor):
+    """
+    x-min-lsn запроса - в min_lsn на время RPC, в ответ - x-lsn
+    """
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+
+        def begin(context):
+            try:
+                return min_lsn.set(_requested_lsn(context))
+            except ValueError as e:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        def wrap_unary(behavior):
+            def wrapper(request, context):
+                token = begin(context)
+                commits = _begin_commits()
+                try:
+                    return behavior(request, context)
+                finally:
+                    context.set_trailing_metadata(_lsn_metadata())
+                    _rpc_commits.reset(commits)
+                    min_lsn.reset(token)
+            return wrapper
+
+        def wrap_stream(behavior):
+            def wrapper(request, context):
+                token = begin(context)
+                commits = _begin_commits()
+                try:
+                    yield from behavior(request, context)
+                finally:
+                    context.set_trailing_metadata(_lsn_metadata())
+                    _rpc_commits.reset(commits)
+                    min_lsn.reset(token)
+            return wrapper
+
+        return metrics.ReplaceBehavior(handler, wrap_unary, wrap_stream)
+
+
+
+class AsyncReplicaInterceptor(grpc.aio.ServerInterceptor):
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+
+        async def begin(context):
+            try:
+                return min_lsn.set(_requested_lsn(context))
+            except ValueError as e:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        def wrap_unary(behavior):
+            async def wrapper(request, context):
+                token = await begin(context)
+                commits = _begin_commits()
+                try:
+                    return await behavior(request, context)
+                finally:
+                    context.set_trailing_metadata(_lsn_metadata())
+                    _rpc_commits.reset(commits)
+                    min_lsn.reset(token)
+            return wrapper
+
+        def wrap_stream(behavior):
+            async def wrapper(request, context):
+                token = await begin(context)
+                commits = _begin_commits()
+                try:
+                    async for response in behavior(request, context):
+                        yield response
+                finally:
+                    context.set_trailing_metadata(_lsn_metadata())
+                    _rpc_commits.reset(commits)
+                    min_lsn.reset(token)
+            return wrapper
+
+        return metrics.ReplaceBehavior(handler, wrap_unary, wrap_stream)
+
+
+
+def ServerInterceptors():
+    return [ReplicaInterceptor()] if replicas else []
+
+
+
+def AsyncServerInterceptors():
+    return [AsyncReplicaInterceptor()] if replicas else []
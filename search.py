@@ -0,0 +1,323 @@
+"""
+Поиск шаблонов и фич по имени (SearchTemplates / SearchFeatures).
+
+Два способа:
+    db     - запросы к postgresql с pg_trgm: GIN индексы по триграммам для подстроки и нечёткого поиска,
+             btree по lower(name) для префикса (индексы создаёт model.CreateSearchIndexes)
+    memory - триграммный индекс в памяти процесса, для SQLite и баз без pg_trgm. Строится при старте
+             и обновляется событиями журнала изменений (events.bus), ответ без обращения к базе
+
+Ранжирование одинаковое: префикс - по алфавиту, подстрока и нечёткий поиск - по сходству имени
+с запросом (доля общих триграмм, как similarity() в pg_trgm), при равенстве - по id.
+Подстрока короче трёх символов в памяти ищется перебором всех записей.
+Индекс в памяти рассчитан на объёмы SQLite: шаблон с описанием занимает в нём единицы КБ,
+на сотнях тысяч шаблонов нужен pg_trgm.
+
+Настройки:
+    SEARCH_BACKEND    - db, memory или auto: db, если в базе есть pg_trgm (auto)
+    SEARCH_MAX_LIMIT  - больше результатов не отдаётся (100)
+"""
+import threading
+import logging
+import bisect
+import heapq
+import math
+import re
+import os
+
+import events
+import model
+
+
+logger = logging.getLogger(__name__)
+
+
+search_backend = os.getenv('SEARCH_BACKEND') or 'auto'
+max_limit = int(os.getenv('SEARCH_MAX_LIMIT') or 100)
+
+MODES = ("prefix", "substring", "fuzzy")
+DEFAULT_LIMIT = 20
+# как pg_trgm.similarity_threshold по умолчанию
+FUZZY_THRESHOLD = 0.3
+
+# слова для триграмм - как в pg_trgm: буквы и цифры, без подчёркивания
+WORD_RE = re.compile(r"[^\W_]+")
+
+
+
+def Trigrams(text):
+    """
+    Триграммы строки как в pg_trgm: каждое слово в нижнем регистре дополняется двумя пробелами слева и одним справа
+    """
+    trigrams = set()
+    for word in WORD_RE.findall((text or "").lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+
+def _inner_trigrams(text):
+    """
+    Триграммы, которые обязаны быть у строки, содержащей text как подстроку: без дополнения по краям слов,
+    ведь запрос может начинаться и заканчиваться внутри слова
+    """
+    trigrams = set()
+    for word in WORD_RE.findall(text):
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+
+def Similarity(a, b):
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+
+class TrigramIndex:
+    """
+    Записи (dict с id и name) с индексами: отсортированные имена для префикса,
+    триграммы всех полей fields для подстроки и триграммы имени для нечёткого поиска
+    """
+    def __init__(self, fields):
+        self.fields = fields
+        self._lock = threading.RLock()
+        self._records = {}
+        # [(имя в нижнем регистре, id)] по возрастанию
+        self._names = []
+        # поля записи в нижнем регистре одной строкой, в ней проверяется подстрока
+        self._texts = {}
+        self._name_trigrams = {}
+        # триграмма -> id записей: по имени (нечёткий поиск) и по всем полям (подстрока)
+        self._name_postings = {}
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def _add(self, record):
+        record_id = record["id"]
+        self._records[record_id] = record
+        text = "\n".join((record.get(field) or "").lower() for field in self.fields)
+        self._texts[record_id] = text
+        name_trigrams = frozenset(Trigrams(record["name"]))
+        self._name_trigrams[record_id] = name_trigrams
+        for trigram in name_trigrams:
+            self._name_postings.setdefault(trigram, set()).add(record_id)
+        for trigram in Trigrams(text):
+            self._postings.setdefault(trigram, set()).add(record_id)
+        return ((record["name"] or "").lower(), record_id)
+
+    def Load(self, records):
+        """
+        Массовое добавление при построении индекса: имена сортируются один раз в конце
+        """
+        with self._lock:
+            for record in records:
+                self.Remove(record["id"])
+                self._names.append(self._add(record))
+            self._names.sort()
+
+    def Put(self, record):
+        with self._lock:
+            self.Remove(record["id"])
+            bisect.insort(self._names, self._add(record))
+
+    def Remove(self, record_id):
+        with self._lock:
+            record = self._records.pop(record_id, None)
+            if record is None:
+                return
+            key = ((record["name"] or "").lower(), record_id)
+            index = bisect.bisect_left(self._names, key)
+            if index < len(self._names) and self._names[index] == key:
+                del self._names[index]
+            for trigram in self._name_trigrams.pop(record_id):
+                self._discard(self._name_postings, trigram, record_id)
+            for trigram in Trigrams(self._texts.pop(record_id)):
+                self._discard(self._postings, trigram, record_id)
+
+    def _discard(self, postings, trigram, record_id):
+        ids = postings.get(trigram)
+        if ids is not None:
+            ids.discard(record_id)
+            if not ids:
+                del postings[trigram]
+
+    def Search(self, query, mode, limit):
+        """
+        [(запись, сходство)] в порядке ранжирования
+        """
+        lowered = query.lower()
+        query_trigrams = frozenset(Trigrams(query))
+        with self._lock:
+            if mode == "prefix":
+                matches = self._prefix(lowered, limit)
+                return [(self._records[record_id], Similarity(query_trigrams, self._name_trigrams[record_id]))
+                        for record_id in matches]
+            if mode == "substring":
+                scored = ((record_id, Similarity(query_trigrams, self._name_trigrams[record_id]))
+                          for record_id in self._substring(lowered))
+            else:
+                scored = self._fuzzy(query_trigrams)
+            best = heapq.nsmallest(limit, scored, key=lambda item: (-item[1], item[0]))
+            return [(self._records[record_id], score) for record_id, score in best]
+
+    def _prefix(self, lowered, limit):
+        matches = []
+        index = bisect.bisect_left(self._names, (lowered,))
+        while len(matches) < limit and index < len(self._names):
+            name, record_id = self._names[index]
+            if not name.startswith(lowered):
+                break
+            matches.append(record_id)
+            index += 1
+        return matches
+
+    def _substring(self, lowered):
+        trigrams = _inner_trigrams(lowered)
+        texts = self._texts
+        if not trigrams:
+            return [record_id for record_id, text in texts.items() if lowered in text]
+        postings = sorted((self._postings.get(trigram, ()) for trigram in trigrams), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return [record_id for record_id in candidates if lowered in texts[record_id]]
+
+    def _fuzzy(self, query_trigrams):
+        """
+        При сходстве не ниже FUZZY_THRESHOLD у записи есть хотя бы need общих триграмм с запросом, значит,
+        хотя бы одна из (len(query) - need + 1) самых редких. Самые частые триграммы кандидатов не дают
+        """
+        size = len(query_trigrams)
+        if not size:
+            return
+        need = max(1, math.ceil(FUZZY_THRESHOLD * size))
+        postings = sorted((self._name_postings.get(trigram, ()) for trigram in query_trigrams), key=len)
+        candidates = set().union(*postings[:size - need + 1])
+        for record_id in candidates:
+            name_trigrams = self._name_trigrams[record_id]
+            shared = len(query_trigrams & name_trigrams)
+            score = shared / (size + len(name_trigrams) - shared)
+            if score >= FUZZY_THRESHOLD:
+                yield record_id, score
+
+
+
+templates_index = TrigramIndex(("name", "description"))
+features_index = TrigramIndex(("name",))
+
+# выбранный при Start() способ поиска: db или memory
+backend = None
+_start_lock = threading.Lock()
+_apply_lock = threading.Lock()
+_applied_seq = 0
+
+INDEXES = {"template": templates_index, "feature": features_index}
+
+
+
+def _apply(events_batch):
+    global _applied_seq
+    for event in events_batch:
+        if event["seq"] <= _applied_seq:
+            continue
+        _applied_seq = event["seq"]
+        index = INDEXES.get(event["entity"])
+        if index is None:
+            continue
+        if event["op"] == "delete":
+            index.Remove(event["entity_id"])
+        else:
+            index.Put(dict(event["data"] or {}, id=event["entity_id"]))
+
+
+
+def _on_events(events_batch):
+    with _apply_lock:
+        _apply(events_batch)
+
+
+
+def _load():
+    """
+    Снимок таблиц плюс события, пришедшие во время чтения снимка: изменения, попавшие
+    и в снимок, и в журнал, применяются повторно по порядку seq и дают то же состояние
+    """
+    global _applied_seq
+    with _apply_lock:
+        since = _applied_seq = events.bus.last_seq
+        events.bus.Subscribe(_on_events)
+        for chunk in model.IterTemplates():
+            templates_index.Load(row._asdict() for row in chunk)
+        features_index.Load(model.GetAllFeatures())
+        while True:
+            batch, since = events.ReadSince(since)
+            if not batch:
+                break
+            _apply(batch)
+
+
+
+def Start():
+    """
+    Выбирает способ поиска и при необходимости строит индекс в памяти.
+    Вызывается после events.Start(): индекс обновляется событиями шины
+    """
+    global backend
+    with _start_lock:
+        if backend is not None:
+            return
+        mode = search_backend
+        if mode == "auto":
+            mode = "db" if model.HasTrigramSearch() else "memory"
+        if mode == "memory":
+            _load()
+            logger.info(f"Поиск по индексу в памяти: {len(templates_index)} шаблонов, {len(features_index)} фич")
+        elif mode == "db":
+            logger.info("Поиск запросами к базе (pg_trgm)")
+        else:
+            raise ValueError(f"Неизвестный SEARCH_BACKEND: {mode}")
+        backend = mode
+
+
+
+def _template_match(record, score):
+    return {"id": record["id"], "name": record["name"], "description": record.get("description"), "score": score}
+
+
+
+def _feature_match(record, score):
+    return {"id": record["id"], "name": record["name"], "feature_type": record["feature_type"], "score": score}
+
+
+
+def SearchTemplates(query, mode, limit):
+    if backend == "db":
+        return model.SearchTemplates(query, mode, limit)
+    return [_template_match(record, score) for record, score in templates_index.Search(query, mode, limit)]
+
+
+
+def SearchFeatures(query, mode, limit):
+    if backend == "db":
+        return model.SearchFeatures(query, mode, limit)
+    return [_feature_match(record, score) for record, score in features_index.Search(query, mode, limit)]
+
+
+
+async def SearchTemplatesAsync(query, mode, limit):
+    if backend == "db":
+        import model_async
+        return await model_async.SearchTemplates(query, mode, limit)
+    return SearchTemplates(query, mode, limit)
+
+
+
+async def SearchFeaturesAsync(query, mode, limit):
+    if backend == "db":
+        import model_async
+        return await model_async.SearchFeatures(query, mode, limit)
+    return SearchFeatures(query, mode, limit)
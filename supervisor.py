@@ -0,0 +1,251 @@
+"""
+Многопроцессный режим сервера.
+
+Сборка protobuf ответов и ORM объектов упирается в GIL, поэтому один процесс использует одно ядро
+независимо от размера пула потоков. В этом режиме родительский процесс только следит за воркерами:
+каждый воркер - отдельный процесс со своим gRPC сервером, все слушают один порт (SO_REUSEPORT),
+соединения между ними распределяет ядро.
+
+Сигналы родителю:
+    SIGTERM, SIGINT  - плавная остановка: воркеры дорабатывают начатые запросы и завершаются
+    SIGHUP           - плавный перезапуск воркеров по одному, порт всё время кем-то слушается
+
+Настройки:
+    GRPC_SUPERVISOR          - 1 включает многопроцессный режим (0)
+    GRPC_PROCESSES           - число процессов-воркеров (число доступных ядер)
+    GRPC_SHUTDOWN_GRACE      - сколько секунд воркер дорабатывает запросы при остановке (10)
+    GRPC_WORKER_START_TIMEOUT - сколько секунд ждать готовности нового воркера (30)
+"""
+import logging
+import select
+import signal
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+supervisor_enabled = (os.getenv('GRPC_SUPERVISOR') or '0') not in ('0', 'false', 'no')
+processes = int(os.getenv('GRPC_PROCESSES') or _cpu_count())
+shutdown_grace = float(os.getenv('GRPC_SHUTDOWN_GRACE') or 10)
+worker_start_timeout = float(os.getenv('GRPC_WORKER_START_TIMEOUT') or 30)
+
+# номер воркера в многопроцессном режиме, None - обычный однопроцессный запуск
+worker_index = None
+
+# перезапуск упавшего воркера не чаще, чем раз в RESPAWN_DELAY секунд на слот
+RESPAWN_DELAY = 1.0
+
+
+
+def NotifyReady(ready_fd):
+    """
+    Воркер сообщает родителю, что сервер запущен и принимает запросы
+    """
+    if ready_fd is None:
+        return
+    try:
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+    except OSError:
+        pass
+
+
+
+class Worker:
+
+    def __init__(self, index, pid, ready_fd):
+        self.index = index
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.started_at = time.monotonic()
+        self.stopping = False
+
+
+
+class Supervisor:
+    """
+    Запускает target(index, ready_fd) в count дочерних процессах и следит за ними.
+    target должен вызвать NotifyReady(ready_fd) после старта сервера и завершиться по SIGTERM
+    """
+
+    def __init__(self, target, count=processes):
+        self.target = target
+        self.count = max(1, count)
+        self.workers = {}
+        self.respawn_at = {}
+        self.shutting_down = False
+        self.reload_requested = False
+
+    def Run(self):
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_r, False)
+        os.set_blocking(wakeup_w, False)
+        signal.set_wakeup_fd(wakeup_w)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        logger.info(f"Supervisor {os.getpid()}: запуск {self.count} воркеров")
+        for index in range(self.count):
+            self._spawn(index)
+
+        while self.workers or not self.shutting_down:
+            try:
+                select.select([wakeup_r], [], [], 1.0)
+            except InterruptedError:
+                pass
+            self._drain(wakeup_r)
+            self._reap()
+            if self.shutting_down:
+                self._stop_all()
+                continue
+            if self.reload_requested:
+                self.reload_requested = False
+                self._rolling_restart(wakeup_r)
+            self._respawn()
+
+        signal.set_wakeup_fd(-1)
+        os.close(wakeup_r)
+        os.close(wakeup_w)
+        logger.info(f"Supervisor {os.getpid()}: остановлен")
+
+    def _on_stop(self, signum, frame):
+        if not self.shutting_down:
+            logger.info(f"Supervisor: получен {signal.Signals(signum).name}, останавливаем воркеры")
+        self.shutting_down = True
+
+    def _on_reload(self, signum, frame):
+        logger.info("Supervisor: получен SIGHUP, перезапускаем воркеры")
+        self.reload_requested = True
+
+    def _drain(self, fd):
+        try:
+            while os.read(fd, 512):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _spawn(self, index):
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # воркер: сигналы родителя ему не нужны, обработчики поставит сам сервер
+            os.close(ready_r)
+            signal.set_wakeup_fd(-1)
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            global worker_index
+            worker_index = index
+            code = 0
+            try:
+                self.target(index, ready_w)
+            except BaseException as e:
+                logger.exception(e)
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        os.close(ready_w)
+        worker = Worker(index, pid, ready_r)
+        self.workers[pid] = worker
+        logger.info(f"Supervisor: воркер {index} запущен, pid {pid}")
+        return worker
+
+    def _wait_ready(self, worker, wakeup_r):
+        """
+        Ждём, пока воркер поднимет сервер. False - воркер умер или не успел за worker_start_timeout
+        """
+        deadline = time.monotonic() + worker_start_timeout
+        try:
+            while not self.shutting_down and worker.pid in self.workers:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return False
+                readable, _, _ = select.select([worker.ready_fd, wakeup_r], [], [], timeout)
+                if worker.ready_fd in readable:
+                    return os.read(worker.ready_fd, 1) == b"1"
+                self._drain(wakeup_r)
+                self._reap()
+            return False
+        except InterruptedError:
+            return False
+
+    def _rolling_restart(self, wakeup_r):
+        """
+        Новый воркер поднимается раньше, чем останавливается старый в том же слоте,
+        поэтому число слушающих порт процессов не падает
+        """
+        for old in sorted(list(self.workers.values()), key=lambda worker: worker.index):
+            if self.shutting_down:
+                return
+            if old.stopping or old.pid not in self.workers:
+                continue
+            new = self._spawn(old.index)
+            if not self._wait_ready(new, wakeup_r):
+                logger.error(f"Supervisor: новый воркер {new.index} не запустился, перезапуск прерван")
+                return
+            self._terminate(old)
+        logger.info("Supervisor: перезапуск завершён")
+
+    def _terminate(self, worker):
+        if worker.stopping:
+            return
+        worker.stopping = True
+        worker.stop_deadline = time.monotonic() + shutdown_grace + 5
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _stop_all(self):
+        now = time.monotonic()
+        for worker in list(self.workers.values()):
+            if not worker.stopping:
+                self._terminate(worker)
+            elif now > worker.stop_deadline:
+                logger.warning(f"Supervisor: воркер {worker.index} (pid {worker.pid}) не остановился, SIGKILL")
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            os.close(worker.ready_fd)
+            code = os.waitstatus_to_exitcode(status)
+            if worker.stopping or self.shutting_down:
+                logger.info(f"Supervisor: воркер {worker.index} (pid {pid}) остановлен, код {code}")
+                continue
+            logger.error(f"Supervisor: воркер {worker.index} (pid {pid}) завершился с кодом {code}, перезапускаем")
+            # воркер, упавший сразу после старта, не перезапускаем в цикле без паузы
+            delay = RESPAWN_DELAY if time.monotonic() - worker.started_at < RESPAWN_DELAY else 0
+            self.respawn_at[worker.index] = time.monotonic() + delay
+
+    def _respawn(self):
+        now = time.monotonic()
+        for index, at in list(self.respawn_at.items()):
+            if at > now:
+                continue
+            del self.respawn_at[index]
+            # слот мог уже занять воркер, запущенный при перезапуске по SIGHUP
+            if not any(worker.index == index and not worker.stopping for worker in self.workers.values()):
+                self._spawn(index)
@@ -0,0 +1,803 @@
+"""
+Клиентская библиотека сервиса шаблонов.
+
+    from templates_client import TemplatesClient
+
+    client = TemplatesClient("templates:5255", cache_ttl=5)
+    templates = client.GetAllTemplates()
+    links = client.GetFeaturesByTemplateId(templates[0].id)
+
+    async with AsyncTemplatesClient("templates:5255") as client:
+        templates = await client.GetAllTemplates()
+
+Что делает библиотека:
+    - каналы общие на процесс (sync): клиенты с одним адресом используют одни и те же соединения,
+      keepalive держит их живыми между редкими запросами;
+    - у каждого метода свой дедлайн по умолчанию (DEFAULT_DEADLINES);
+    - чтения повторяются при UNAVAILABLE / RESOURCE_EXHAUSTED с экспоненциальной задержкой
+      со случайным разбросом - это retryPolicy из service config, повторы делает сам gRPC;
+    - hedge_delay включает дублирующие чтения: если ответа нет за hedge_delay секунд,
+      уходит второй такой же запрос, берётся первый ответ;
+    - cache_ttl включает локальный кэш GetAllTemplates (дальше список обновляется через
+      GetAllTemplatesIfModified, т.е. почти бесплатно) и GetFeaturesByTemplateId;
+    - Watch сам переподключается и продолжает с последнего полученного seq;
+    - read_your_writes: LSN из ответов на записи (x-lsn) уходит в x-min-lsn следующих запросов,
+      и сервер с репликами читает данные не старее этих записей.
+
+Возвращаются protobuf сообщения сервиса. Списки из кэша общие для всех вызовов, изменять их нельзя.
+"""
+from collections import OrderedDict
+from concurrent import futures
+import threading
+import asyncio
+import logging
+import random
+import json
+import time
+import os
+
+import grpc
+import templates_pb2
+import templates_pb2_grpc
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_TARGET = os.environ.get('GRPC_TARGET') or 'localhost:50051'
+
+SERVICE = templates_pb2.DESCRIPTOR.services_by_name['Templates']
+
+# дедлайн по умолчанию, секунд; None - без дедлайна
+DEFAULT_DEADLINES = {
+    "GetFeaturesByTemplateId": 1.0,
+    "GetTemplatesPage": 2.0,
+    "FindTemplates": 2.0,
+    "BatchGetFeaturesByTemplateIds": 2.0,
+    "GetTemplatesByIds": 2.0,
+    "SearchTemplates": 1.0,
+    "SearchFeatures": 1.0,
+    "GetAllTemplates": 10.0,
+    "GetAllTemplatesIfModified": 10.0,
+    "StreamAllTemplates": 300.0,
+    "BulkImport": 600.0,
+    "Watch": None,
+}
+DEFAULT_DEADLINE = 3.0
+
+# read-your-writes с реплик: LSN фиксации в ответе и минимальный LSN для чтения в запросе
+LSN_HEADER = "x-lsn"
+MIN_LSN_HEADER = "x-min-lsn"
+
+# методы без побочных эффектов: их можно повторять и дублировать
+READ_METHODS = (
+    "GetFeaturesByTemplateId",
+    "GetTemplatesPage",
+    "FindTemplates",
+    "BatchGetFeaturesByTemplateIds",
+    "GetTemplatesByIds",
+    "GetAllTemplates",
+    "GetAllTemplatesIfModified",
+    "StreamAllTemplates",
+    "SearchTemplates",
+    "SearchFeatures",
+)
+
+SERVICE_CONFIG = {
+    "methodConfig": [{
+        "name": [{"service": SERVICE.full_name, "method": method} for method in READ_METHODS],
+        "retryPolicy": {
+            "maxAttempts": 4,
+            "initialBackoff": "0.05s",
+            "maxBackoff": "1s",
+            "backoffMultiplier": 2,
+            "retryableStatusCodes": ["UNAVAILABLE", "RESOURCE_EXHAUSTED"],
+        },
+    }],
+    # при массовых ошибках повторы отключаются, чтобы не добивать перегруженный сервер
+    "retryThrottling": {"maxTokens": 10, "tokenRatio": 0.1},
+}
+
+CHANNEL_OPTIONS = [
+    ("grpc.service_config", json.dumps(SERVICE_CONFIG)),
+    ("grpc.enable_retries", 1),
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.max_receive_message_length", 64 * 1024 * 1024),
+    # у каждого канала свои соединения, иначе gRPC склеит каналы с одинаковыми настройками в одно
+    ("grpc.use_local_subchannel_pool", 1),
+]
+
+FEATURES_CACHE_MAX_ENTRIES = 10000
+
+# переподключение Watch
+WATCH_RETRY_INITIAL = 0.5
+WATCH_RETRY_MAX = 30.0
+
+
+
+class TtlCache:
+    """
+    LRU кэш с временем жизни записей
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def Get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def Put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def Pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def Clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+
+def _split_cached(cache, keys):
+    """
+    ({ключ: значение из кэша}, [ключи без значения в кэше]) без повторов
+    """
+    found = {}
+    misses = []
+    for key in dict.fromkeys(keys):
+        value = cache.Get(key) if cache is not None else None
+        if value is None:
+            misses.append(key)
+        else:
+            found[key] = value
+    return found, misses
+
+
+
+class CatalogCache:
+    """
+    Список шаблонов с версией каталога. После ttl список не выбрасывается,
+    а проверяется через GetAllTemplatesIfModified
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.version = 0
+        self.items = None
+        self.checked_at = 0.0
+
+    def Fresh(self):
+        with self._lock:
+            if self.items is not None and time.monotonic() - self.checked_at < self.ttl:
+                return self.items
+            return None
+
+    def Update(self, snapshot):
+        with self._lock:
+            if not snapshot.not_modified or self.items is None:
+                self.version = snapshot.version
+                self.items = list(snapshot.items)
+            self.checked_at = time.monotonic()
+            return self.items
+
+    def Expire(self):
+        with self._lock:
+            self.checked_at = 0.0
+
+
+
+#========================================================================================================================
+#                       Каналы
+#========================================================================================================================
+
+
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+
+def GetChannel(target, credentials=None, index=0):
+    """
+    Общий на процесс канал до target. index позволяет держать несколько соединений
+    к одному адресу (HTTP/2 соединение ограничено числом одновременных потоков)
+    """
+    key = (target, id(credentials) if credentials is not None else None, index)
+    with _channels_lock:
+        entry = _channels.get(key)
+        if entry is None:
+            channel = (grpc.secure_channel(target, credentials, CHANNEL_OPTIONS) if credentials is not None
+                       else grpc.insecure_channel(target, CHANNEL_OPTIONS))
+            entry = _channels[key] = [channel, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+
+def ReleaseChannel(channel):
+    with _channels_lock:
+        for key, entry in list(_channels.items()):
+            if entry[0] is channel:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del _channels[key]
+                    channel.close()
+                return
+
+
+
+def _deadline(deadlines, method, timeout):
+    if timeout is not None:
+        return timeout
+    return deadlines.get(method, DEFAULT_DEADLINE)
+
+
+
+def _remaining(deadline_at):
+    if deadline_at is None:
+        return None
+    return max(0.0, deadline_at - time.monotonic())
+
+
+
+def _parse_lsn(value):
+    high, _, low = value.partition("/")
+    return (int(high, 16) << 32) | int(low or "0", 16)
+
+
+
+class LsnTracker:
+    """
+    Наибольший LSN из x-lsn ответов на записи; уходит в x-min-lsn всех следующих запросов
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+        self.lsn = None
+
+    def Observe(self, trailing_metadata):
+        for key, value in trailing_metadata or ():
+            if key != LSN_HEADER:
+                continue
+            parsed = _parse_lsn(value)
+            with self._lock:
+                if parsed > self._value:
+                    self._value, self.lsn = parsed, value
+
+    def Metadata(self, metadata):
+        if self.lsn is None:
+            return metadata
+        return tuple(metadata or ()) + ((MIN_LSN_HEADER, self.lsn),)
+
+
+
+#========================================================================================================================
+#                       Синхронный клиент
+#========================================================================================================================
+
+
+
+class TemplatesClient:
+    """
+    Синхронный клиент. Потокобезопасен, создавать один на приложение.
+        channels     - сколько соединений держать к target
+        deadlines    - дедлайны методов поверх DEFAULT_DEADLINES
+        hedge_delay  - через сколько секунд дублировать чтение, None - не дублировать
+        cache_ttl    - время жизни локального кэша чтений в секундах, None - без кэша
+        read_your_writes - читать не старее своих записей (см. LsnTracker)
+    """
+
+    def __init__(self, target=DEFAULT_TARGET, channels=1, deadlines=None, hedge_delay=None,
+                 cache_ttl=None, credentials=None, metadata=None, read_your_writes=False):
+        self._channels = [GetChannel(target, credentials, index) for index in range(max(1, channels))]
+        self._stubs = [templates_pb2_grpc.TemplatesStub(channel) for channel in self._channels]
+        self._next = 0
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self.hedge_delay = hedge_delay
+        self.metadata = metadata
+        self._lsn = LsnTracker() if read_your_writes else None
+        self._catalog = CatalogCache(cache_ttl) if cache_ttl else None
+        self._features = TtlCache(cache_ttl, FEATURES_CACHE_MAX_ENTRIES) if cache_ttl else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def Close(self):
+        for channel in self._channels:
+            ReleaseChannel(channel)
+        self._channels, self._stubs = [], []
+
+    def _stub(self):
+        # гонка на счётчике не страшна - это только выбор соединения
+        self._next += 1
+        return self._stubs[self._next % len(self._stubs)]
+
+    def _metadata(self):
+        return self._lsn.Metadata(self.metadata) if self._lsn is not None else self.metadata
+
+    def Call(self, method, request, timeout=None):
+        """
+        Унарный вызов method с дедлайном по умолчанию; чтения дублируются, если задан hedge_delay
+        """
+        timeout = _deadline(self.deadlines, method, timeout)
+        if self.hedge_delay is not None and method in READ_METHODS:
+            return self._hedged(method, request, timeout)
+        if self._lsn is not None and method not in READ_METHODS:
+            response, call = getattr(self._stub(), method).with_call(request, timeout=timeout, metadata=self._metadata())
+            self._lsn.Observe(call.trailing_metadata())
+            return response
+        return getattr(self._stub(), method)(request, timeout=timeout, metadata=self._metadata())
+
+    def _hedged(self, method, request, timeout):
+        deadline_at = time.monotonic() + timeout if timeout is not None else None
+        done = futures.Future()
+        calls = []
+        pending = [0]
+        lock = threading.Lock()
+
+        def on_done(call):
+            with lock:
+                pending[0] -= 1
+                if done.done() or call.cancelled():
+                    return
+                if call.exception() is None:
+                    done.set_result(call.result())
+                elif pending[0] == 0:
+                    # ответ с ошибкой берём, только если других запросов в полёте нет
+                    done.set_exception(call.exception())
+
+        def start():
+            with lock:
+                pending[0] += 1
+            call = getattr(self._stub(), method).future(request, timeout=_remaining(deadline_at),
+                                                        metadata=self._metadata())
+            calls.append(call)
+            call.add_done_callback(on_done)
+
+        start()
+        try:
+            return done.result(timeout=self.hedge_delay)
+        except futures.TimeoutError:
+            pass
+        except grpc.RpcError:
+            raise
+        start()
+        try:
+            return done.result()
+        finally:
+            for call in calls:
+                call.cancel()
+
+    #------------------------------------------------------------------------------------------
+    # Шаблоны
+
+    def GetAllTemplates(self, timeout=None):
+        """
+        Все шаблоны. С кэшем после cache_ttl запрашивается только изменение списка
+        """
+        if self._catalog is None:
+            return list(self.Call("GetAllTemplates", templates_pb2.Empty(), timeout).items)
+        items = self._catalog.Fresh()
+        if items is not None:
+            return items
+        snapshot = self.Call("GetAllTemplatesIfModified",
+                             templates_pb2.CatalogVersionRequest(known_version=self._catalog.version), timeout)
+        return self._catalog.Update(snapshot)
+
+    def GetTemplatesPage(self, page_size=0, cursor="", timeout=None):
+        return self.Call("GetTemplatesPage", templates_pb2.TemplatesPageRequest(page_size=page_size, cursor=cursor), timeout)
+
+    def GetTemplatesByIds(self, template_ids, timeout=None):
+        """
+        ({id: TemplateStruct}, [id несуществующих шаблонов])
+        """
+        response = self.Call("GetTemplatesByIds", templates_pb2.IdsRequest(ids=template_ids), timeout)
+        return {item.id: item for item in response.items}, list(response.missing_ids)
+
+    def FindTemplates(self, predicates, page_size=0, cursor="", timeout=None):
+        """
+        Страница шаблонов по условиям на фичи: predicates - [templates_pb2.FeaturePredicate]
+        """
+        request = templates_pb2.FindTemplatesRequest(predicates=predicates, page_size=page_size, cursor=cursor)
+        return self.Call("FindTemplates", request, timeout)
+
+    def IterTemplates(self, chunk_size=0, timeout=None):
+        """
+        Все шаблоны потоком StreamAllTemplates, по одному
+        """
+        timeout = _deadline(self.deadlines, "StreamAllTemplates", timeout)
+        request = templates_pb2.StreamTemplatesRequest(chunk_size=chunk_size)
+        for chunk in self._stub().StreamAllTemplates(request, timeout=timeout, metadata=self._metadata()):
+            yield from chunk.items
+
+    def CreateTemplate(self, name, description="", timeout=None):
+        response = self.Call("CreateTemplate", templates_pb2.TemplateStruct(name=name, description=description), timeout)
+        self._catalog_changed()
+        return response.id
+
+    def UpdateTemplate(self, template_id, name, description="", timeout=None):
+        self.Call("UpdateTemplate", templates_pb2.TemplateStruct(id=template_id, name=name, description=description), timeout)
+        self._catalog_changed()
+
+    def DeleteTemplate(self, template_id, timeout=None):
+        self.Call("DeleteTemplate", templates_pb2.IdStruct(id=template_id), timeout)
+        self._catalog_changed()
+        self._template_changed(template_id)
+
+    def DeleteTemplates(self, template_ids, timeout=None):
+        """
+        ([id удалённых], [id, которых уже не было])
+        """
+        response = self.Call("DeleteTemplates", templates_pb2.IdsRequest(ids=template_ids), timeout)
+        self._catalog_changed()
+        for template_id in template_ids:
+            self._template_changed(template_id)
+        return list(response.deleted_ids), list(response.missing_ids)
+
+    def SearchTemplates(self, query, mode=templates_pb2.SearchRequest.PREFIX, limit=0, timeout=None):
+        """
+        [TemplateMatch] по убыванию релевантности
+        """
+        request = templates_pb2.SearchRequest(query=query, mode=mode, limit=limit)
+        return list(self.Call("SearchTemplates", request, timeout).items)
+
+    #------------------------------------------------------------------------------------------
+    # Фичи и связи
+
+    def SearchFeatures(self, query, mode=templates_pb2.SearchRequest.PREFIX, limit=0, timeout=None):
+        request = templates_pb2.SearchRequest(query=query, mode=mode, limit=limit)
+        return list(self.Call("SearchFeatures", request, timeout).items)
+
+    def GetFeaturesByTemplateId(self, template_id, timeout=None):
+        if self._features is not None:
+            items = self._features.Get(template_id)
+            if items is not None:
+                return items
+        items = list(self.Call("GetFeaturesByTemplateId", templates_pb2.IdStruct(id=template_id), timeout).items)
+        if self._features is not None:
+            self._features.Put(template_id, items)
+        return items
+
+    def BatchGetFeaturesByTemplateIds(self, template_ids, timeout=None):
+        """
+        ({id шаблона: [FeatureLinkTemplate]}, [id несуществующих шаблонов]); в сервер уходят только id, которых нет в кэше
+        """
+        found, misses = _split_cached(self._features, template_ids)
+        if not misses:
+            return found, []
+        response = self.Call("BatchGetFeaturesByTemplateIds", templates_pb2.IdsRequest(ids=misses), timeout)
+        return self._batch_features(found, response)
+
+    def _batch_features(self, found, response):
+        for item in response.items:
+            found[item.template_id] = items = list(item.features.items)
+            if self._features is not None:
+                self._features.Put(item.template_id, items)
+        return found, list(response.missing_ids)
+
+    def CreateFeature(self, name, feature_type=templates_pb2.FeatureStruct.RANGE, timeout=None):
+        return self.Call("CreateFeature", templates_pb2.FeatureStruct(name=name, feature_type=feature_type), timeout).id
+
+    def UpdateFeature(self, feature_id, name, feature_type=templates_pb2.FeatureStruct.RANGE, timeout=None):
+        self.Call("UpdateFeature", templates_pb2.FeatureStruct(id=feature_id, name=name, feature_type=feature_type), timeout)
+        self._feature_changed()
+
+    def DeleteFeature(self, feature_id, timeout=None):
+        self.Call("DeleteFeature", templates_pb2.IdStruct(id=feature_id), timeout)
+        self._feature_changed()
+
+    def DeleteFeatures(self, feature_ids, timeout=None):
+        response = self.Call("DeleteFeatures", templates_pb2.IdsRequest(ids=feature_ids), timeout)
+        self._feature_changed()
+        return list(response.deleted_ids), list(response.missing_ids)
+
+    def CreateLink(self, template_id, feature_id, value="", timeout=None):
+        response = self.Call("CreateLink", templates_pb2.FeatureLinkTemplateStruct(
+            template_id=template_id, feature_id=feature_id, value=value), timeout)
+        self._template_changed(template_id)
+        return response.id
+
+    def UpdateLink(self, link_id, template_id, feature_id, value="", timeout=None):
+        self.Call("UpdateLink", templates_pb2.FeatureLinkTemplateStruct(
+            id=link_id, template_id=template_id, feature_id=feature_id, value=value), timeout)
+        self._template_changed(template_id)
+
+    def DeleteLink(self, template_id, feature_id, timeout=None):
+        self.Call("DeleteLink", templates_pb2.FeatureLinkTemplateStruct(template_id=template_id, feature_id=feature_id), timeout)
+        self._template_changed(template_id)
+
+    def BulkImport(self, records, timeout=None):
+        """
+        records - итератор BulkImportRecord, возвращает BulkImportSummary
+        """
+        timeout = _deadline(self.deadlines, "BulkImport", timeout)
+        summary, call = self._stub().BulkImport.with_call(iter(records), timeout=timeout, metadata=self._metadata())
+        if self._lsn is not None:
+            self._lsn.Observe(call.trailing_metadata())
+        self._catalog_changed()
+        if self._features is not None:
+            self._features.Clear()
+        return summary
+
+    #------------------------------------------------------------------------------------------
+    # Изменения
+
+    def Watch(self, since_seq=0):
+        """
+        Бесконечный поток ChangeEvent. При обрыве соединения переподключается с последнего seq;
+        OUT_OF_RANGE (seq уже удалён из журнала) пробрасывается - нужно перечитать данные целиком
+        """
+        delay = WATCH_RETRY_INITIAL
+        seq = since_seq
+        while True:
+            stream = self._stub().Watch(templates_pb2.WatchRequest(since_seq=seq), metadata=self._metadata())
+            try:
+                for batch in stream:
+                    delay = WATCH_RETRY_INITIAL
+                    for event in batch.items:
+                        yield event
+                    seq = batch.last_seq or seq
+            except grpc.RpcError as e:
+                if e.code() not in (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                    grpc.StatusCode.INTERNAL):
+                    raise
+                logger.warning(f"Watch: {e.code().name}, переподключение через {delay:.1f} с")
+            finally:
+                stream.cancel()
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, WATCH_RETRY_MAX)
+
+    #------------------------------------------------------------------------------------------
+
+    def _catalog_changed(self):
+        if self._catalog is not None:
+            self._catalog.Expire()
+
+    def _template_changed(self, template_id):
+        if self._features is not None:
+            self._features.Pop(template_id)
+
+    def _feature_changed(self):
+        # в каких шаблонах фича, клиент не знает
+        if self._features is not None:
+            self._features.Clear()
+
+
+
+#========================================================================================================================
+#                       Асинхронный клиент
+#========================================================================================================================
+
+
+
+class AsyncTemplatesClient(TemplatesClient):
+    """
+    Клиент для asyncio. Каналы grpc.aio привязаны к event loop, поэтому у каждого клиента свои;
+    создавать и использовать внутри одного event loop. Параметры как у TemplatesClient
+    """
+
+    def __init__(self, target=DEFAULT_TARGET, channels=1, deadlines=None, hedge_delay=None,
+                 cache_ttl=None, credentials=None, metadata=None, read_your_writes=False):
+        self._channels = [
+            grpc.aio.secure_channel(target, credentials, CHANNEL_OPTIONS) if credentials is not None
+            else grpc.aio.insecure_channel(target, CHANNEL_OPTIONS)
+            for _ in range(max(1, channels))
+        ]
+        self._stubs = [templates_pb2_grpc.TemplatesStub(channel) for channel in self._channels]
+        self._next = 0
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self.hedge_delay = hedge_delay
+        self.metadata = metadata
+        self._lsn = LsnTracker() if read_your_writes else None
+        self._catalog = CatalogCache(cache_ttl) if cache_ttl else None
+        self._features = TtlCache(cache_ttl, FEATURES_CACHE_MAX_ENTRIES) if cache_ttl else None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.Close()
+
+    async def Close(self):
+        for channel in self._channels:
+            await channel.close()
+        self._channels, self._stubs = [], []
+
+    async def Call(self, method, request, timeout=None):
+        timeout = _deadline(self.deadlines, method, timeout)
+        if self.hedge_delay is not None and method in READ_METHODS:
+            return await self._hedged(method, request, timeout)
+        call = getattr(self._stub(), method)(request, timeout=timeout, metadata=self._metadata())
+        response = await call
+        if self._lsn is not None and method not in READ_METHODS:
+            self._lsn.Observe(await call.trailing_metadata())
+        return response
+
+    async def _hedged(self, method, request, timeout):
+        deadline_at = time.monotonic() + timeout if timeout is not None else None
+
+        def start():
+            return asyncio.ensure_future(getattr(self._stub(), method)(
+                request, timeout=_remaining(deadline_at), metadata=self._metadata()))
+
+        calls = [start()]
+        try:
+            done, _ = await asyncio.wait(calls, timeout=self.hedge_delay)
+            if not done:
+                calls.append(start())
+            error = None
+            pending = set(calls)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for call in done:
+                    if call.exception() is None:
+                        return call.result()
+                    error = call.exception()
+            raise error
+        finally:
+            for call in calls:
+                call.cancel()
+
+    async def GetAllTemplates(self, timeout=None):
+        if self._catalog is None:
+            return list((await self.Call("GetAllTemplates", templates_pb2.Empty(), timeout)).items)
+        items = self._catalog.Fresh()
+        if items is not None:
+            return items
+        snapshot = await self.Call("GetAllTemplatesIfModified",
+                                   templates_pb2.CatalogVersionRequest(known_version=self._catalog.version), timeout)
+        return self._catalog.Update(snapshot)
+
+    async def GetTemplatesPage(self, page_size=0, cursor="", timeout=None):
+        return await self.Call("GetTemplatesPage", templates_pb2.TemplatesPageRequest(page_size=page_size, cursor=cursor), timeout)
+
+    async def GetTemplatesByIds(self, template_ids, timeout=None):
+        response = await self.Call("GetTemplatesByIds", templates_pb2.IdsRequest(ids=template_ids), timeout)
+        return {item.id: item for item in response.items}, list(response.missing_ids)
+
+    async def FindTemplates(self, predicates, page_size=0, cursor="", timeout=None):
+        request = templates_pb2.FindTemplatesRequest(predicates=predicates, page_size=page_size, cursor=cursor)
+        return await self.Call("FindTemplates", request, timeout)
+
+    async def IterTemplates(self, chunk_size=0, timeout=None):
+        timeout = _deadline(self.deadlines, "StreamAllTemplates", timeout)
+        request = templates_pb2.StreamTemplatesRequest(chunk_size=chunk_size)
+        async for chunk in self._stub().StreamAllTemplates(request, timeout=timeout, metadata=self._metadata()):
+            for item in chunk.items:
+                yield item
+
+    async def CreateTemplate(self, name, description="", timeout=None):
+        response = await self.Call("CreateTemplate", templates_pb2.TemplateStruct(name=name, description=description), timeout)
+        self._catalog_changed()
+        return response.id
+
+    async def UpdateTemplate(self, template_id, name, description="", timeout=None):
+        await self.Call("UpdateTemplate", templates_pb2.TemplateStruct(id=template_id, name=name, description=description), timeout)
+        self._catalog_changed()
+
+    async def DeleteTemplate(self, template_id, timeout=None):
+        await self.Call("DeleteTemplate", templates_pb2.IdStruct(id=template_id), timeout)
+        self._catalog_changed()
+        self._template_changed(template_id)
+
+    async def DeleteTemplates(self, template_ids, timeout=None):
+        response = await self.Call("DeleteTemplates", templates_pb2.IdsRequest(ids=template_ids), timeout)
+        self._catalog_changed()
+        for template_id in template_ids:
+            self._template_changed(template_id)
+        return list(response.deleted_ids), list(response.missing_ids)
+
+    async def SearchTemplates(self, query, mode=templates_pb2.SearchRequest.PREFIX, limit=0, timeout=None):
+        request = templates_pb2.SearchRequest(query=query, mode=mode, limit=limit)
+        return list((await self.Call("SearchTemplates", request, timeout)).items)
+
+    async def SearchFeatures(self, query, mode=templates_pb2.SearchRequest.PREFIX, limit=0, timeout=None):
+        request = templates_pb2.SearchRequest(query=query, mode=mode, limit=limit)
+        return list((await self.Call("SearchFeatures", request, timeout)).items)
+
+    async def GetFeaturesByTemplateId(self, template_id, timeout=None):
+        if self._features is not None:
+            items = self._features.Get(template_id)
+            if items is not None:
+                return items
+        response = await self.Call("GetFeaturesByTemplateId", templates_pb2.IdStruct(id=template_id), timeout)
+        items = list(response.items)
+        if self._features is not None:
+            self._features.Put(template_id, items)
+        return items
+
+    async def BatchGetFeaturesByTemplateIds(self, template_ids, timeout=None):
+        found, misses = _split_cached(self._features, template_ids)
+        if not misses:
+            return found, []
+        response = await self.Call("BatchGetFeaturesByTemplateIds", templates_pb2.IdsRequest(ids=misses), timeout)
+        return self._batch_features(found, response)
+
+    async def CreateFeature(self, name, feature_type=templates_pb2.FeatureStruct.RANGE, timeout=None):
+        return (await self.Call("CreateFeature", templates_pb2.FeatureStruct(name=name, feature_type=feature_type), timeout)).id
+
+    async def UpdateFeature(self, feature_id, name, feature_type=templates_pb2.FeatureStruct.RANGE, timeout=None):
+        await self.Call("UpdateFeature", templates_pb2.FeatureStruct(id=feature_id, name=name, feature_type=feature_type), timeout)
+        self._feature_changed()
+
+    async def DeleteFeature(self, feature_id, timeout=None):
+        await self.Call("DeleteFeature", templates_pb2.IdStruct(id=feature_id), timeout)
+        self._feature_changed()
+
+    async def DeleteFeatures(self, feature_ids, timeout=None):
+        response = await self.Call("DeleteFeatures", templates_pb2.IdsRequest(ids=feature_ids), timeout)
+        self._feature_changed()
+        return list(response.deleted_ids), list(response.missing_ids)
+
+    async def CreateLink(self, template_id, feature_id, value="", timeout=None):
+        response = await self.Call("CreateLink", templates_pb2.FeatureLinkTemplateStruct(
+            template_id=template_id, feature_id=feature_id, value=value), timeout)
+        self._template_changed(template_id)
+        return response.id
+
+    async def UpdateLink(self, link_id, template_id, feature_id, value="", timeout=None):
+        await self.Call("UpdateLink", templates_pb2.FeatureLinkTemplateStruct(
+            id=link_id, template_id=template_id, feature_id=feature_id, value=value), timeout)
+        self._template_changed(template_id)
+
+    async def DeleteLink(self, template_id, feature_id, timeout=None):
+        await self.Call("DeleteLink", templates_pb2.FeatureLinkTemplateStruct(template_id=template_id, feature_id=feature_id), timeout)
+        self._template_changed(template_id)
+
+    async def BulkImport(self, records, timeout=None):
+        """
+        records - обычный или асинхронный итератор BulkImportRecord
+        """
+        timeout = _deadline(self.deadlines, "BulkImport", timeout)
+        call = self._stub().BulkImport(records, timeout=timeout, metadata=self._metadata())
+        summary = await call
+        if self._lsn is not None:
+            self._lsn.Observe(await call.trailing_metadata())
+        self._catalog_changed()
+        if self._features is not None:
+            self._features.Clear()
+        return summary
+
+    async def Watch(self, since_seq=0):
+        delay = WATCH_RETRY_INITIAL
+        seq = since_seq
+        while True:
+            stream = self._stub().Watch(templates_pb2.WatchRequest(since_seq=seq), metadata=self._metadata())
+            try:
+                async for batch in stream:
+                    delay = WATCH_RETRY_INITIAL
+                    for event in batch.items:
+                        yield event
+                    seq = batch.last_seq or seq
+            except grpc.RpcError as e:
+                if e.code() not in (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                    grpc.StatusCode.INTERNAL):
+                    raise
+                logger.warning(f"Watch: {e.code().name}, переподключение через {delay:.1f} с")
+            finally:
+                stream.cancel()
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, WATCH_RETRY_MAX)
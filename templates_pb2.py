@@ -14,7 +14,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0ftemplates.proto\x12\x10TemplatesService\"\x07\n\x05\x45mpty\"_\n\x19\x46\x65\x61tureLinkTemplateStruct\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x12\n\nfeature_id\x18\x02 \x01(\x04\x12\x13\n\x0btemplate_id\x18\x03 \x01(\x04\x12\r\n\x05value\x18\x04 \x01(\t\"?\n\x0eTemplateStruct\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x03 \x01(\t\"@\n\rTemplatesList\x12/\n\x05items\x18\x01 \x03(\x0b\x32 .TemplatesService.TemplateStruct\"\x90\x01\n\rFeatureStruct\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x41\n\x0c\x66\x65\x61ture_type\x18\x03 \x01(\x0e\x32+.TemplatesService.FeatureStruct.FeatureType\"\"\n\x0b\x46\x65\x61tureType\x12\t\n\x05RANGE\x10\x00\x12\x08\n\x04LIST\x10\x01\">\n\x0c\x46\x65\x61turesList\x12.\n\x05items\x18\x01 \x03(\x0b\x32\x1f.TemplatesService.FeatureStruct\"\x16\n\x08IdStruct\x12\n\n\x02id\x18\x01 \x01(\x04\"\x82\x01\n\x13\x46\x65\x61tureLinkTemplate\x12\x39\n\x04link\x18\x01 \x01(\x0b\x32+.TemplatesService.FeatureLinkTemplateStruct\x12\x30\n\x07\x66\x65\x61ture\x18\x02 \x01(\x0b\x32\x1f.TemplatesService.FeatureStruct\"U\n\x1dHibridFeatureLinkTemplateList\x12\x34\n\x05items\x18\x01 \x03(\x0b\x32%.TemplatesService.FeatureLinkTemplate2\x82\x07\n\tTemplates\x12U\n\nCreateLink\x12+.TemplatesService.FeatureLinkTemplateStruct\x1a\x1a.TemplatesService.IdStruct\x12R\n\nUpdateLink\x12+.TemplatesService.FeatureLinkTemplateStruct\x1a\x17.TemplatesService.Empty\x12R\n\nDeleteLink\x12+.TemplatesService.FeatureLinkTemplateStruct\x1a\x17.TemplatesService.Empty\x12N\n\x0e\x43reateTemplate\x12 .TemplatesService.TemplateStruct\x1a\x1a.TemplatesService.IdStruct\x12K\n\x0eUpdateTemplate\x12 .TemplatesService.TemplateStruct\x1a\x17.TemplatesService.Empty\x12\x45\n\x0e\x44\x65leteTemplate\x12\x1a.TemplatesService.IdStruct\x1a\x17.TemplatesService.Empty\x12L\n\rCreateFeature\x12\x1f.TemplatesService.FeatureStruct\x1a\x1a.TemplatesService.IdStruct\x12I\n\rUpdateFeature\x12\x1f.TemplatesService.FeatureStruct\x1a\x17.TemplatesService.Empty\x12\x44\n\rDeleteFeature\x12\x1a.TemplatesService.IdStruct\x1a\x17.TemplatesService.Empty\x12K\n\x0fGetAllTemplates\x12\x17.TemplatesService.Empty\x1a\x1f.TemplatesService.TemplatesList\x12\x66\n\x17GetFeaturesByTemplateId\x12\x1a.TemplatesService.IdStruct\x1a/.TemplatesService.HibridFeatureLinkTemplateListB\x0fZ\rapi/templatesb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0ftemplates.proto\x12\x10TemplatesService\"\x07\n\x05\x45mpty\"_\n\x19\x46\x65\x61tureLinkTemplateStruct\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x12\n\nfeature_id\x18\x02 \x01(\x04\x12\x13\n\x0btemplate_id\x18\x03 \x01(\x04\x12\r\n\x05value\x18\x04 \x01(\t\"?\n\x0eTemplateStruct\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x03 \x01(\t\"@\n\rTemplatesList\x12/\n\x05items\x18\x01 \x03(\x0b\x32 .TemplatesService.TemplateStruct\".\n\x15\x43\x61talogVersionRequest\x12\x15\n\rknown_version\x18\x01 \x01(\x04\"k\n\x11TemplatesSnapshot\x12/\n\x05items\x18\x01 \x03(\x0b\x32 .TemplatesService.TemplateStruct\x12\x0f\n\x07version\x18\x02 \x01(\x04\x12\x14\n\x0cnot_modified\x18\x03 \x01(\x08\"!\n\x0cWatchRequest\x12\x11\n\tsince_seq\x18\x01 \x01(\x04\"\xbb\x03\n\x0b\x43hangeEvent\x12\x0b\n\x03seq\x18\x01 \x01(\x04\x12\x34\n\x06\x65ntity\x18\x02 \x01(\x0e\x32$.TemplatesService.ChangeEvent.Entity\x12,\n\x02op\x18\x03 \x01(\x0e\x32 .TemplatesService.ChangeEvent.Op\x12\n\n\x02id\x18\x04 \x01(\x04\x12\x13\n\x0btemplate_id\x18\x05 \x01(\x04\x12\x12\n\nfeature_id\x18\x06 \x01(\x04\x12\x34\n\x08template\x18\x07 \x01(\x0b\x32 .TemplatesService.TemplateStructH\x00\x12\x32\n\x07\x66\x65\x61ture\x18\x08 \x01(\x0b\x32\x1f.TemplatesService.FeatureStructH\x00\x12;\n\x04link\x18\t \x01(\x0b\x32+.TemplatesService.FeatureLinkTemplateStructH\x00\"-\n\x06\x45ntity\x12\x0c\n\x08TEMPLATE\x10\x00\x12\x0b\n\x07\x46\x45\x41TURE\x10\x01\x12\x08\n\x04LINK\x10\x02\"(\n\x02Op\x12\n\n\x06\x43REATE\x10\x00\x12\n\n\x06UPDATE\x10\x01\x12\n\n\x06\x44\x45LETE\x10\x02\x42\x06\n\x04\x64\x61ta\"R\n\x10\x43hangeEventsList\x12,\n\x05items\x18\x01 \x03(\x0b\x32\x1d.TemplatesService.ChangeEvent\x12\x10\n\x08last_seq\x18\x02 \x01(\x04\",\n\x16StreamTemplatesRequest\x12\x12\n\nchunk_size\x18\x01 \x01(\r\"9\n\x14TemplatesPageRequest\x12\x11\n\tpage_size\x18\x01 \x01(\r\x12\x0e\n\x06\x63ursor\x18\x02 \x01(\t\"U\n\rTemplatesPage\x12/\n\x05items\x18\x01 \x03(\x0b\x32 .TemplatesService.TemplateStruct\x12\x13\n\x0bnext_cursor\x18\x02 \x01(\t\"\x90\x01\n\rFeatureStruct\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x41\n\x0c\x66\x65\x61ture_type\x18\x03 \x01(\x0e\x32+.TemplatesService.FeatureStruct.FeatureType\"\"\n\x0b\x46\x65\x61tureType\x12\t\n\x05RANGE\x10\x00\x12\x08\n\x04LIST\x10\x01\">\n\x0c\x46\x65\x61turesList\x12.\n\x05items\x18\x01 \x03(\x0b\x32\x1f.TemplatesService.FeatureStruct\"\x16\n\x08IdStruct\x12\n\n\x02id\x18\x01 \x01(\x04\"\x82\x01\n\x13\x46\x65\x61tureLinkTemplate\x12\x39\n\x04link\x18\x01 \x01(\x0b\x32+.TemplatesService.FeatureLinkTemplateStruct\x12\x30\n\x07\x66\x65\x61ture\x18\x02 \x01(\x0b\x32\x1f.TemplatesService.FeatureStruct\"U\n\x1dHibridFeatureLinkTemplateList\x12\x34\n\x05items\x18\x01 \x03(\x0b\x32%.TemplatesService.FeatureLinkTemplate\"m\n\x08\x42ulkLink\x12\x14\n\x0ctemplate_ref\x18\x01 \x01(\t\x12\x13\n\x0b\x66\x65\x61ture_ref\x18\x02 \x01(\t\x12\x13\n\x0btemplate_id\x18\x03 \x01(\x04\x12\x12\n\nfeature_id\x18\x04 \x01(\x04\x12\r\n\x05value\x18\x05 \x01(\t\"\xbf\x01\n\x10\x42ulkImportRecord\x12\x0b\n\x03ref\x18\x01 \x01(\t\x12\x34\n\x08template\x18\x02 \x01(\x0b\x32 .TemplatesService.TemplateStructH\x00\x12\x32\n\x07\x66\x65\x61ture\x18\x03 \x01(\x0b\x32\x1f.TemplatesService.FeatureStructH\x00\x12*\n\x04link\x18\x04 \x01(\x0b\x32\x1a.TemplatesService.BulkLinkH\x00\x42\x08\n\x06record\"/\n\x0f\x42ulkImportError\x12\r\n\x05index\x18\x01 \x01(\r\x12\r\n\x05\x65rror\x18\x02 \x01(\t\"\x87\x01\n\x11\x42ulkImportSummary\x12\x11\n\ttemplates\x18\x01 \x01(\r\x12\x10\n\x08\x66\x65\x61tures\x18\x02 \x01(\r\x12\r\n\x05links\x18\x03 \x01(\r\x12\x0b\n\x03ids\x18\x04 \x03(\x04\x12\x31\n\x06\x65rrors\x18\x05 \x03(\x0b\x32!.TemplatesService.BulkImportError\"\x8f\x01\n\rSearchRequest\x12\r\n\x05query\x18\x01 \x01(\t\x12\x32\n\x04mode\x18\x02 \x01(\x0e\x32$.TemplatesService.SearchRequest.Mode\x12\r\n\x05limit\x18\x03 \x01(\r\",\n\x04Mode\x12\n\n\x06PREFIX\x10\x00\x12\r\n\tSUBSTRING\x10\x01\x12\t\n\x05\x46UZZY\x10\x02\"R\n\rTemplateMatch\x12\x32\n\x08template\x18\x01 \x01(\x0b\x32 .TemplatesService.TemplateStruct\x12\r\n\x05score\x18\x02 \x01(\x02\"F\n\x14TemplateSearchResult\x12.\n\x05items\x18\x01 \x03(\x0b\x32\x1f.TemplatesService.TemplateMatch\"O\n\x0c\x46\x65\x61tureMatch\x12\x30\n\x07\x66\x65\x61ture\x18\x01 \x01(\x0b\x32\x1f.TemplatesService.FeatureStruct\x12\r\n\x05score\x18\x02 \x01(\x02\"D\n\x13\x46\x65\x61tureSearchResult\x12-\n\x05items\x18\x01 \x03(\x0b\x32\x1e.TemplatesService.FeatureMatch\"\x19\n\nIdsRequest\x12\x0b\n\x03ids\x18\x01 \x03(\x04\"j\n\x10TemplateFeatures\x12\x13\n\x0btemplate_id\x18\x01 \x01(\x04\x12\x41\n\x08\x66\x65\x61tures\x18\x02 \x01(\x0b\x32/.TemplatesService.HibridFeatureLinkTemplateList\"]\n\x13\x42\x61tchFeaturesResult\x12\x31\n\x05items\x18\x01 \x03(\x0b\x32\".TemplatesService.TemplateFeatures\x12\x13\n\x0bmissing_ids\x18\x02 \x03(\x04\"\\\n\x14TemplatesByIdsResult\x12/\n\x05items\x18\x01 \x03(\x0b\x32 .TemplatesService.TemplateStruct\x12\x13\n\x0bmissing_ids\x18\x02 \x03(\x04\"8\n\x0c\x44\x65leteResult\x12\x13\n\x0b\x64\x65leted_ids\x18\x01 \x03(\x04\x12\x13\n\x0bmissing_ids\x18\x02 \x03(\x04\"V\n\x0eRangeCondition\x12\x10\n\x03min\x18\x01 \x01(\x01H\x00\x88\x01\x01\x12\x10\n\x03max\x18\x02 \x01(\x01H\x01\x88\x01\x01\x12\x10\n\x08overlaps\x18\x03 \x01(\x08\x42\x06\n\x04_minB\x06\n\x04_max\"/\n\rListCondition\x12\x0e\n\x06\x61ny_of\x18\x01 \x03(\t\x12\x0e\n\x06\x61ll_of\x18\x02 \x03(\t\"\x97\x01\n\x10\x46\x65\x61turePredicate\x12\x12\n\nfeature_id\x18\x01 \x01(\x04\x12\x31\n\x05range\x18\x02 \x01(\x0b\x32 .TemplatesService.RangeConditionH\x00\x12/\n\x04list\x18\x03 \x01(\x0b\x32\x1f.TemplatesService.ListConditionH\x00\x42\x0b\n\tcondition\"q\n\x14\x46indTemplatesRequest\x12\x36\n\npredicates\x18\x01 \x03(\x0b\x32\".TemplatesService.FeaturePredicate\x12\x11\n\tpage_size\x18\x02 \x01(\r\x12\x0e\n\x06\x63ursor\x18\x03 \x01(\t2\xc7\x0f\n\tTemplates\x12U\n\nCreateLink\x12+.TemplatesService.FeatureLinkTemplateStruct\x1a\x1a.TemplatesService.IdStruct\x12R\n\nUpdateLink\x12+.TemplatesService.FeatureLinkTemplateStruct\x1a\x17.TemplatesService.Empty\x12R\n\nDeleteLink\x12+.TemplatesService.FeatureLinkTemplateStruct\x1a\x17.TemplatesService.Empty\x12N\n\x0e\x43reateTemplate\x12 .TemplatesService.TemplateStruct\x1a\x1a.TemplatesService.IdStruct\x12K\n\x0eUpdateTemplate\x12 .TemplatesService.TemplateStruct\x1a\x17.TemplatesService.Empty\x12\x45\n\x0e\x44\x65leteTemplate\x12\x1a.TemplatesService.IdStruct\x1a\x17.TemplatesService.Empty\x12O\n\x0f\x44\x65leteTemplates\x12\x1c.TemplatesService.IdsRequest\x1a\x1e.TemplatesService.DeleteResult\x12L\n\rCreateFeature\x12\x1f.TemplatesService.FeatureStruct\x1a\x1a.TemplatesService.IdStruct\x12I\n\rUpdateFeature\x12\x1f.TemplatesService.FeatureStruct\x1a\x17.TemplatesService.Empty\x12\x44\n\rDeleteFeature\x12\x1a.TemplatesService.IdStruct\x1a\x17.TemplatesService.Empty\x12N\n\x0e\x44\x65leteFeatures\x12\x1c.TemplatesService.IdsRequest\x1a\x1e.TemplatesService.DeleteResult\x12\x64\n\x1d\x42\x61tchGetFeaturesByTemplateIds\x12\x1c.TemplatesService.IdsRequest\x1a%.TemplatesService.BatchFeaturesResult\x12Y\n\x11GetTemplatesByIds\x12\x1c.TemplatesService.IdsRequest\x1a&.TemplatesService.TemplatesByIdsResult\x12K\n\x0fGetAllTemplates\x12\x17.TemplatesService.Empty\x1a\x1f.TemplatesService.TemplatesList\x12i\n\x19GetAllTemplatesIfModified\x12\'.TemplatesService.CatalogVersionRequest\x1a#.TemplatesService.TemplatesSnapshot\x12\x66\n\x17GetFeaturesByTemplateId\x12\x1a.TemplatesService.IdStruct\x1a/.TemplatesService.HibridFeatureLinkTemplateList\x12\x61\n\x12StreamAllTemplates\x12(.TemplatesService.StreamTemplatesRequest\x1a\x1f.TemplatesService.TemplatesList0\x01\x12[\n\x10GetTemplatesPage\x12&.TemplatesService.TemplatesPageRequest\x1a\x1f.TemplatesService.TemplatesPage\x12X\n\rFindTemplates\x12&.TemplatesService.FindTemplatesRequest\x1a\x1f.TemplatesService.TemplatesPage\x12Z\n\x0fSearchTemplates\x12\x1f.TemplatesService.SearchRequest\x1a&.TemplatesService.TemplateSearchResult\x12X\n\x0eSearchFeatures\x12\x1f.TemplatesService.SearchRequest\x1a%.TemplatesService.FeatureSearchResult\x12M\n\x05Watch\x12\x1e.TemplatesService.WatchRequest\x1a\".TemplatesService.ChangeEventsList0\x01\x12W\n\nBulkImport\x12\".TemplatesService.BulkImportRecord\x1a#.TemplatesService.BulkImportSummary(\x01\x42\x0fZ\rapi/templatesb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -30,18 +30,76 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_TEMPLATESTRUCT']._serialized_end=206
   _globals['_TEMPLATESLIST']._serialized_start=208
   _globals['_TEMPLATESLIST']._serialized_end=272
-  _globals['_FEATURESTRUCT']._serialized_start=275
-  _globals['_FEATURESTRUCT']._serialized_end=419
-  _globals['_FEATURESTRUCT_FEATURETYPE']._serialized_start=385
-  _globals['_FEATURESTRUCT_FEATURETYPE']._serialized_end=419
-  _globals['_FEATURESLIST']._serialized_start=421
-  _globals['_FEATURESLIST']._serialized_end=483
-  _globals['_IDSTRUCT']._serialized_start=485
-  _globals['_IDSTRUCT']._serialized_end=507
-  _globals['_FEATURELINKTEMPLATE']._serialized_start=510
-  _globals['_FEATURELINKTEMPLATE']._serialized_end=640
-  _globals['_HIBRIDFEATURELINKTEMPLATELIST']._serialized_start=642
-  _globals['_HIBRIDFEATURELINKTEMPLATELIST']._serialized_end=727
-  _globals['_TEMPLATES']._serialized_start=730
-  _globals['_TEMPLATES']._serialized_end=1628
+  _globals['_CATALOGVERSIONREQUEST']._serialized_start=274
+  _globals['_CATALOGVERSIONREQUEST']._serialized_end=320
+  _globals['_TEMPLATESSNAPSHOT']._serialized_start=322
+  _globals['_TEMPLATESSNAPSHOT']._serialized_end=429
+  _globals['_WATCHREQUEST']._serialized_start=431
+  _globals['_WATCHREQUEST']._serialized_end=464
+  _globals['_CHANGEEVENT']._serialized_start=467
+  _globals['_CHANGEEVENT']._serialized_end=910
+  _globals['_CHANGEEVENT_ENTITY']._serialized_start=815
+  _globals['_CHANGEEVENT_ENTITY']._serialized_end=860
+  _globals['_CHANGEEVENT_OP']._serialized_start=862
+  _globals['_CHANGEEVENT_OP']._serialized_end=902
+  _globals['_CHANGEEVENTSLIST']._serialized_start=912
+  _globals['_CHANGEEVENTSLIST']._serialized_end=994
+  _globals['_STREAMTEMPLATESREQUEST']._serialized_start=996
+  _globals['_STREAMTEMPLATESREQUEST']._serialized_end=1040
+  _globals['_TEMPLATESPAGEREQUEST']._serialized_start=1042
+  _globals['_TEMPLATESPAGEREQUEST']._serialized_end=1099
+  _globals['_TEMPLATESPAGE']._serialized_start=1101
+  _globals['_TEMPLATESPAGE']._serialized_end=1186
+  _globals['_FEATURESTRUCT']._serialized_start=1189
+  _globals['_FEATURESTRUCT']._serialized_end=1333
+  _globals['_FEATURESTRUCT_FEATURETYPE']._serialized_start=1299
+  _globals['_FEATURESTRUCT_FEATURETYPE']._serialized_end=1333
+  _globals['_FEATURESLIST']._serialized_start=1335
+  _globals['_FEATURESLIST']._serialized_end=1397
+  _globals['_IDSTRUCT']._serialized_start=1399
+  _globals['_IDSTRUCT']._serialized_end=1421
+  _globals['_FEATURELINKTEMPLATE']._serialized_start=1424
+  _globals['_FEATURELINKTEMPLATE']._serialized_end=1554
+  _globals['_HIBRIDFEATURELINKTEMPLATELIST']._serialized_start=1556
+  _globals['_HIBRIDFEATURELINKTEMPLATELIST']._serialized_end=1641
+  _globals['_BULKLINK']._serialized_start=1643
+  _globals['_BULKLINK']._serialized_end=1752
+  _globals['_BULKIMPORTRECORD']._serialized_start=1755
+  _globals['_BULKIMPORTRECORD']._serialized_end=1946
+  _globals['_BULKIMPORTERROR']._serialized_start=1948
+  _globals['_BULKIMPORTERROR']._serialized_end=1995
+  _globals['_BULKIMPORTSUMMARY']._serialized_start=1998
+  _globals['_BULKIMPORTSUMMARY']._serialized_end=2133
+  _globals['_SEARCHREQUEST']._serialized_start=2136
+  _globals['_SEARCHREQUEST']._serialized_end=2279
+  _globals['_SEARCHREQUEST_MODE']._serialized_start=2235
+  _globals['_SEARCHREQUEST_MODE']._serialized_end=2279
+  _globals['_TEMPLATEMATCH']._serialized_start=2281
+  _globals['_TEMPLATEMATCH']._serialized_end=2363
+  _globals['_TEMPLATESEARCHRESULT']._serialized_start=2365
+  _globals['_TEMPLATESEARCHRESULT']._serialized_end=2435
+  _globals['_FEATUREMATCH']._serialized_start=2437
+  _globals['_FEATUREMATCH']._serialized_end=2516
+  _globals['_FEATURESEARCHRESULT']._serialized_start=2518
+  _globals['_FEATURESEARCHRESULT']._serialized_end=2586
+  _globals['_IDSREQUEST']._serialized_start=2588
+  _globals['_IDSREQUEST']._serialized_end=2613
+  _globals['_TEMPLATEFEATURES']._serialized_start=2615
+  _globals['_TEMPLATEFEATURES']._serialized_end=2721
+  _globals['_BATCHFEATURESRESULT']._serialized_start=2723
+  _globals['_BATCHFEATURESRESULT']._serialized_end=2816
+  _globals['_TEMPLATESBYIDSRESULT']._serialized_start=2818
+  _globals['_TEMPLATESBYIDSRESULT']._serialized_end=2910
+  _globals['_DELETERESULT']._serialized_start=2912
+  _globals['_DELETERESULT']._serialized_end=2968
+  _globals['_RANGECONDITION']._serialized_start=2970
+  _globals['_RANGECONDITION']._serialized_end=3056
+  _globals['_LISTCONDITION']._serialized_start=3058
+  _globals['_LISTCONDITION']._serialized_end=3105
+  _globals['_FEATUREPREDICATE']._serialized_start=3108
+  _globals['_FEATUREPREDICATE']._serialized_end=3259
+  _globals['_FINDTEMPLATESREQUEST']._serialized_start=3261
+  _globals['_FINDTEMPLATESREQUEST']._serialized_end=3374
+  _globals['_TEMPLATES']._serialized_start=3377
+  _globals['_TEMPLATES']._serialized_end=5368
 # @@protoc_insertion_point(module_scope)
@@ -69,6 +69,11 @@ class TemplatesStub(object):
                 request_serializer=templates__pb2.IdStruct.SerializeToString,
                 response_deserializer=templates__pb2.Empty.FromString,
                 _registered_method=True)
+        self.DeleteTemplates = channel.unary_unary(
+                '/TemplatesService.Templates/DeleteTemplates',
+                request_serializer=templates__pb2.IdsRequest.SerializeToString,
+                response_deserializer=templates__pb2.DeleteResult.FromString,
+                _registered_method=True)
         self.CreateFeature = channel.unary_unary(
                 '/TemplatesService.Templates/CreateFeature',
                 request_serializer=templates__pb2.FeatureStruct.SerializeToString,
@@ -84,16 +89,71 @@ class TemplatesStub(object):
                 request_serializer=templates__pb2.IdStruct.SerializeToString,
                 response_deserializer=templates__pb2.Empty.FromString,
                 _registered_method=True)
+        self.DeleteFeatures = channel.unary_unary(
+                '/TemplatesService.Templates/DeleteFeatures',
+                request_serializer=templates__pb2.IdsRequest.SerializeToString,
+                response_deserializer=templates__pb2.DeleteResult.FromString,
+                _registered_method=True)
+        self.BatchGetFeaturesByTemplateIds = channel.unary_unary(
+                '/TemplatesService.Templates/BatchGetFeaturesByTemplateIds',
+                request_serializer=templates__pb2.IdsRequest.SerializeToString,
+                response_deserializer=templates__pb2.BatchFeaturesResult.FromString,
+                _registered_method=True)
+        self.GetTemplatesByIds = channel.unary_unary(
+                '/TemplatesService.Templates/GetTemplatesByIds',
+                request_serializer=templates__pb2.IdsRequest.SerializeToString,
+                response_deserializer=templates__pb2.TemplatesByIdsResult.FromString,
+                _registered_method=True)
         self.GetAllTemplates = channel.unary_unary(
                 '/TemplatesService.Templates/GetAllTemplates',
                 request_serializer=templates__pb2.Empty.SerializeToString,
                 response_deserializer=templates__pb2.TemplatesList.FromString,
                 _registered_method=True)
+        self.GetAllTemplatesIfModified = channel.unary_unary(
+                '/TemplatesService.Templates/GetAllTemplatesIfModified',
+                request_serializer=templates__pb2.CatalogVersionRequest.SerializeToString,
+                response_deserializer=templates__pb2.TemplatesSnapshot.FromString,
+                _registered_method=True)
         self.GetFeaturesByTemplateId = channel.unary_unary(
                 '/TemplatesService.Templates/GetFeaturesByTemplateId',
                 request_serializer=templates__pb2.IdStruct.SerializeToString,
                 response_deserializer=templates__pb2.HibridFeatureLinkTemplateList.FromString,
                 _registered_method=True)
+        self.StreamAllTemplates = channel.unary_stream(
+                '/TemplatesService.Templates/StreamAllTemplates',
+                request_serializer=templates__pb2.StreamTemplatesRequest.SerializeToString,
+                response_deserializer=templates__pb2.TemplatesList.FromString,
+                _registered_method=True)
+        self.GetTemplatesPage = channel.unary_unary(
+                '/TemplatesService.Templates/GetTemplatesPage',
+                request_serializer=templates__pb2.TemplatesPageRequest.SerializeToString,
+                response_deserializer=templates__pb2.TemplatesPage.FromString,
+                _registered_method=True)
+        self.FindTemplates = channel.unary_unary(
+                '/TemplatesService.Templates/FindTemplates',
+                request_serializer=templates__pb2.FindTemplatesRequest.SerializeToString,
+                response_deserializer=templates__pb2.TemplatesPage.FromString,
+                _registered_method=True)
+        self.SearchTemplates = channel.unary_unary(
+                '/TemplatesService.Templates/SearchTemplates',
+                request_serializer=templates__pb2.SearchRequest.SerializeToString,
+                response_deserializer=templates__pb2.TemplateSearchResult.FromString,
+                _registered_method=True)
+        self.SearchFeatures = channel.unary_unary(
+                '/TemplatesService.Templates/SearchFeatures',
+                request_serializer=templates__pb2.SearchRequest.SerializeToString,
+                response_deserializer=templates__pb2.FeatureSearchResult.FromString,
+                _registered_method=True)
+        self.Watch = channel.unary_stream(
+                '/TemplatesService.Templates/Watch',
+                request_serializer=templates__pb2.WatchRequest.SerializeToString,
+                response_deserializer=templates__pb2.ChangeEventsList.FromString,
+                _registered_method=True)
+        self.BulkImport = channel.stream_unary(
+                '/TemplatesService.Templates/BulkImport',
+                request_serializer=templates__pb2.BulkImportRecord.SerializeToString,
+                response_deserializer=templates__pb2.BulkImportSummary.FromString,
+                _registered_method=True)
 
 
 class TemplatesServicer(object):
@@ -141,6 +201,13 @@ class TemplatesServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def DeleteTemplates(self, request, context):
+        """Удаление многих шаблонов вместе со связями
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def CreateFeature(self, request, context):
         """Создание фичи +
         """
@@ -162,6 +229,27 @@ class TemplatesServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def DeleteFeatures(self, request, context):
+        """Удаление многих фич вместе со связями
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def BatchGetFeaturesByTemplateIds(self, request, context):
+        """Фичи многих шаблонов за один вызов
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetTemplatesByIds(self, request, context):
+        """Шаблоны по списку id
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def GetAllTemplates(self, request, context):
         """Получение всех шаблонов +
         """
@@ -169,6 +257,13 @@ class TemplatesServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def GetAllTemplatesIfModified(self, request, context):
+        """Все шаблоны, если список изменился после known_version, иначе not_modified
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def GetFeaturesByTemplateId(self, request, context):
         """Получение фичи по айди шаблона +
         """
@@ -176,6 +271,55 @@ class TemplatesServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamAllTemplates(self, request, context):
+        """Потоковое получение всех шаблонов пачками
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetTemplatesPage(self, request, context):
+        """Постраничное получение шаблонов, next_cursor пустой на последней странице
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def FindTemplates(self, request, context):
+        """Шаблоны по значениям фич: число в диапазоне, элементы списка; постранично
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SearchTemplates(self, request, context):
+        """Поиск шаблонов по имени и описанию
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SearchFeatures(self, request, context):
+        """Поиск фич по имени
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Watch(self, request, context):
+        """Поток изменений шаблонов, фич и связей начиная с since_seq
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def BulkImport(self, request_iterator, context):
+        """Массовая загрузка шаблонов, фич и связей одной транзакцией
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_TemplatesServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -209,6 +353,11 @@ def add_TemplatesServicer_to_server(servicer, server):
                     request_deserializer=templates__pb2.IdStruct.FromString,
                     response_serializer=templates__pb2.Empty.SerializeToString,
             ),
+            'DeleteTemplates': grpc.unary_unary_rpc_method_handler(
+                    servicer.DeleteTemplates,
+                    request_deserializer=templates__pb2.IdsRequest.FromString,
+                    response_serializer=templates__pb2.DeleteResult.SerializeToString,
+            ),
             'CreateFeature': grpc.unary_unary_rpc_method_handler(
                     servicer.CreateFeature,
                     request_deserializer=templates__pb2.FeatureStruct.FromString,
@@ -224,16 +373,71 @@ def add_TemplatesServicer_to_server(servicer, server):
                     request_deserializer=templates__pb2.IdStruct.FromString,
                     response_serializer=templates__pb2.Empty.SerializeToString,
             ),
+            'DeleteFeatures': grpc.unary_unary_rpc_method_handler(
+                    servicer.DeleteFeatures,
+                    request_deserializer=templates__pb2.IdsRequest.FromString,
+                    response_serializer=templates__pb2.DeleteResult.SerializeToString,
+            ),
+            'BatchGetFeaturesByTemplateIds': grpc.unary_unary_rpc_method_handler(
+                    servicer.BatchGetFeaturesByTemplateIds,
+                    request_deserializer=templates__pb2.IdsRequest.FromString,
+                    response_serializer=templates__pb2.BatchFeaturesResult.SerializeToString,
+            ),
+            'GetTemplatesByIds': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetTemplatesByIds,
+                    request_deserializer=templates__pb2.IdsRequest.FromString,
+                    response_serializer=templates__pb2.TemplatesByIdsResult.SerializeToString,
+            ),
             'GetAllTemplates': grpc.unary_unary_rpc_method_handler(
                     servicer.GetAllTemplates,
                     request_deserializer=templates__pb2.Empty.FromString,
                     response_serializer=templates__pb2.TemplatesList.SerializeToString,
             ),
+            'GetAllTemplatesIfModified': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetAllTemplatesIfModified,
+                    request_deserializer=templates__pb2.CatalogVersionRequest.FromString,
+                    response_serializer=templates__pb2.TemplatesSnapshot.SerializeToString,
+            ),
             'GetFeaturesByTemplateId': grpc.unary_unary_rpc_method_handler(
                     servicer.GetFeaturesByTemplateId,
                     request_deserializer=templates__pb2.IdStruct.FromString,
                     response_serializer=templates__pb2.HibridFeatureLinkTemplateList.SerializeToString,
             ),
+            'StreamAllTemplates': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamAllTemplates,
+                    request_deserializer=templates__pb2.StreamTemplatesRequest.FromString,
+                    response_serializer=templates__pb2.TemplatesList.SerializeToString,
+            ),
+            'GetTemplatesPage': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetTemplatesPage,
+                    request_deserializer=templates__pb2.TemplatesPageRequest.FromString,
+                    response_serializer=templates__pb2.TemplatesPage.SerializeToString,
+            ),
+            'FindTemplates': grpc.unary_unary_rpc_method_handler(
+                    servicer.FindTemplates,
+                    request_deserializer=templates__pb2.FindTemplatesRequest.FromString,
+                    response_serializer=templates__pb2.TemplatesPage.SerializeToString,
+            ),
+            'SearchTemplates': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchTemplates,
+                    request_deserializer=templates__pb2.SearchRequest.FromString,
+                    response_serializer=templates__pb2.TemplateSearchResult.SerializeToString,
+            ),
+            'SearchFeatures': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchFeatures,
+                    request_deserializer=templates__pb2.SearchRequest.FromString,
+                    response_serializer=templates__pb2.FeatureSearchResult.SerializeToString,
+            ),
+            'Watch': grpc.unary_stream_rpc_method_handler(
+                    servicer.Watch,
+                    request_deserializer=templates__pb2.WatchRequest.FromString,
+                    response_serializer=templates__pb2.ChangeEventsList.SerializeToString,
+            ),
+            'BulkImport': grpc.stream_unary_rpc_method_handler(
+                    servicer.BulkImport,
+                    request_deserializer=templates__pb2.BulkImportRecord.FromString,
+                    response_serializer=templates__pb2.BulkImportSummary.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'TemplatesService.Templates', rpc_method_handlers)
@@ -407,6 +611,33 @@ class Templates(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def DeleteTemplates(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/DeleteTemplates',
+            templates__pb2.IdsRequest.SerializeToString,
+            templates__pb2.DeleteResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def CreateFeature(request,
             target,
@@ -488,6 +719,87 @@ class Templates(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def DeleteFeatures(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/DeleteFeatures',
+            templates__pb2.IdsRequest.SerializeToString,
+            templates__pb2.DeleteResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def BatchGetFeaturesByTemplateIds(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/BatchGetFeaturesByTemplateIds',
+            templates__pb2.IdsRequest.SerializeToString,
+            templates__pb2.BatchFeaturesResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetTemplatesByIds(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/GetTemplatesByIds',
+            templates__pb2.IdsRequest.SerializeToString,
+            templates__pb2.TemplatesByIdsResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def GetAllTemplates(request,
             target,
@@ -515,6 +827,33 @@ class Templates(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def GetAllTemplatesIfModified(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/GetAllTemplatesIfModified',
+            templates__pb2.CatalogVersionRequest.SerializeToString,
+            templates__pb2.TemplatesSnapshot.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def GetFeaturesByTemplateId(request,
             target,
@@ -541,3 +880,192 @@ class Templates(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def StreamAllTemplates(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/TemplatesService.Templates/StreamAllTemplates',
+            templates__pb2.StreamTemplatesRequest.SerializeToString,
+            templates__pb2.TemplatesList.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetTemplatesPage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/GetTemplatesPage',
+            templates__pb2.TemplatesPageRequest.SerializeToString,
+            templates__pb2.TemplatesPage.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def FindTemplates(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/FindTemplates',
+            templates__pb2.FindTemplatesRequest.SerializeToString,
+            templates__pb2.TemplatesPage.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SearchTemplates(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/SearchTemplates',
+            templates__pb2.SearchRequest.SerializeToString,
+            templates__pb2.TemplateSearchResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SearchFeatures(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/TemplatesService.Templates/SearchFeatures',
+            templates__pb2.SearchRequest.SerializeToString,
+            templates__pb2.FeatureSearchResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Watch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/TemplatesService.Templates/Watch',
+            templates__pb2.WatchRequest.SerializeToString,
+            templates__pb2.ChangeEventsList.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def BulkImport(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/TemplatesService.Templates/BulkImport',
+            templates__pb2.BulkImportRecord.SerializeToString,
+            templates__pb2.BulkImportSummary.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
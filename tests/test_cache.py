@@ -0,0 +1,216 @@
+"""
+TemplateFeaturesCache и VersionedResponseCache без базы
+"""
+import pytest
+
+import cache
+from cache import ENTRY_OVERHEAD, TemplateFeaturesCache, VersionedResponseCache
+
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+
+def make_cache(max_entries=100, max_bytes=10 ** 6, ttl=60):
+    return TemplateFeaturesCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+
+
+
+def test_put_and_get():
+    features = make_cache()
+    assert features.Get(1) is None
+    features.Put(1, b"payload", [10, 11], features.BeginLoad())
+    assert features.Get(1) == b"payload"
+    stats = features.Stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["bytes"] == len(b"payload") + ENTRY_OVERHEAD
+
+
+
+def test_invalidation_during_load_rejects_put():
+    features = make_cache()
+    token = features.BeginLoad()
+    # пока ответ читался из базы, шаблон изменили
+    features.InvalidateTemplate(1)
+    features.Put(1, b"stale", [10], token)
+    assert features.Get(1) is None
+    assert features.Stats()["rejected"] == 1
+
+    features.Put(1, b"fresh", [10], features.BeginLoad())
+    assert features.Get(1) == b"fresh"
+
+
+
+def test_feature_invalidation_during_load_rejects_put():
+    features = make_cache()
+    token = features.BeginLoad()
+    features.InvalidateFeature(99)
+    features.Put(1, b"stale", [10], token)
+    assert features.Get(1) is None
+
+
+
+def test_invalidate_feature_drops_templates_with_it():
+    features = make_cache()
+    token = features.BeginLoad()
+    features.Put(1, b"a", [10, 11], token)
+    features.Put(2, b"b", [11], token)
+    features.Put(3, b"c", [12], token)
+    features.InvalidateFeature(11)
+    assert features.Get(1) is None
+    assert features.Get(2) is None
+    assert features.Get(3) == b"c"
+    assert features.Stats()["invalidations"] == 2
+
+
+
+def test_replaced_entry_keeps_byte_count():
+    features = make_cache()
+    features.Put(1, b"a" * 10, [10], features.BeginLoad())
+    features.Put(1, b"b" * 30, [11], features.BeginLoad())
+    assert features.Stats()["bytes"] == 30 + ENTRY_OVERHEAD
+    # старая фича больше не ссылается на шаблон
+    features.InvalidateFeature(10)
+    assert features.Get(1) == b"b" * 30
+
+
+
+def test_byte_limit_evicts_least_recently_used():
+    entry = 100 + ENTRY_OVERHEAD
+    features = make_cache(max_bytes=entry * 2)
+    token = features.BeginLoad()
+    features.Put(1, b"1" * 100, [], token)
+    features.Put(2, b"2" * 100, [], token)
+    features.Get(1)
+    features.Put(3, b"3" * 100, [], token)
+    assert features.Get(2) is None
+    assert features.Get(1) is not None
+    assert features.Get(3) is not None
+    stats = features.Stats()
+    assert stats["bytes"] == entry * 2
+    assert stats["evictions"] == 1
+
+
+
+def test_payload_over_byte_limit_is_not_cached():
+    features = make_cache(max_bytes=ENTRY_OVERHEAD + 10)
+    features.Put(1, b"x" * 11, [], features.BeginLoad())
+    assert features.Get(1) is None
+    assert features.Stats()["bytes"] == 0
+
+
+
+def test_entry_limit():
+    features = make_cache(max_entries=2)
+    token = features.BeginLoad()
+    for template_id in (1, 2, 3):
+        features.Put(template_id, b"x", [template_id * 10], token)
+    assert features.Get(1) is None
+    assert features.Stats()["entries"] == 2
+    # вытесненная запись убрана и из индекса по фичам
+    assert 10 not in features._by_feature
+
+
+
+def test_ttl(clock):
+    features = make_cache(ttl=5)
+    features.Put(1, b"x", [10], features.BeginLoad())
+    clock.now += 4.9
+    assert features.Get(1) == b"x"
+    clock.now += 0.2
+    assert features.Get(1) is None
+    stats = features.Stats()
+    assert (stats["expirations"], stats["entries"], stats["bytes"]) == (1, 0, 0)
+
+
+
+def test_disabled():
+    features = TemplateFeaturesCache(max_entries=10, max_bytes=10 ** 6, ttl=60, enabled=False)
+    features.Put(1, b"x", [], features.BeginLoad())
+    assert features.Get(1) is None
+    assert features.Stats()["misses"] == 0
+
+
+
+def test_clear():
+    features = make_cache()
+    token = features.BeginLoad()
+    features.Put(1, b"x", [10], token)
+    features.Clear()
+    assert features.Get(1) is None
+    features.Put(1, b"x", [10], token)
+    assert features.Get(1) is None
+    assert features.Stats()["bytes"] == 0
+
+
+
+def test_replica_read_behind_invalidation_is_rejected():
+    features = make_cache()
+    features.fence_clock = lambda: 100
+    features.InvalidateTemplate(1)
+    token = features.BeginLoad()
+    # реплика ещё не проиграла изменение, после которого сбросили кэш
+    features.Put(1, b"stale", [10], token, source_lsn=99)
+    assert features.Get(1) is None
+    features.Put(1, b"fresh", [10], token, source_lsn=100)
+    assert features.Get(1) == b"fresh"
+
+
+
+def test_feature_fence_applies_to_templates_with_feature():
+    features = make_cache()
+    features.fence_clock = lambda: 200
+    features.InvalidateFeature(10)
+    token = features.BeginLoad()
+    features.Put(1, b"a", [10], token, source_lsn=150)
+    features.Put(2, b"b", [20], token, source_lsn=150)
+    # с основной базы (source_lsn None) - всегда свежий ответ
+    features.Put(3, b"c", [10], token)
+    assert features.Get(1) is None
+    assert features.Get(2) == b"b"
+    assert features.Get(3) == b"c"
+
+
+
+def test_evicted_fences_raise_floor(monkeypatch):
+    monkeypatch.setattr(cache, "FENCE_LIMIT", 2)
+    features = make_cache()
+    lsn = iter((10, 20, 30))
+    features.fence_clock = lambda: next(lsn)
+    for template_id in (1, 2, 3):
+        features.InvalidateTemplate(template_id)
+    token = features.BeginLoad()
+    # метка шаблона 1 вытеснена, её LSN стал общим порогом
+    features.Put(4, b"x", [], token, source_lsn=9)
+    assert features.Get(4) is None
+    features.Put(4, b"x", [], token, source_lsn=10)
+    assert features.Get(4) == b"x"
+    features.Put(3, b"x", [], token, source_lsn=25)
+    assert features.Get(3) is None
+
+
+
+def test_versioned_cache_keeps_newest():
+    catalog = VersionedResponseCache()
+    catalog.Put(2, b"v2")
+    catalog.Put(1, b"v1")
+    assert catalog.Get(1) is None
+    assert catalog.Get(2) == b"v2"
+    catalog.Put(3, b"v3")
+    assert catalog.Get(3) == b"v3"
+    assert catalog.Stats()["version"] == 3
@@ -0,0 +1,150 @@
+"""
+LSN и выбор реплики без базы: проверки реплик подменены
+"""
+import pytest
+
+import replicas
+from replicas import CaughtUp, FormatLsn, ParseLsn, Replica
+
+
+
+@pytest.mark.parametrize("text, lsn", [
+    ("0/0", 0),
+    ("0/16B3748", 0x16B3748),
+    ("16/B374D848", (0x16 << 32) | 0xB374D848),
+    ("ffffffff/ffffffff", 2 ** 64 - 1),
+])
+def test_parse_lsn(text, lsn):
+    assert ParseLsn(text) == lsn
+    assert ParseLsn(FormatLsn(lsn)) == lsn
+
+
+
+def test_parse_lsn_empty_and_numbers():
+    assert ParseLsn("") == 0
+    assert ParseLsn(None) == 0
+    # asyncpg отдаёт pg_lsn числом
+    assert ParseLsn(12345) == 12345
+
+
+
+@pytest.mark.parametrize("text", ["zzz", "16", "G/1", "1/"])
+def test_parse_lsn_rejects_garbage(text):
+    with pytest.raises(ValueError):
+        ParseLsn(text)
+
+
+
+def test_format_lsn():
+    assert FormatLsn(0) == "0/0"
+    assert FormatLsn((0x16 << 32) | 0xB374D848) == "16/B374D848"
+
+
+
+def test_caught_up():
+    # без токена годится любая реплика, с токеном - проигравшая его
+    assert CaughtUp(0, 0)
+    assert not CaughtUp(99, 100)
+    assert CaughtUp(100, 100)
+    assert CaughtUp(101, 100)
+
+
+
+class FakeReplica(Replica):
+
+    def __init__(self, index, replay_lsn, checks=()):
+        super().__init__(index, f"postgresql://replica{index}")
+        self.healthy = True
+        self.replay_lsn = replay_lsn
+        self._checks = list(checks)
+        self.checked = 0
+
+    def Check(self):
+        self.checked += 1
+        self.checked_at = replicas.time.monotonic()
+        return self.Observe(self._checks.pop(0) if self._checks else self.replay_lsn)
+
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = []
+    monkeypatch.setattr(replicas, "replicas", pool)
+    monkeypatch.setattr(replicas, "wait", 0.05)
+    return pool
+
+
+
+def pick(required):
+    token = replicas.min_lsn.set(required)
+    try:
+        return replicas.Pick()
+    finally:
+        replicas.min_lsn.reset(token)
+
+
+
+def test_pick_without_token_takes_lagging_replica(pool, monkeypatch):
+    lagging = FakeReplica(1, 10)
+    pool.append(lagging)
+    # процесс знает о фиксациях дальше реплики, но клиент их не ждёт
+    monkeypatch.setattr(replicas, "known_lsn", 1000)
+    assert pick(0) is lagging
+    assert lagging.checked == 0
+
+
+
+def test_pick_waits_for_token(pool):
+    replica = FakeReplica(1, 10, checks=[10, 50, 100])
+    pool.append(replica)
+    assert pick(100) is replica
+    assert replica.replay_lsn == 100
+
+
+
+def test_pick_falls_back_to_primary(pool):
+    fallbacks = replicas.fallbacks
+    pool.append(FakeReplica(1, 10))
+    assert pick(100) is None
+    assert replicas.fallbacks == fallbacks + 1
+
+
+
+def test_pick_prefers_caught_up_replica(pool):
+    pool.extend([FakeReplica(1, 10), FakeReplica(2, 500)])
+    for _ in range(4):
+        assert pick(100).name == "replica2"
+    assert pool[0].checked == 0
+
+
+
+def test_poll_shares_checks_within_step():
+    replica = FakeReplica(1, 10)
+    replica.Poll()
+    replica.Poll()
+    assert replica.checked == 1
+
+
+
+def test_unhealthy_replica_leaves_rotation(pool):
+    broken = FakeReplica(1, 10)
+
+    def fail():
+        raise OSError("connection refused")
+
+    broken.Check = fail
+    pool.append(broken)
+    assert pick(100) is None
+    assert not broken.healthy
+
+
+
+def test_track_reads_keeps_oldest_source(pool):
+    pool.extend([FakeReplica(1, 300), FakeReplica(2, 200)])
+    with replicas.TrackReads() as sources:
+        pick(0)
+        pick(0)
+    assert sources.lsn == 200
+    with replicas.TrackReads() as sources:
+        replicas._count(None)
+    assert sources.lsn is None
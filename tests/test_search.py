@@ -0,0 +1,113 @@
+"""
+TrigramIndex поиска в памяти без базы
+"""
+import pytest
+
+from search import FUZZY_THRESHOLD, Similarity, TrigramIndex, Trigrams
+
+
+
+@pytest.fixture
+def index():
+    index = TrigramIndex(("name", "description"))
+    index.Load([
+        {"id": 1, "name": "Ноутбук игровой", "description": "мощная видеокарта"},
+        {"id": 2, "name": "Ноутбук офисный", "description": "лёгкий"},
+        {"id": 3, "name": "Монитор", "description": "для ноутбука"},
+        {"id": 4, "name": "notebook", "description": ""},
+        {"id": 5, "name": "Notebook Pro", "description": None},
+    ])
+    return index
+
+
+
+def ids(results):
+    return [record["id"] for record, _ in results]
+
+
+
+def test_trigrams_like_pg_trgm():
+    assert Trigrams("ab") == {"  a", " ab", "ab "}
+    # регистр и знаки не важны, каждое слово отдельно
+    assert Trigrams("A-b") == {"  a", " a ", "  b", " b "}
+    assert Trigrams("") == set()
+    assert Trigrams(None) == set()
+
+
+
+def test_similarity():
+    assert Similarity(Trigrams("notebook"), Trigrams("Notebook")) == 1.0
+    assert Similarity(Trigrams("abc"), Trigrams("xyz")) == 0.0
+    assert Similarity(set(), Trigrams("abc")) == 0.0
+    shared = Trigrams("word") & Trigrams("words")
+    assert Similarity(Trigrams("word"), Trigrams("words")) == len(shared) / len(Trigrams("word") | Trigrams("words"))
+
+
+
+def test_prefix_alphabetical_with_limit(index):
+    assert ids(index.Search("ноут", "prefix", 10)) == [1, 2]
+    assert ids(index.Search("NOTE", "prefix", 10)) == [4, 5]
+    assert ids(index.Search("note", "prefix", 1)) == [4]
+    assert index.Search("zzz", "prefix", 10) == []
+
+
+
+def test_substring_searches_all_fields(index):
+    # в описании монитора, в имени ноутбуков
+    assert set(ids(index.Search("ноутбук", "substring", 10))) == {1, 2, 3}
+    assert ids(index.Search("видеокарт", "substring", 10)) == [1]
+
+
+
+def test_substring_ranked_by_name_similarity(index):
+    results = index.Search("ноутбук", "substring", 10)
+    # у монитора совпадение только в описании - сходство имени ниже
+    assert ids(results)[-1] == 3
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+
+def test_short_substring_scans_records(index):
+    # короче триграммы - без индекса, перебором
+    assert set(ids(index.Search("ук", "substring", 10))) == {1, 2, 3}
+    assert set(ids(index.Search("ro", "substring", 10))) == {5}
+
+
+
+def test_fuzzy_ranking_and_threshold(index):
+    results = index.Search("notebok", "fuzzy", 10)
+    assert ids(results)[0] == 4
+    assert 5 in ids(results)
+    assert all(score >= FUZZY_THRESHOLD for _, score in results)
+    assert index.Search("монитор", "fuzzy", 10)[0][1] == 1.0
+    assert index.Search("xyzzy", "fuzzy", 10) == []
+    assert index.Search("", "fuzzy", 10) == []
+
+
+
+def test_fuzzy_ties_ordered_by_id():
+    index = TrigramIndex(("name",))
+    index.Load([{"id": record_id, "name": "alpha"} for record_id in (7, 3, 5)])
+    assert ids(index.Search("alpha", "fuzzy", 2)) == [3, 5]
+
+
+
+def test_put_replaces_record(index):
+    index.Put({"id": 4, "name": "планшет", "description": ""})
+    assert ids(index.Search("note", "prefix", 10)) == [5]
+    assert ids(index.Search("план", "prefix", 10)) == [4]
+    assert 4 not in ids(index.Search("notebook", "fuzzy", 10))
+    assert len(index) == 5
+
+
+
+def test_remove(index):
+    index.Remove(1)
+    index.Remove(100)
+    assert ids(index.Search("ноут", "prefix", 10)) == [2]
+    assert ids(index.Search("видеокарт", "substring", 10)) == []
+    assert len(index) == 4
+    # триграммы удалённой записи не остаются в индексах
+    assert all(1 not in record_ids for record_ids in index._postings.values())
+    assert all(1 not in record_ids for record_ids in index._name_postings.values())
@@ -0,0 +1,208 @@
+"""
+Групповая запись: мелкие изменения из разных RPC одной транзакцией (group commit).
+
+Вызовы Submit(op), пришедшие одновременно, собираются в течение WRITE_BATCH_WINDOW_MS и уходят
+в базу одним вызовом apply_many(ops) -> [результат или исключение по каждой op]: многострочные запросы
+и один COMMIT на пачку вместо своего на каждый вызов. Каждый вызов получает свой результат или ошибку.
+Первый вызов пачки ждёт окно и выполняет её, пачка уходит сразу, набрав WRITE_BATCH_MAX операций.
+
+Пачка, как и у loader, выполняется в контексте db.BatchContext своих вызовов: с самым ранним
+из их дедлайнов, отменяется, только когда отменены все.
+
+Настройки:
+    WRITE_BATCH_WINDOW_MS  - окно сбора пачки, 0 - каждая запись своей транзакцией (0)
+    WRITE_BATCH_MAX        - операций в пачке не больше (100)
+"""
+from concurrent import futures
+import contextvars
+import threading
+import asyncio
+import logging
+import os
+
+import db
+
+logger = logging.getLogger(__name__)
+
+
+window = float(os.getenv('WRITE_BATCH_WINDOW_MS') or 0) / 1000
+max_batch = int(os.getenv('WRITE_BATCH_MAX') or 100)
+
+
+
+def _resolve(ops, results, set_result, set_exception):
+    """
+    Раздаёт результаты пачки вызовам: исключение в результатах - ошибка только этой операции
+    """
+    for (_, future), result in zip(ops, results):
+        if isinstance(result, Exception):
+            set_exception(future, result)
+        else:
+            set_result(future, result)
+
+
+
+class _Batch:
+
+    def __init__(self):
+        self.ops = []
+        # contextvars.copy_context() вызовов, см. db.BatchContext
+        self.contexts = []
+        self.full = threading.Event()
+
+
+
+class GroupWriter:
+    """
+    Для пула потоков (grpc.server): Submit блокирует поток вызова до фиксации пачки
+    """
+    def __init__(self, name, apply_many, window=window, max_batch=max_batch):
+        self.name = name
+        self.apply_many = apply_many
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._batch = None
+        self.batches = 0
+        self.ops = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def Submit(self, op):
+        leader = False
+        future = futures.Future()
+        with self._lock:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _Batch()
+                leader = True
+            batch.ops.append((op, future))
+            batch.contexts.append(contextvars.copy_context())
+            if len(batch.ops) >= self.max_batch:
+                self._batch = None
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            context, scope = db.BatchContext(batch.contexts)
+            try:
+                context.run(self._dispatch, batch.ops)
+            finally:
+                scope.Close()
+        return future.result()
+
+    def _dispatch(self, ops):
+        with self._lock:
+            self.batches += 1
+            self.ops += len(ops)
+        try:
+            results = self.apply_many([op for op, _ in ops])
+            _resolve(ops, results, futures.Future.set_result, futures.Future.set_exception)
+        except Exception as e:
+            for _, future in ops:
+                if not future.done():
+                    future.set_exception(e)
+
+    def Stats(self):
+        return {"batches": self.batches, "ops": self.ops}
+
+
+
+class _AsyncBatch:
+
+    def __init__(self):
+        self.ops = []
+        self.contexts = []
+        # вызовов, ещё ждущих результат
+        self.waiters = 0
+        self.task = None
+
+
+
+class AsyncGroupWriter:
+    """
+    Для grpc.aio: apply_many - корутина, пачка выполняется отдельной задачей event loop
+    """
+    def __init__(self, name, apply_many, window=window, max_batch=max_batch):
+        self.name = name
+        self.apply_many = apply_many
+        self.window = window
+        self.max_batch = max_batch
+        self._batch = None
+        self._timer = None
+        self.batches = 0
+        self.ops = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    async def Submit(self, op):
+        loop = asyncio.get_running_loop()
+        batch = self._batch
+        if batch is None:
+            batch = self._batch = _AsyncBatch()
+            self._timer = loop.call_later(self.window, self._flush, batch)
+        future = loop.create_future()
+        batch.ops.append((op, future))
+        batch.contexts.append(contextvars.copy_context())
+        batch.waiters += 1
+        if len(batch.ops) >= self.max_batch:
+            self._timer.cancel()
+            self._flush(batch)
+        try:
+            # shield: отменённый вызов не отменяет запись остальных, а его операция всё равно уходит в пачке
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            batch.waiters -= 1
+            # отменены все вызовы - как и одиночная запись отменённого RPC, пачка прерывается
+            if not batch.waiters and batch.task is not None:
+                batch.task.cancel()
+            raise
+
+    def _flush(self, batch):
+        if self._batch is batch:
+            self._batch = self._timer = None
+        context, scope = db.BatchContext(batch.contexts)
+        batch.task = context.run(asyncio.ensure_future, self._dispatch(batch.ops))
+        batch.task.add_done_callback(lambda _: scope.Close())
+
+    async def _dispatch(self, ops):
+        self.batches += 1
+        self.ops += len(ops)
+        try:
+            results = await self.apply_many([op for op, _ in ops])
+            _resolve(ops, results, _set_result, _set_exception)
+        except Exception as e:
+            for _, future in ops:
+                _set_exception(future, e)
+
+    def Stats(self):
+        return {"batches": self.batches, "ops": self.ops}
+
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+
+def _set_exception(future, e):
+    if not future.done():
+        future.set_exception(e)
+
+
+
+# писатели процесса по имени, их читают метрики
+writers = {}
+
+
+
+def Register(writer):
+    writers[writer.name] = writer
+    return writer